@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -46,17 +47,26 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 ]
 
+# MetricsMiddleware comes first so that it times the whole request.
+# The voters.middleware classes are the Django middleware of the same name,
+# skipped for API requests when LEAN_API_MIDDLEWARE is on. Only paths under
+# FULL_MIDDLEWARE_PATH_PREFIXES (the admin) get the full browser stack.
 MIDDLEWARE_CLASSES = [
+    'voters.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'voters.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'voters.middleware.CsrfViewMiddleware',
+    'voters.middleware.AuthenticationMiddleware',
+    'voters.middleware.SessionAuthenticationMiddleware',
+    'voters.middleware.MessageMiddleware',
+    'voters.middleware.XFrameOptionsMiddleware',
 ]
 
+LEAN_API_MIDDLEWARE = True
+
+FULL_MIDDLEWARE_PATH_PREFIXES = ['/admin/']
+
 ROOT_URLCONF = 'Voter_API.urls'
 
 TEMPLATES = [
@@ -85,9 +95,168 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Reuse connections across requests instead of reopening per request
+        'CONN_MAX_AGE': 300,
+    }
+}
+
+# Applied to every new SQLite connection by voters.sqlite, in this order.
+SQLITE_PRAGMAS = [
+    ('journal_mode', 'WAL'),       # readers don't block on writers
+    ('synchronous', 'NORMAL'),     # fsync at checkpoints, not every commit
+    ('busy_timeout', 5000),        # ms to wait for the write lock
+    ('cache_size', -64000),        # 64MB page cache
+    ('mmap_size', 268435456),      # 256MB memory-mapped I/O
+    ('temp_store', 'MEMORY'),
+]
+
+# Read replicas
+# Read-only API views read from a random replica in DATABASE_REPLICAS via
+# voters.replicas.ReplicaRouter. After a write, a client (X-Client-Id
+# header, or its address) reads from the primary for READ_YOUR_WRITES_SECONDS.
+# For local use, VOTER_DB_REPLICAS lists SQLite files separated by os.pathsep,
+# kept up to date by `manage.py sync_replicas`.
+
+REPLICA_PATHS = [path for path in os.environ.get('VOTER_DB_REPLICAS', '').split(os.pathsep) if path]
+
+for number, path in enumerate(REPLICA_PATHS, 1):
+    DATABASES['replica%d' % number] = dict(DATABASES['default'], NAME=path,
+                                           TEST={'MIRROR': 'default'})
+
+DATABASE_REPLICAS = ['replica%d' % number for number in range(1, len(REPLICA_PATHS) + 1)]
+
+READ_YOUR_WRITES_SECONDS = 10
+
+# Sharding
+# With shards, each constituency's stations, voters and turnout counters live
+# in one of DATABASE_SHARDS, picked by voters.shards.ShardRouter; 'default'
+# keeps parties, candidates and the constituency list. For local use,
+# VOTER_DB_SHARDS lists SQLite files separated by os.pathsep; set it before
+# the first migrate and run `manage.py migrate --database shardN` for each.
+# Shards and replicas are mutually exclusive: with both, replica_reads views
+# would still read sharded models from the shard primaries, so the voters
+# app refuses to start with both (voters.shards.check_settings).
+
+SHARD_PATHS = [path for path in os.environ.get('VOTER_DB_SHARDS', '').split(os.pathsep) if path]
+
+for number, path in enumerate(SHARD_PATHS, 1):
+    DATABASES['shard%d' % number] = dict(DATABASES['default'], NAME=path)
+
+DATABASE_SHARDS = ['shard%d' % number for number in range(1, len(SHARD_PATHS) + 1)]
+
+DATABASE_ROUTERS = ['voters.shards.ShardRouter', 'voters.replicas.ReplicaRouter']
+
+
+# API keys
+# Role -> list of accepted 'Authorization' header values. Each role's keys
+# can be replaced through VOTER_API_<ROLE>_KEYS (one key per line), so keys
+# can be rotated or added without a code change.
+
+def api_keys(role, default=None):
+    keys = os.environ.get('VOTER_API_%s_KEYS' % role.upper())
+    if keys:
+        return keys.splitlines()
+    return [default] if default else []
+
+API_KEYS = {
+    'station': api_keys('station', 'Basic uYx%mfq;XglNP^G1OSKv/]z=!S!K*y'),
+    'booth': api_keys('booth', 'Basic *qGf_P$@mokuQhOaV1^q5}*WfX]3FU'),
+    'voter': api_keys('voter', 'Basic 8Pqv^>#aU68x(Lcg$e>Oz++@/\"UJ.~'),
+    'results': api_keys('results', 'Basic XMEtV5S]"Bok-<{W4\'2g7h7}>kkjfy'),
+    'pins': api_keys('pins', 'Basic ;]u->is/1r]VrzL4v.HuT/@}>>@95_'),
+    'outcome': api_keys('outcome', 'Basic Mk~@9e{xTM3k11(SW-C|VUeB_.aijg'),
+    'audit': api_keys('audit'),
+    'monitoring': api_keys('monitoring'),
+}
+
+
+# Caches
+# get_candidates responses are cached per constituency and invalidated by
+# model signals. Use a cache shared by all workers (e.g. memcached) in
+# production so that invalidations reach every process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+CANDIDATES_CACHE_TIMEOUT = 60 * 60
+
+# voter_turnout and get_candidates bodies are also kept in each worker's
+# memory for MICRO_CACHE_SECONDS (0 disables), and served for a further
+# MICRO_CACHE_STALE_SECONDS while one request recomputes them.
+
+MICRO_CACHE_SECONDS = float(os.environ.get('VOTER_API_MICRO_CACHE_SECONDS', 0))
+
+MICRO_CACHE_STALE_SECONDS = float(os.environ.get('VOTER_API_MICRO_CACHE_STALE_SECONDS', 0))
+
+
+# Metrics
+# Each worker writes its request metrics to METRICS_DIR at most every
+# METRICS_FLUSH_SECONDS; /metrics (monitoring role) serves the sum over all
+# running workers in the Prometheus text format (the files of exited workers
+# are deleted, so the counters drop, i.e. reset, when a worker exits).
+# METRICS_DIR must be private to this deployment and host, and is best kept
+# on a tmpfs.
+
+METRICS_DIR = os.environ.get('VOTER_API_METRICS_DIR',
+                             os.path.join(tempfile.gettempdir(), 'voter-api-metrics'))
+
+METRICS_FLUSH_SECONDS = 5
+
+
+# Voter bitmap
+# check_votable answers from a memory-mapped bitmap of the used_vote and
+# active_pin flags at VOTER_BITMAP_PATH, shared by all workers (keep it on
+# local disk or tmpfs). Each worker rebuilds it from the database as it
+# starts unless it was rebuilt in the last VOTER_BITMAP_MAX_AGE seconds;
+# `manage.py rebuild_voter_bitmap` rebuilds it by hand. Unset to disable.
+# Only processes on this host with the setting keep it up to date: run the
+# API workers, importers and any other process writing voters with the same
+# VOTER_API_BITMAP_PATH on one host, and rebuild the bitmap after writing
+# voters from anywhere else. Voters missing from it are read from the
+# database, so a stale bitmap can never hide a voter.
+
+VOTER_BITMAP_PATH = os.environ.get('VOTER_API_BITMAP_PATH')
+
+VOTER_BITMAP_MAX_AGE = 300
+
+
+# Batch endpoints
+# Upper bound on the number of voter ids accepted in one batch request;
+# each batch is resolved with a single IN query.
+
+VOTER_BATCH_MAX_SIZE = 500
+
+# List pagination
+# List endpoints (get_voters) return a single keyset page, ordered by id,
+# when the client passes page_size or a cursor: LIST_PAGE_SIZE rows if only
+# a cursor is given, and never more than LIST_PAGE_MAX_SIZE.
+
+LIST_PAGE_SIZE = 100
+
+LIST_PAGE_MAX_SIZE = 1000
+
+# Turnout history
+# turnout_history serves the last TURNOUT_HISTORY_DEFAULT_SECONDS unless the
+# client gives a range, which may span at most TURNOUT_HISTORY_MAX_SECONDS.
+# The history is recorded by `manage.py record_turnout_history --interval 60`.
+
+TURNOUT_HISTORY_DEFAULT_SECONDS = 60 * 60
+
+TURNOUT_HISTORY_MAX_SECONDS = 24 * 60 * 60
+
+# Group commit
+# With a window set, concurrent single-voter make_voter_ineligible and
+# set_voter_has_active_pin calls in a worker are collected for up to
+# GROUP_COMMIT_WINDOW_MS (or GROUP_COMMIT_MAX_BATCH calls) and committed in
+# one transaction. Each call still waits for the commit. 0 disables.
+
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('VOTER_API_GROUP_COMMIT_WINDOW_MS', 0))
+
+GROUP_COMMIT_MAX_BATCH = 64
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -14,3 +14,6 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Voter_API.settings")
 
 application = get_wsgi_application()
+
+from voters.bitmap import load_voter_bitmap  # noqa: E402
+load_voter_bitmap()
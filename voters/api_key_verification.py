@@ -1,22 +1,77 @@
-from django.http import JsonResponse, HttpResponse, HttpResponseForbidden
+import hashlib
 
-UNAUTHORIZED_CODE = 401
+from functools import wraps
 
-STATION_KEY = 'Basic uYx%mfq;XglNP^G1OSKv/]z=!S!K*y'
-BOOTH_KEY = 'Basic *qGf_P$@mokuQhOaV1^q5}*WfX]3FU'
-VOTER_KEY = 'Basic 8Pqv^>#aU68x(Lcg$e>Oz++@/\"UJ.~'
-RESULTS_KEY = 'Basic XMEtV5S]"Bok-<{W4\'2g7h7}>kkjfy'
-PINS_KEY = 'Basic ;]u->is/1r]VrzL4v.HuT/@}>>@95_'
-OUTCOME_KEY = 'Basic Mk~@9e{xTM3k11(SW-C|VUeB_.aijg'
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils import six
 
+UNAUTHORIZED_CODE = 401
 
-def verify(verif):
+# Roles, as bits of a role mask
+STATION = 1 << 0
+BOOTH = 1 << 1
+VOTER = 1 << 2
+RESULTS = 1 << 3
+PINS = 1 << 4
+OUTCOME = 1 << 5
+AUDIT = 1 << 6
+MONITORING = 1 << 7
+
+ROLES = {
+    'station': STATION,
+    'booth': BOOTH,
+    'voter': VOTER,
+    'results': RESULTS,
+    'pins': PINS,
+    'outcome': OUTCOME,
+    'audit': AUDIT,
+    'monitoring': MONITORING,
+}
+
+# Key digest -> role mask, built from settings.API_KEYS by load_api_keys().
+# Keys are looked up by their SHA-256 digest, so neither the dict lookup nor
+# its timing ever compares the secret itself.
+_key_roles = {}
+
+
+def _digest(key):
+    return hashlib.sha256(key.encode('utf-8')).digest()
+
+
+def load_api_keys():
+    key_roles = {}
+    for role, keys in settings.API_KEYS.items():
+        if isinstance(keys, six.string_types):
+            keys = [keys]
+        for key in keys:
+            digest = _digest(key)
+            key_roles[digest] = key_roles.get(digest, 0) | ROLES[role]
+    global _key_roles
+    _key_roles = key_roles
+
+
+@receiver(setting_changed)
+def reload_api_keys(setting, **kwargs):
+    if setting == 'API_KEYS':
+        load_api_keys()
+
+
+def key_roles(key):
+    """The role mask granted to an API key, 0 for unknown keys."""
+    return _key_roles.get(_digest(key), 0)
+
+
+def verify(roles):
     def perform(func):
+        @wraps(func)
         def inner(request, **kwargs):
-            # Does the user have an API key? (should also check they key is valid)
+            # Does the user have an API key?
             if 'HTTP_AUTHORIZATION' in request.META:
-                # Does the user have appropriate permissions?
-                if verif()(request.META['HTTP_AUTHORIZATION']):
+                # Does the key grant any of the roles the view accepts?
+                if key_roles(request.META['HTTP_AUTHORIZATION']) & roles:
                     return func(request, **kwargs)
                 return HttpResponseForbidden()
             return HttpResponse(status=UNAUTHORIZED_CODE)
@@ -24,70 +79,62 @@ def verify(verif):
     return perform
 
 
-def is_station(key):
-    return key == STATION_KEY
-
-
-def is_booth(key):
-    return key == BOOTH_KEY
-
-
-def is_voter(key):
-    return key == VOTER_KEY
-
-
-def is_results(key):
-    return key == RESULTS_KEY
+def has_roles(key, roles):
+    return bool(key_roles(key) & roles)
 
 
-def is_pins(key):
-    return key == PINS_KEY
+# Voter-API Roles #
 
 
-def is_outcome(key):
-    return key == OUTCOME_KEY
+SET_VOTER_HAS_ACTIVE_PIN_ROLES = PINS
+CHECK_VOTABLE_ROLES = PINS | BOOTH
+GET_VOTERS_ROLES = STATION
+MAKE_VOTER_INELIGIBLE_ROLES = PINS
+GET_CANDIDATES_ROLES = BOOTH
+EXPORT_ROLES = AUDIT | RESULTS
+METRICS_ROLES = MONITORING
 
 
 # Voter-API Check Functions #
 
 
 def has_set_voter_has_active_pin_permissions(key):
-    return is_pins(key)
+    return has_roles(key, SET_VOTER_HAS_ACTIVE_PIN_ROLES)
 
 
 def has_check_votable_permissions(key):
-    return is_pins(key) or is_booth(key)
+    return has_roles(key, CHECK_VOTABLE_ROLES)
 
 
 def has_get_voters_permissions(key):
-    return is_station(key)
+    return has_roles(key, GET_VOTERS_ROLES)
 
 
 def has_make_voter_ineligible_permissions(key):
-    return is_pins(key)
+    return has_roles(key, MAKE_VOTER_INELIGIBLE_ROLES)
 
 
 def has_get_candidates_permissions(key):
-    return is_booth(key)
+    return has_roles(key, GET_CANDIDATES_ROLES)
 
 
 # PAPI Check Functions #
 
 
 def has_get_pin_code_permissions(key):
-    return is_station(key)
+    return has_roles(key, STATION)
 
 
 def has_verify_and_check_eligibility_permissions(key):
-    return is_results(key) or is_booth(key)
+    return has_roles(key, RESULTS | BOOTH)
 
 
 def has_verify_and_make_ineligibile_permissions(key):
-    return is_results(key)
+    return has_roles(key, RESULTS)
 
 
 # Results Check Functions #
 
 
 def has_vote_permissions(key):
-    return is_booth(key)
+    return has_roles(key, BOOTH)
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class VotersConfig(AppConfig):
     name = 'voters'
+
+    def ready(self):
+        from . import metrics, replicas, shards, signals, sqlite  # noqa: F401
+        from .api_key_verification import load_api_keys
+        load_api_keys()
+        shards.check_settings()
@@ -0,0 +1,67 @@
+"""Shared helpers for the benchmark management commands."""
+from __future__ import division
+
+from contextlib import contextmanager
+from timeit import default_timer
+
+from django.db import connection
+
+# Host accepted by ALLOWED_HOSTS for requests made with the test client
+SERVER_NAME = 'localhost'
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(durations):
+    """Latency and throughput figures for a list of durations in seconds."""
+    ordered = sorted(durations)
+    total = sum(ordered)
+    return {
+        'requests': len(ordered),
+        'mean_ms': 1000 * total / len(ordered) if ordered else 0.0,
+        'p50_ms': 1000 * percentile(ordered, 0.50),
+        'p95_ms': 1000 * percentile(ordered, 0.95),
+        'p99_ms': 1000 * percentile(ordered, 0.99),
+        'per_second': len(ordered) / total if total else 0.0,
+    }
+
+
+def time_calls(func, repeat):
+    """Call func repeat times and return the duration of each call."""
+    durations = []
+    for _ in range(repeat):
+        start = default_timer()
+        func()
+        durations.append(default_timer() - start)
+    return durations
+
+
+def format_summary(label, summary):
+    return ('%(label)-40s n=%(requests)-6d mean=%(mean_ms)8.3fms p50=%(p50_ms)8.3fms '
+            'p95=%(p95_ms)8.3fms p99=%(p99_ms)8.3fms %(per_second)9.1f/s'
+            % dict(summary, label=label))
+
+
+@contextmanager
+def temporary_database(name=None):
+    """
+    Run the block against a freshly migrated throwaway database, the same
+    way the test runner does, so benchmarks never write to real data. For
+    SQLite pass a file name when several threads must share the database.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    previous_test_name = test_settings.get('NAME')
+    if name is not None:
+        test_settings['NAME'] = name
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection.settings_dict['NAME']
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = previous_test_name
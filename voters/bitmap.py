@@ -0,0 +1,337 @@
+"""
+Memory-mapped voter flags for check_votable.
+
+For every voter primary key the file at settings.VOTER_BITMAP_PATH (one
+file per shard, see voter_bitmap()) holds
+three bits: the voter exists, has used their vote, has an active PIN. The
+bits of eight consecutive voters share three adjacent bytes, so 50M voters
+take under 19MB. Every worker maps the same file, so a flag written by one
+worker is seen by all of them without touching the database.
+
+Writes follow the database: the VoterManager flag updates, Voter saves and
+deletes, and insert_voters() update the bitmap once their transaction has
+committed. Writers serialize on a lock file (fcntl) plus a thread lock;
+readers take no lock. Remaps swap in a new map under the thread lock and
+never close the old one, which readers may still be using. rebuild() scans the Voter table into a new file and
+swaps it in, flagging the old file as stale so that the other workers
+remap. Voters beyond the file's capacity are unknown (lookup() returns
+None) until a write grows the file.
+
+The bitmap is only ever trusted for voters it marks as existing: callers
+ask the database about every other id. It can only follow writes made by
+processes on this host with VOTER_BITMAP_PATH set; Voter QuerySet.update()
+calls on the flags (admin actions, scripts) drop the voters they touch
+from it. Writes from anywhere else (another host, a process without the
+setting, raw SQL) need `manage.py rebuild_voter_bitmap` afterwards.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .shards import all_shards, id_base, shard_for_id
+
+MAGIC = b'VBM1'
+# magic, stale flag, capacity (voters), build time
+HEADER = struct.Struct('<4sB3xQd')
+STALE_OFFSET = 4
+
+EXISTS, USED_VOTE, ACTIVE_PIN = range(3)
+PLANES = {'used_vote': USED_VOTE, 'active_pin': ACTIVE_PIN}
+BYTES_PER_GROUP = 3  # one byte per flag for each group of eight voters
+
+
+def file_size(capacity):
+    return HEADER.size + capacity // 8 * BYTES_PER_GROUP
+
+
+def round_capacity(voters):
+    return (voters // 8 + 1) * 8
+
+
+# One mapping of the file: the map itself and the header it was opened with
+Mapping = namedtuple('Mapping', ['map', 'capacity', 'built_at', 'pid'])
+
+
+class VoterBitmap(object):
+
+    def __init__(self, path):
+        self.path = path
+        # Guards writes and remaps. Re-entrant, as writers remap while
+        # holding it.
+        self._thread_lock = threading.RLock()
+        self._mapping = None
+        self._lock_file = None
+        self._lock_pid = None
+
+    @property
+    def capacity(self):
+        mapping = self._mapping
+        return mapping.capacity if mapping is not None else 0
+
+    @property
+    def built_at(self):
+        mapping = self._mapping
+        return mapping.built_at if mapping is not None else 0.0
+
+    # Mapping #
+
+    def _open(self, seen=None):
+        """
+        Map the file again and return the new Mapping, or None if there is
+        no valid bitmap file. seen is the mapping the caller found out of
+        date; if another thread has remapped since, its mapping is used.
+        The old map is never closed here: readers on other threads may
+        still be reading it, and it is unmapped once the last of them drops
+        it.
+        """
+        with self._thread_lock:
+            mapping = self._mapping
+            if seen is not None and mapping is not seen and mapping is not None and \
+                    mapping.pid == os.getpid():
+                return mapping
+            try:
+                with open(self.path, 'r+b') as bitmap_file:
+                    bitmap = mmap.mmap(bitmap_file.fileno(), 0)
+            except (IOError, OSError, ValueError):
+                self._mapping = None
+                return None
+            magic, _, capacity, built_at = HEADER.unpack(bitmap[:HEADER.size])
+            if magic != MAGIC or len(bitmap) < file_size(capacity):
+                self._mapping = None
+                return None
+            self._mapping = Mapping(bitmap, capacity, built_at, os.getpid())
+            return self._mapping
+
+    def _current(self):
+        """The up-to-date Mapping, or None if there is no bitmap file."""
+        mapping = self._mapping
+        if mapping is None or mapping.pid != os.getpid() or \
+                mapping.map[STALE_OFFSET:STALE_OFFSET + 1] != b'\x00':
+            return self._open(mapping)
+        return mapping
+
+    def close(self):
+        # Dropped rather than closed, for the same reason as in _open()
+        self._mapping = None
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            if self._lock_file is None or self._lock_pid != os.getpid():
+                directory = os.path.dirname(os.path.abspath(self.path))
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                self._lock_file = open(self.path + '.lock', 'a')
+                self._lock_pid = os.getpid()
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    # Reading #
+
+    def lookup(self, voter_id):
+        """
+        (exists, used_vote, active_pin) for a voter, or None if the bitmap
+        cannot answer and the database has to.
+        """
+        mapping = self._current()
+        if mapping is None or voter_id < 0:
+            return None
+        if voter_id >= mapping.capacity:
+            # Another worker may have grown the file
+            if voter_id >= HEADER.unpack(mapping.map[:HEADER.size])[2]:
+                return None
+            mapping = self._open(mapping)
+            if mapping is None or voter_id >= mapping.capacity:
+                return None
+        group, bit = divmod(voter_id, 8)
+        offset = HEADER.size + group * BYTES_PER_GROUP
+        flags = bytearray(mapping.map[offset:offset + BYTES_PER_GROUP])
+        return tuple(bool(flags[plane] & (1 << bit)) for plane in (EXISTS, USED_VOTE, ACTIVE_PIN))
+
+    # Writing #
+
+    def _grow(self, mapping, voter_id):
+        capacity = round_capacity(max(voter_id, mapping.capacity * 2))
+        with open(self.path, 'r+b') as bitmap_file:
+            bitmap_file.truncate(file_size(capacity))
+        mapping.map[:HEADER.size] = HEADER.pack(MAGIC, 0, capacity, mapping.built_at)
+        return self._open()
+
+    def update(self, voters):
+        """Store (voter id, {plane: value}) pairs."""
+        with self._locked():
+            mapping = self._current()
+            if mapping is None:
+                return
+            for voter_id, values in voters:
+                if voter_id >= mapping.capacity:
+                    mapping = self._grow(mapping, voter_id)
+                    if mapping is None:
+                        return
+                bitmap = mapping.map
+                group, bit = divmod(voter_id, 8)
+                offset = HEADER.size + group * BYTES_PER_GROUP
+                flags = bytearray(bitmap[offset:offset + BYTES_PER_GROUP])
+                for plane, value in values.items():
+                    if value:
+                        flags[plane] |= 1 << bit
+                    else:
+                        flags[plane] &= ~(1 << bit) & 0xff
+                bitmap[offset:offset + BYTES_PER_GROUP] = bytes(flags)
+
+    def rebuild(self, rows, max_voter_id, unless_built_after=None):
+        """
+        Replace the bitmap with one built from (voter id, used_vote,
+        active_pin) rows; writers wait until the new file is in place.
+        Returns False without rebuilding if the current bitmap was built
+        after unless_built_after.
+        """
+        capacity = round_capacity(max_voter_id + max(1024, max_voter_id // 4))
+        data = bytearray(file_size(capacity))
+        with self._locked():
+            mapping = self._current()
+            if unless_built_after is not None and mapping is not None and \
+                    mapping.built_at > unless_built_after:
+                return False
+            for voter_id, used_vote, active_pin in rows:
+                if voter_id >= capacity:
+                    # Inserted since max_voter_id was read
+                    capacity = round_capacity(voter_id * 2)
+                    data.extend(bytearray(file_size(capacity) - len(data)))
+                group, bit = divmod(voter_id, 8)
+                offset = HEADER.size + group * BYTES_PER_GROUP
+                mask = 1 << bit
+                data[offset + EXISTS] |= mask
+                if used_vote:
+                    data[offset + USED_VOTE] |= mask
+                if active_pin:
+                    data[offset + ACTIVE_PIN] |= mask
+            data[:HEADER.size] = HEADER.pack(MAGIC, 0, capacity, time.time())
+
+            with open(self.path + '.tmp', 'wb') as new_file:
+                new_file.write(data)
+            old_file = open(self.path, 'r+b') if os.path.exists(self.path) else None
+            try:
+                os.rename(self.path + '.tmp', self.path)
+                if old_file is not None:
+                    old_file.seek(STALE_OFFSET)
+                    old_file.write(b'\x01')
+            finally:
+                if old_file is not None:
+                    old_file.close()
+            self._open()
+        return True
+
+
+_bitmaps = {}
+
+
+def voter_bitmap(alias=DEFAULT_DB_ALIAS):
+    """
+    The VoterBitmap of a shard's voters (settings.VOTER_BITMAP_PATH, plus
+    '.<alias>' for shards other than 'default'), or None if disabled. Bits
+    are indexed by voter id less the shard's id_base().
+    """
+    path = settings.VOTER_BITMAP_PATH
+    if not path:
+        return None
+    if alias != DEFAULT_DB_ALIAS:
+        path += '.' + alias
+    if path not in _bitmaps:
+        _bitmaps[path] = VoterBitmap(path)
+    return _bitmaps[path]
+
+
+def lookup_voter(voter_id):
+    """VoterBitmap.lookup() on the configured bitmap; None if disabled."""
+    alias = shard_for_id(voter_id)
+    bitmap = voter_bitmap(alias)
+    return bitmap.lookup(int(voter_id) - id_base(alias)) if bitmap is not None else None
+
+
+def update_after_commit(voters):
+    """
+    Queue bitmap.update(voters) for when the transaction of each voter's
+    shard commits.
+    """
+    if not settings.VOTER_BITMAP_PATH:
+        return
+    shards = {}
+    for voter_id, values in voters:
+        shards.setdefault(shard_for_id(voter_id), []).append((voter_id, values))
+    for alias, changes in shards.items():
+        base = id_base(alias)
+        changes = [(voter_id - base, values) for voter_id, values in changes]
+        transaction.on_commit(partial(voter_bitmap(alias).update, changes), using=alias)
+
+
+def set_flag_after_commit(voter_ids, flag):
+    update_after_commit([(int(voter_id), {PLANES[flag]: True}) for voter_id in voter_ids])
+
+
+def store_voters_after_commit(voters):
+    update_after_commit([(voter.pk, {EXISTS: True, USED_VOTE: voter.used_vote,
+                                     ACTIVE_PIN: voter.active_pin})
+                         for voter in voters])
+
+
+def remove_voter_after_commit(voter_id):
+    update_after_commit([(voter_id, {EXISTS: False, USED_VOTE: False, ACTIVE_PIN: False})])
+
+
+def forget_voters_after_commit(voter_ids):
+    """
+    Mark voters whose flags changed behind the bitmap's back as unknown, so
+    that check_votable reads them from the database until the next rebuild.
+    """
+    update_after_commit([(int(voter_id), {EXISTS: False}) for voter_id in voter_ids])
+
+
+def rebuild_voter_bitmap(unless_built_after=None):
+    """
+    Rebuild the bitmap of every shard from its Voter table (see
+    VoterBitmap.rebuild). Returns the number of voters, or None if nothing
+    was rebuilt.
+    """
+    from django.db.models import Max
+    from .models import Voter
+
+    if not settings.VOTER_BITMAP_PATH:
+        return None
+    count = [0]
+    rebuilt = False
+    for alias in all_shards():
+        base = id_base(alias)
+        voters = Voter.objects.using(alias).order_by()
+
+        def rows():
+            for pk, used_vote, active_pin in voters.values_list(
+                    'pk', 'used_vote', 'active_pin').iterator():
+                count[0] += 1
+                yield pk - base, used_vote, active_pin
+        max_voter_id = voters.aggregate(pk=Max('pk'))['pk'] or base
+        if voter_bitmap(alias).rebuild(rows(), max_voter_id - base, unless_built_after):
+            rebuilt = True
+    return count[0] if rebuilt else None
+
+
+def load_voter_bitmap():
+    """
+    Called as each worker starts: rebuild the bitmap from the database
+    unless another worker has done so in the last VOTER_BITMAP_MAX_AGE
+    seconds.
+    """
+    return rebuild_voter_bitmap(unless_built_after=time.time() - settings.VOTER_BITMAP_MAX_AGE)
@@ -0,0 +1,77 @@
+"""
+Cached get_candidates responses.
+
+Candidate lists do not change while polls are open, so the finished JSON
+body for each constituency is kept in the cache together with a
+station -> constituency map. Both are invalidated by the signal handlers
+in signals.py whenever a Candidate, Party, Station or Constituency
+changes; candidate entries are invalidated together by moving to a new
+version key, since a Party rename touches every constituency. The
+version and constituency also make up the response's ETag, together with
+the fields and format selected (see projection.py).
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Candidate, Station
+from .projection import CANDIDATE_PROJECTION, RECORDS, json_body
+
+VERSION_KEY = 'voters:candidates:version'
+
+
+def station_key(station_id):
+    return 'voters:station:%s:constituency' % station_id
+
+
+def selection_key(fields, output_format):
+    # No commas: the key is part of the ETag, and If-None-Match lists ETags
+    return '-'.join([output_format] + CANDIDATE_PROJECTION.select(fields))
+
+
+def candidates_key(version, constituency_id, selection):
+    return 'voters:candidates:%s:%s:%s' % (version, constituency_id, selection)
+
+
+def invalidate_candidates():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_station(station_id):
+    cache.delete(station_key(station_id))
+
+
+def render_candidates(constituency_id, fields=None, output_format=RECORDS):
+    candidates = Candidate.objects.filter(constituency=constituency_id)
+    return ''.join(json_body('candidates', CANDIDATE_PROJECTION, candidates,
+                             fields, output_format)).encode('utf-8')
+
+
+def candidates_for_station(station_id, fields=None, output_format=RECORDS):
+    """
+    Return (ETag, get_candidates response body) for a station, or None if
+    the station does not exist. Costs no queries once the cache is warm.
+    """
+    selection = selection_key(fields, output_format)
+    cached = cache.get_many([station_key(station_id), VERSION_KEY])
+    constituency_id = cached.get(station_key(station_id))
+    version = cached.get(VERSION_KEY)
+
+    if constituency_id is None:
+        constituency_id = Station.objects.filter(pk=station_id).values_list(
+            'constituency', flat=True).first()
+        if constituency_id is None:
+            return None
+        cache.set(station_key(station_id), constituency_id, settings.CANDIDATES_CACHE_TIMEOUT)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(VERSION_KEY, version, None):
+            version = cache.get(VERSION_KEY)
+
+    key = candidates_key(version, constituency_id, selection)
+    content = cache.get(key)
+    if content is None:
+        content = render_candidates(constituency_id, fields, output_format)
+        cache.set(key, content, settings.CANDIDATES_CACHE_TIMEOUT)
+    return '"%s-%s-%s"' % (version, constituency_id, selection), content
@@ -0,0 +1,89 @@
+"""
+CSV extracts of the roll and of turnout, produced a page at a time.
+
+Rows are read in short keyset-paginated queries (WHERE id > last ORDER BY
+id LIMIT n) rather than one long cursor, so memory stays constant and, on
+SQLite, no read transaction is held open long enough to stall the vote
+marking writers. Each page is read from the shard holding its rows.
+"""
+import csv
+
+from django.utils import six
+
+from .models import Station, Voter, StationTurnout
+from .shards import all_shards, shard_for_constituency, using_shard
+
+PAGE_SIZE = 2000
+
+VOTER_COLUMNS = ('id', 'first_name', 'last_name', 'addr_line_1', 'addr_line_2', 'postcode',
+                 'date_of_birth', 'phone', 'station_id', 'station__name', 'used_vote', 'active_pin')
+TURNOUT_COLUMNS = ('station__constituency_id', 'station__constituency__name', 'station_id',
+                   'station__name', 'registered_voters', 'voted')
+
+
+class Echo(object):
+    """File-like object that hands back what csv.writer writes to it."""
+
+    def write(self, value):
+        return value
+
+
+def _encode(value):
+    if value is None:
+        return ''
+    if six.PY2 and isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def _as_bytes(text):
+    return text.encode('utf-8') if isinstance(text, six.text_type) else text
+
+
+def csv_pages(header, pages):
+    """Render a header and pages of row tuples as one UTF-8 CSV chunk per page."""
+    writer = csv.writer(Echo())
+    yield _as_bytes(writer.writerow(header))
+    for page in pages:
+        yield _as_bytes(''.join(writer.writerow([_encode(value) for value in row])
+                                for row in page))
+
+
+def keyset_pages(queryset, page_size=PAGE_SIZE, pk_index=0):
+    """
+    Yield lists of values_list rows from queryset in primary key order, one
+    short query per page. pk_index is the position of the primary key in
+    each row.
+    """
+    last_pk = None
+    while True:
+        page_queryset = queryset.order_by('pk')
+        if last_pk is not None:
+            page_queryset = page_queryset.filter(pk__gt=last_pk)
+        page = list(page_queryset[:page_size])
+        if not page:
+            return
+        yield page
+        last_pk = page[-1][pk_index]
+
+
+def voter_pages(constituency_id, page_size=PAGE_SIZE):
+    """Pages of VOTER_COLUMNS rows for every voter registered in a constituency."""
+    with using_shard(shard_for_constituency(constituency_id)):
+        stations = list(Station.objects.filter(constituency=constituency_id).order_by('pk')
+                        .values_list('pk', flat=True))
+        for station_id in stations:
+            # Per station, so that every page is a (station_id, id) index range.
+            voters = Voter.objects.filter(station=station_id).values_list(*VOTER_COLUMNS)
+            for page in keyset_pages(voters, page_size):
+                yield page
+
+
+def turnout_pages(page_size=PAGE_SIZE):
+    """Pages of TURNOUT_COLUMNS rows, one row per station, shard by shard."""
+    turnout = StationTurnout.objects.values_list(*TURNOUT_COLUMNS)
+    for alias in all_shards():
+        with using_shard(alias):
+            for page in keyset_pages(turnout, page_size,
+                                     pk_index=TURNOUT_COLUMNS.index('station_id')):
+                yield page
@@ -0,0 +1,168 @@
+"""
+Group commit for single-voter flag writes.
+
+On SQLite every make_voter_ineligible is its own transaction, and so its
+own turn on the database's single write lock and its own fsync. With
+GROUP_COMMIT_WINDOW_MS set, concurrent make_voter_ineligible and
+set_voter_has_active_pin calls in a worker are instead collected and
+committed together: the first caller becomes the leader, waits up to the
+window (or until GROUP_COMMIT_MAX_BATCH calls have joined), then applies
+every pending call in one transaction through the set-based VoterManager
+methods. Each shard has its own groups, so a group is all or nothing. Each
+caller gets its own outcome only once that transaction has committed. If
+it fails, the group's calls are retried one at a time, so only the calls
+that fail on their own get an exception.
+
+Groups commit one at a time, so calls arriving while a group commits join
+the next one.
+"""
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Voter, CHANGED, ALREADY_SET, MAX_ID, NOT_FOUND
+from .roll import chunked
+from .shards import group_by_shard, shard_for_id
+
+BATCH_METHODS = {
+    'used_vote': Voter.objects.mark_used_votes,
+    'active_pin': Voter.objects.mark_active_pins,
+}
+SINGLE_METHODS = {
+    'used_vote': Voter.objects.mark_used_vote,
+    'active_pin': Voter.objects.mark_active_pin,
+}
+
+
+class _Call(object):
+
+    def __init__(self, item):
+        self.item = item
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitWriter(object):
+    """
+    Applies concurrent submit(item) calls in groups: apply(items) is called
+    with the items of a group and returns their results in order. If it
+    raises for a group of several items and apply_one is given, each item
+    is then applied on its own with apply_one(item).
+    """
+
+    def __init__(self, apply, window, max_batch, apply_one=None):
+        self.apply = apply
+        self.apply_one = apply_one
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._pending = []
+        self._leading = False
+        self._full = threading.Event()
+
+    def submit(self, item):
+        call = _Call(item)
+        with self._lock:
+            self._pending.append(call)
+            lead = not self._leading
+            self._leading = True
+            if len(self._pending) >= self.max_batch:
+                self._full.set()
+
+        if lead:
+            self._full.wait(self.window)
+            with self._commit_lock:
+                with self._lock:
+                    group, self._pending = self._pending, []
+                    self._leading = False
+                    self._full.clear()
+                self._commit(group)
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _commit(self, group):
+        try:
+            results = self.apply([call.item for call in group])
+        except Exception as error:
+            if len(group) > 1 and self.apply_one is not None:
+                self._commit_each(group)
+                return
+            for call in group:
+                call.error = error
+        else:
+            for call, result in zip(group, results):
+                call.result = result
+        for call in group:
+            call.done.set()
+
+    def _commit_each(self, group):
+        for call in group:
+            try:
+                call.result = self.apply_one(call.item)
+            except Exception as error:
+                call.error = error
+            call.done.set()
+
+
+def apply_flags(items):
+    """
+    Apply (voter id, flag) items in one transaction per shard and return
+    their outcomes in order. An item repeating an earlier one in the same
+    group gets the outcome it would have had running after it.
+    """
+    outcomes = dict((flag, {}) for _, flag in items)
+    wanted = set(items)
+    for alias, shard_ids in group_by_shard(set(voter_id for voter_id, _ in items)).items():
+        with transaction.atomic(using=alias):
+            for flag in outcomes:
+                voter_ids = [voter_id for voter_id in shard_ids if (voter_id, flag) in wanted]
+                for chunk in chunked(voter_ids, settings.VOTER_BATCH_MAX_SIZE):
+                    outcomes[flag].update(BATCH_METHODS[flag](chunk))
+    results = []
+    seen = set()
+    for voter_id, flag in items:
+        outcome = outcomes[flag][voter_id]
+        if outcome == CHANGED and (voter_id, flag) in seen:
+            outcome = ALREADY_SET
+        seen.add((voter_id, flag))
+        results.append(outcome)
+    return results
+
+
+def apply_flag(item):
+    voter_id, flag = item
+    return SINGLE_METHODS[flag](voter_id)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def flag_writer(alias):
+    """This worker's GroupCommitWriter for a shard and the current settings."""
+    key = (alias, settings.GROUP_COMMIT_WINDOW_MS, settings.GROUP_COMMIT_MAX_BATCH)
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = GroupCommitWriter(apply_flags, key[1] / 1000.0, key[2],
+                                              apply_flag)
+        return _writers[key]
+
+
+def mark_voter(voter_id, flag):
+    """
+    Set a voter's used_vote or active_pin flag like VoterManager's
+    mark_used_vote / mark_active_pin, group committed if enabled. Ids no
+    voter can have are NOT_FOUND without reaching the database.
+    """
+    if not 0 < int(voter_id) <= MAX_ID:
+        return NOT_FOUND
+    if not settings.GROUP_COMMIT_WINDOW_MS:
+        return SINGLE_METHODS[flag](voter_id)
+    return flag_writer(shard_for_id(voter_id)).submit((int(voter_id), flag))
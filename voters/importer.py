@@ -0,0 +1,168 @@
+"""
+Streaming import of the electoral register from CSV.
+
+Rows are read one at a time, validated against an in-memory set of
+station ids and written with chunked multi-row inserts, one transaction
+per batch and shard. Each
+transaction also advances the shard's VoterImport checkpoint for the source
+file and the turnout counters of the stations it touched, so an interrupted
+import resumes exactly where its last committed batch ended.
+"""
+import csv
+import datetime
+import io
+import os
+import re
+from collections import Counter
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+from django.utils import six
+
+from .models import Station, Voter, VoterImport, adjust_turnout
+from .roll import chunked, insert_voters
+from .shards import all_shards, id_base, shard_for_id, using_shard
+from .urls import POSTCODE_REGEX
+
+COLUMNS = ('first_name', 'last_name', 'addr_line_1', 'addr_line_2', 'postcode',
+           'date_of_birth', 'phone', 'station_id')
+REQUIRED = ('first_name', 'last_name', 'addr_line_1', 'postcode', 'date_of_birth', 'phone',
+            'station_id')
+POSTCODE_PATTERN = re.compile('^' + POSTCODE_REGEX + '$')
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def read_rows(path):
+    """Yield each data row of a CSV file as a {column: value} dict."""
+    if six.PY2:
+        with open(path, 'rb') as csv_file:
+            for row in csv.DictReader(csv_file):
+                yield dict((key, value.decode('utf-8') if value else value)
+                           for key, value in row.items())
+    else:
+        with io.open(path, 'r', encoding='utf-8', newline='') as csv_file:
+            for row in csv.DictReader(csv_file):
+                yield row
+
+
+def build_voter(row, station_ids):
+    """Validate a CSV row and return an unsaved Voter, or raise InvalidRow."""
+    values = {}
+    for column in COLUMNS:
+        value = (row.get(column) or '').strip()
+        if column in REQUIRED and not value:
+            raise InvalidRow('missing %s' % column)
+        if column != 'station_id' and column != 'date_of_birth':
+            max_length = Voter._meta.get_field(column).max_length
+            if len(value) > max_length:
+                raise InvalidRow('%s longer than %d characters' % (column, max_length))
+        values[column] = value
+
+    if not POSTCODE_PATTERN.match(values['postcode'].upper()):
+        raise InvalidRow('invalid postcode %r' % values['postcode'])
+    try:
+        values['date_of_birth'] = datetime.datetime.strptime(
+            values['date_of_birth'], '%Y-%m-%d').date()
+    except ValueError:
+        raise InvalidRow('invalid date_of_birth %r' % values['date_of_birth'])
+    try:
+        values['station_id'] = int(values['station_id'])
+    except ValueError:
+        raise InvalidRow('invalid station_id %r' % values['station_id'])
+    if values['station_id'] not in station_ids:
+        raise InvalidRow('unknown station %d' % values['station_id'])
+    return Voter(**values)
+
+
+def voter_indexes_present(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, Voter._meta.db_table)
+    return [index for index in Voter._meta.indexes if index.name in constraints]
+
+
+def drop_voter_indexes(using=DEFAULT_DB_ALIAS):
+    """Drop the secondary Voter indexes so a bulk load does not maintain them."""
+    with connections[using].schema_editor() as schema_editor:
+        for index in voter_indexes_present(using):
+            schema_editor.remove_index(Voter, index)
+
+
+def create_voter_indexes(using=DEFAULT_DB_ALIAS):
+    present = [index.name for index in voter_indexes_present(using)]
+    with connections[using].schema_editor() as schema_editor:
+        for index in Voter._meta.indexes:
+            if index.name not in present:
+                schema_editor.add_index(Voter, index)
+
+
+def import_voters(path, batch_size=10000, chunk_size=1000, defer_indexes=True,
+                  on_error=None, on_progress=None):
+    """
+    Import the voters in the CSV file at path, resuming after the rows a
+    previous run already committed. on_error(row number, error) is called
+    for each rejected row and on_progress(rows done in total, rows processed
+    by this run) after each committed batch. Returns (rows imported by this
+    run, rows rejected by this run).
+    """
+    source = os.path.abspath(path)
+    shards = all_shards()
+    progress = {}
+    station_ids = set()
+    for alias in shards:
+        progress[alias], _ = VoterImport.objects.using(alias).get_or_create(source=source)
+        station_ids.update(Station.objects.using(alias).values_list('pk', flat=True))
+    imported = rejected = 0
+
+    def rows_done():
+        return min(checkpoint.rows_done for checkpoint in progress.values())
+
+    if defer_indexes:
+        for alias in shards:
+            drop_voter_indexes(alias)
+    try:
+        rows = enumerate(read_rows(path), start=1)
+        for batch in chunked(rows, batch_size):
+            if batch[-1][0] <= rows_done():
+                continue
+            voters = dict((alias, []) for alias in shards)
+            for number, row in batch:
+                if number <= rows_done():
+                    continue
+                try:
+                    voter = build_voter(row, station_ids)
+                except InvalidRow as error:
+                    rejected += 1
+                    if on_error:
+                        on_error(number, error)
+                    continue
+                alias = shard_for_id(voter.station_id)
+                if number > progress[alias].rows_done:
+                    voters[alias].append(voter)
+
+            for alias in shards:
+                if progress[alias].rows_done >= batch[-1][0]:
+                    continue
+                with using_shard(alias), transaction.atomic(using=alias):
+                    last_pk = Voter.objects.aggregate(pk=Max('pk'))['pk']
+                    next_pk = max(last_pk or 0, id_base(alias)) + 1
+                    for offset, voter in enumerate(voters[alias]):
+                        voter.pk = next_pk + offset
+                    for chunk in chunked(voters[alias], chunk_size):
+                        insert_voters(chunk, alias)
+                    for station_id, registered in Counter(
+                            v.station_id for v in voters[alias]).items():
+                        adjust_turnout(station_id, registered=registered)
+                    progress[alias].rows_done = batch[-1][0]
+                    progress[alias].save()
+                imported += len(voters[alias])
+            if on_progress:
+                on_progress(rows_done(), imported + rejected)
+    finally:
+        if defer_indexes:
+            for alias in shards:
+                create_voter_indexes(alias)
+    return imported, rejected
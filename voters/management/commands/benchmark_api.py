@@ -0,0 +1,163 @@
+from __future__ import division
+
+import datetime
+import json
+import random
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ...api_key_verification import ROLES
+from ...benchmarking import SERVER_NAME, format_summary, summarize, temporary_database, \
+time_calls
+from ...bitmap import load_voter_bitmap
+from ...models import Constituency, Station, Voter
+from ...roll import generate_roll
+from ...turnout import record_turnout_history
+from ...urls import urlpatterns
+
+
+class Command(BaseCommand):
+    help = ('Drive every view in voters/urls.py through the test client and report '
+            'p50/p95/p99 latency, throughput and queries per request for each one. '
+            'Runs against a generated roll in a throwaway database unless '
+            '--existing-database is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Requests per endpoint.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Voter ids per batch request.')
+        parser.add_argument('--constituencies', type=int, default=10)
+        parser.add_argument('--stations', type=int, default=10)
+        parser.add_argument('--voters', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--existing-database', action='store_true',
+                            help='Benchmark the configured database as it is. '
+                                 'Write endpoints will change its data.')
+
+    def handle(self, *args, **options):
+        if options['existing_database']:
+            self.run(options)
+            return
+        with temporary_database():
+            self.stdout.write('Generating %d voters...' % options['voters'])
+            generate_roll(constituencies=options['constituencies'], stations=options['stations'],
+                          voters=options['voters'], used_vote_fraction=0.1, seed=options['seed'])
+            self.record_history(options['seed'])
+            self.run(options)
+
+    def record_history(self, seed, minutes=60, votes_per_minute=50):
+        # An hour of polling day for turnout_history: some votes, then a
+        # recording, every minute
+        voter_ids = list(Voter.objects.filter(used_vote=False).values_list('pk', flat=True))
+        random.Random(seed).shuffle(voter_ids)
+        now = timezone.now()
+        for minute in range(minutes, 0, -1):
+            Voter.objects.mark_used_votes(voter_ids[:votes_per_minute])
+            del voter_ids[:votes_per_minute]
+            record_turnout_history(now=now - datetime.timedelta(minutes=minute))
+
+    def run(self, options):
+        # As each WSGI worker does when it starts
+        load_voter_bitmap()
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.voter_ids = list(Voter.objects.values_list('pk', flat=True))
+        self.stations = list(Station.objects.values_list('pk', 'postcode'))
+        self.constituencies = list(Constituency.objects.values_list('pk', flat=True))
+        self.client = Client(SERVER_NAME=SERVER_NAME)
+
+        # Roles without a configured key (e.g. audit) get a throwaway one
+        api_keys = dict((role, settings.API_KEYS.get(role) or ['Basic benchmark-%s' % role])
+                        for role in ROLES)
+        with override_settings(API_KEYS=api_keys):
+            for pattern in urlpatterns:
+                scenario = getattr(self, 'scenario_' + pattern.name, None)
+                if scenario is None:
+                    self.stderr.write('%s: no benchmark scenario' % pattern.name)
+                    continue
+                request = self.make_request(pattern.name, scenario)
+                reset_queries()
+                with CaptureQueriesContext(connection) as queries:
+                    for _ in range(10):
+                        request()
+                queries_per_request = len(queries) / 10
+                # Time without the debug cursor, as in production.
+                with override_settings(DEBUG=False):
+                    summary = summarize(time_calls(request, options['requests']))
+                self.stdout.write(format_summary(pattern.name, summary) +
+                                  ' queries=%.1f' % queries_per_request)
+
+    def make_request(self, name, scenario):
+        def request():
+            role, args, body, query = (scenario() + (None,))[:4]
+            headers = {'HTTP_AUTHORIZATION': settings.API_KEYS[role][0]} if role else {}
+            url = reverse('voters:' + name, args=args)
+            if body is None:
+                response = self.client.get(url, query, **headers)
+            else:
+                response = self.client.post(url, json.dumps(body),
+                                            content_type='application/json', **headers)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            return response
+        return request
+
+    def random_voters(self):
+        return self.rng.sample(self.voter_ids, min(self.batch_size, len(self.voter_ids)))
+
+    # Scenarios return (role, url args, JSON body or None for a GET), plus
+    # the query parameters of a GET if it has any #
+
+    def scenario_index(self):
+        return None, (), None
+
+    def scenario_voter_turnout(self):
+        return None, (), None
+
+    def scenario_check_votable(self):
+        return 'booth', (self.rng.choice(self.voter_ids),), None
+
+    def scenario_check_votable_batch(self):
+        return 'booth', (), {'voter_ids': self.random_voters()}
+
+    def scenario_get_voters(self):
+        station_id, postcode = self.rng.choice(self.stations)
+        return 'station', (station_id, self.rng.choice(['Ja', 'Mar', 'Oliver']), postcode), None
+
+    def scenario_make_voter_ineligible(self):
+        return 'pins', (self.rng.choice(self.voter_ids),), None
+
+    def scenario_make_voter_ineligible_batch(self):
+        return 'pins', (), {'voter_ids': self.random_voters()}
+
+    def scenario_set_voter_has_active_pin(self):
+        return 'pins', (self.rng.choice(self.voter_ids),), None
+
+    def scenario_set_voter_has_active_pin_batch(self):
+        return 'pins', (), {'voter_ids': self.random_voters()}
+
+    def scenario_get_candidates(self):
+        return 'booth', (self.rng.choice(self.stations)[0],), None
+
+    def scenario_turnout_history(self):
+        # A dashboard's view of the last hour, per constituency
+        end = timezone.now()
+        return None, (), None, {'level': 'constituency',
+                                'from': (end - datetime.timedelta(hours=1)).isoformat(),
+                                'to': end.isoformat()}
+
+    def scenario_export_voters(self):
+        return 'results', (self.rng.choice(self.constituencies),), None
+
+    def scenario_export_turnout(self):
+        return 'results', (), None
+
+    def scenario_metrics(self):
+        return 'monitoring', (), None
@@ -0,0 +1,83 @@
+from __future__ import division
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test import override_settings
+
+from ...benchmarking import format_summary, summarize, temporary_database
+from ...group_commit import mark_voter
+from ...models import Voter
+from ...roll import generate_roll
+from ...turnout import rebuild_turnout
+
+
+class Command(BaseCommand):
+    help = ('Mark voters as having voted from many threads at once, committing each '
+            'call on its own and then with group commit at each --windows value, and '
+            'compare throughput and latency. Runs against a throwaway SQLite file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=20000)
+        parser.add_argument('--threads', type=int, default=16,
+                            help='Concurrent booths marking voters.')
+        parser.add_argument('--calls', type=int, default=200,
+                            help='make_voter_ineligible calls per thread.')
+        parser.add_argument('--windows', default='0,1,2,5',
+                            help='Comma-separated group commit windows in ms; 0 commits '
+                                 'every call on its own.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp()
+        try:
+            with temporary_database(os.path.join(directory, 'benchmark.sqlite3')):
+                generate_roll(voters=options['voters'], seed=options['seed'])
+                voter_ids = list(Voter.objects.values_list('pk', flat=True))
+                # The threads share the file through their own connections
+                connection.close()
+                for window in [float(window) for window in options['windows'].split(',')]:
+                    Voter.objects.update(used_vote=False)
+                    rebuild_turnout()
+                    connection.close()
+                    with override_settings(GROUP_COMMIT_WINDOW_MS=window):
+                        durations, errors, seconds = self.run(voter_ids, options)
+                    label = 'window %gms' % window if window else 'commit per call'
+                    self.stdout.write('%s %d errors, %.0f writes/s overall' % (
+                        format_summary(label, summarize(durations)), errors,
+                        len(durations) / seconds))
+        finally:
+            shutil.rmtree(directory)
+
+    def run(self, voter_ids, options):
+        rng = random.Random(options['seed'])
+        voter_ids = rng.sample(voter_ids, min(len(voter_ids), options['threads'] * options['calls']))
+        durations, errors = [], [0]
+
+        def booth(ids):
+            try:
+                for voter_id in ids:
+                    start = default_timer()
+                    try:
+                        mark_voter(voter_id, 'used_vote')
+                    except OperationalError:
+                        errors[0] += 1
+                        continue
+                    durations.append(default_timer() - start)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=booth, args=(voter_ids[n::options['threads']],))
+                   for n in range(options['threads'])]
+        start = default_timer()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return durations, errors[0], default_timer() - start
@@ -0,0 +1,31 @@
+from __future__ import division
+
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from ...benchmarking import SERVER_NAME, format_summary, summarize, time_calls
+
+
+class Command(BaseCommand):
+    help = ('Compare per-request latency of API routes with the lean middleware '
+            'profile against the full browser middleware stack.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per configuration.')
+        parser.add_argument('--path', default='/',
+                            help='API path to request (default: the index view).')
+
+    def handle(self, *args, **options):
+        client = Client(SERVER_NAME=SERVER_NAME)
+        path = options['path']
+        results = {}
+        for label, lean in (('full middleware stack', False), ('lean API middleware', True)):
+            with override_settings(LEAN_API_MIDDLEWARE=lean):
+                client.get(path)  # warm up
+                results[lean] = summarize(time_calls(lambda: client.get(path), options['requests']))
+            self.stdout.write(format_summary(label, results[lean]))
+
+        saved = results[False]['mean_ms'] - results[True]['mean_ms']
+        self.stdout.write('Saved %.3fms per request (%.1f%%).' % (
+            saved, 100 * saved / results[False]['mean_ms']))
@@ -0,0 +1,59 @@
+from __future__ import division
+
+import gzip
+import io
+
+from django.core import serializers
+from django.core.management.base import BaseCommand
+
+from ...benchmarking import summarize, temporary_database, time_calls
+from ...models import Voter
+from ...projection import VOTER_PROJECTION, COLUMNS, RECORDS, json_body
+from ...roll import generate_roll
+
+
+def gzipped_size(content):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as gzip_file:
+        gzip_file.write(content)
+    return len(out.getvalue())
+
+
+class Command(BaseCommand):
+    help = ('Compare per-row CPU time and payload size of serializers.serialize() '
+            'against the values_list() projection, with every field and with a '
+            'field selection, as records and as columns. Runs against a throwaway '
+            'database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--fields', default='first_name,last_name,postcode,used_vote',
+                            help='Comma-separated field selection to compare.')
+
+    def handle(self, *args, **options):
+        fields = options['fields'].split(',')
+        with temporary_database():
+            generate_roll(voters=options['voters'], seed=0)
+            voters = Voter.objects.order_by('pk')
+            rows = voters.count()
+            renderers = [
+                ('serializers.serialize', lambda: serializers.serialize('json', voters)),
+                ('projection, all fields', lambda: self.render(voters, None, RECORDS)),
+                ('projection, %d fields' % len(fields), lambda: self.render(voters, fields, RECORDS)),
+                ('columns, all fields', lambda: self.render(voters, None, COLUMNS)),
+                ('columns, %d fields' % len(fields), lambda: self.render(voters, fields, COLUMNS)),
+            ]
+            self.stdout.write('%-28s %12s %12s %14s' % ('', 'us/row (p50)', 'bytes/row',
+                                                          'gzip bytes/row'))
+            for label, render in renderers:
+                content = render()
+                if not isinstance(content, bytes):
+                    content = content.encode('utf-8')
+                p50_ms = summarize(time_calls(render, options['repeat']))['p50_ms']
+                self.stdout.write('%-28s %12.2f %12.1f %14.1f' % (
+                    label, 1000 * p50_ms / rows, len(content) / rows,
+                    gzipped_size(content) / rows))
+
+    def render(self, voters, fields, output_format):
+        return ''.join(json_body('voters', VOTER_PROJECTION, voters, fields, output_format))
@@ -0,0 +1,104 @@
+from __future__ import division
+
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...benchmarking import format_summary, summarize
+from ...sqlite import apply_pragmas
+
+# Connection settings of the database layer before and after tuning
+CONFIGURATIONS = (
+    ('default (rollback journal, connection per request)', [], False),
+    ('tuned (SQLITE_PRAGMAS, persistent connections)', None, True),
+)
+
+
+class Command(BaseCommand):
+    help = ('Run concurrent check_votable-style reads and make_voter_ineligible-style '
+            'writes against a scratch SQLite file, with the default connection setup and '
+            'with the tuned one from settings.SQLITE_PRAGMAS, and compare throughput.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=100000)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp()
+        try:
+            for label, pragmas, persistent in CONFIGURATIONS:
+                if pragmas is None:
+                    pragmas = settings.SQLITE_PRAGMAS
+                path = os.path.join(directory, 'benchmark-%d.sqlite3' % persistent)
+                self.create_database(path, options['voters'])
+                reads, writes, errors = self.run(path, pragmas, persistent, options)
+                self.stdout.write(label)
+                self.stdout.write(format_summary('  reads', summarize(reads)))
+                self.stdout.write(format_summary('  writes', summarize(writes)))
+                self.stdout.write('  total %.0f ops/s, %d lock timeouts' % (
+                    (len(reads) + len(writes)) / options['seconds'], errors))
+        finally:
+            shutil.rmtree(directory)
+
+    def create_database(self, path, voters):
+        connection = sqlite3.connect(path)
+        connection.execute('CREATE TABLE voter (id INTEGER PRIMARY KEY, station_id INTEGER, '
+                           'used_vote BOOL NOT NULL DEFAULT 0)')
+        connection.executemany('INSERT INTO voter (id, station_id) VALUES (?, ?)',
+                               ((pk, pk % 100) for pk in range(1, voters + 1)))
+        connection.commit()
+        connection.close()
+
+    def run(self, path, pragmas, persistent, options):
+        reads, writes, errors = [], [], [0]
+        deadline = default_timer() + options['seconds']
+
+        def connect():
+            connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+            apply_pragmas(connection.cursor(), pragmas)
+            return connection
+
+        def worker(write, seed):
+            rng = random.Random(seed)
+            durations = writes if write else reads
+            connection = connect() if persistent else None
+            while default_timer() < deadline:
+                voter_id = rng.randint(1, options['voters'])
+                start = default_timer()
+                current = connection or connect()
+                try:
+                    if write:
+                        current.execute('BEGIN IMMEDIATE')
+                        current.execute('UPDATE voter SET used_vote = 1 '
+                                        'WHERE id = ? AND used_vote = 0', (voter_id,))
+                        current.execute('COMMIT')
+                    else:
+                        current.execute('SELECT used_vote FROM voter WHERE id = ?',
+                                        (voter_id,)).fetchone()
+                except sqlite3.OperationalError:
+                    errors[0] += 1
+                    continue
+                finally:
+                    if connection is None:
+                        current.close()
+                durations.append(default_timer() - start)
+            if connection is not None:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(False, n)) for n in range(options['readers'])]
+        threads += [threading.Thread(target=worker, args=(True, 1000 + n))
+                    for n in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return reads, writes, errors[0]
@@ -0,0 +1,43 @@
+import gzip
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...export import VOTER_COLUMNS, TURNOUT_COLUMNS, csv_pages, voter_pages, turnout_pages
+from ...models import Constituency
+
+
+class Command(BaseCommand):
+    help = ('Stream a CSV extract of the voters of one constituency, or of turnout per '
+            'station, to a file or stdout.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('extract', choices=['voters', 'turnout'])
+        parser.add_argument('--constituency', type=int,
+                            help='Constituency id (required for the voters extract).')
+        parser.add_argument('--output', help='File to write (default: stdout).')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output.')
+
+    def handle(self, *args, **options):
+        if options['extract'] == 'voters':
+            if options['constituency'] is None:
+                raise CommandError('--constituency is required for the voters extract.')
+            if not Constituency.objects.filter(pk=options['constituency']).exists():
+                raise CommandError('No constituency %d.' % options['constituency'])
+            chunks = csv_pages(VOTER_COLUMNS, voter_pages(options['constituency']))
+        else:
+            chunks = csv_pages(TURNOUT_COLUMNS, turnout_pages())
+
+        if options['output']:
+            destination = open(options['output'], 'wb')
+        else:
+            destination = getattr(sys.stdout, 'buffer', sys.stdout)
+        output = gzip.GzipFile(fileobj=destination, mode='wb') if options['gzip'] else destination
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not destination:
+                output.close()
+            if options['output']:
+                destination.close()
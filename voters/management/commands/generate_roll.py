@@ -0,0 +1,44 @@
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand
+
+from ...roll import generate_roll
+
+
+class Command(BaseCommand):
+    help = ('Generate a deterministic synthetic electoral roll (constituencies, stations, '
+            'parties, candidates and voters) for load testing.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--constituencies', type=int, default=10)
+        parser.add_argument('--stations', type=int, default=5,
+                            help='Stations per constituency.')
+        parser.add_argument('--voters', type=int, default=10000,
+                            help='Voters in total, spread evenly across stations.')
+        parser.add_argument('--parties', type=int, default=5)
+        parser.add_argument('--candidates', type=int, default=5,
+                            help='Candidates per constituency.')
+        parser.add_argument('--used-vote-fraction', type=float, default=0.0,
+                            help='Fraction of voters who have already voted.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Voters per bulk insert and transaction.')
+
+    def handle(self, *args, **options):
+        start = default_timer()
+
+        def progress(created):
+            self.stdout.write('%d voters (%.0f rows/s)' % (
+                created, created / (default_timer() - start)))
+
+        stations = generate_roll(constituencies=options['constituencies'],
+                                 stations=options['stations'],
+                                 voters=options['voters'],
+                                 parties=options['parties'],
+                                 candidates=options['candidates'],
+                                 used_vote_fraction=options['used_vote_fraction'],
+                                 seed=options['seed'],
+                                 chunk_size=options['chunk_size'],
+                                 progress=progress)
+        self.stdout.write('Generated %d stations and %d voters in %.1fs.' % (
+            len(stations), options['voters'], default_timer() - start))
@@ -0,0 +1,41 @@
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand
+
+from ...importer import COLUMNS, import_voters
+
+
+class Command(BaseCommand):
+    help = ('Stream voters from a CSV file with the columns %s into the database. '
+            'Re-running the command on the same file resumes after the last '
+            'committed batch.' % ', '.join(COLUMNS))
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header row.')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Rows per transaction and checkpoint.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows per bulk insert.')
+        parser.add_argument('--keep-indexes', action='store_true',
+                            help='Maintain the secondary Voter indexes during the load '
+                                 'instead of rebuilding them afterwards.')
+
+    def handle(self, *args, **options):
+        start = default_timer()
+
+        def on_error(number, error):
+            self.stderr.write('row %d: %s' % (number, error))
+
+        def on_progress(rows_done, processed):
+            self.stdout.write('%d rows done (%.0f rows/s)' % (
+                rows_done, processed / (default_timer() - start)))
+
+        imported, rejected = import_voters(options['path'],
+                                           batch_size=options['batch_size'],
+                                           chunk_size=options['chunk_size'],
+                                           defer_indexes=not options['keep_indexes'],
+                                           on_error=on_error,
+                                           on_progress=on_progress)
+        elapsed = default_timer() - start
+        self.stdout.write('Imported %d voters, rejected %d rows in %.1fs (%.0f rows/s).' % (
+            imported, rejected, elapsed, (imported + rejected) / elapsed if elapsed else 0))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...turnout import rebuild_turnout, verify_turnout
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the station and constituency turnout counters from the '
+            'Voter table, or check them with --verify.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Only compare the counters against the Voter table.')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = verify_turnout()
+            for label, expected, stored in mismatches:
+                self.stderr.write('%s: expected %s, stored %s' % (label, expected, stored))
+            if mismatches:
+                raise CommandError('%d turnout counters are out of date.' % len(mismatches))
+            self.stdout.write('Turnout counters are up to date.')
+            return
+
+        station_counts, constituency_counts = rebuild_turnout()
+        self.stdout.write('Rebuilt turnout for %d stations and %d constituencies.' % (
+            len(station_counts), len(constituency_counts)))
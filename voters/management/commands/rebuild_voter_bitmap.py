@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...bitmap import rebuild_voter_bitmap
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the memory-mapped used_vote/active_pin bitmap at '
+            'settings.VOTER_BITMAP_PATH from the Voter table.')
+
+    def handle(self, *args, **options):
+        voters = rebuild_voter_bitmap()
+        if voters is None:
+            raise CommandError('VOTER_BITMAP_PATH is not set.')
+        self.stdout.write('Rebuilt the voter bitmap with %d voters.' % voters)
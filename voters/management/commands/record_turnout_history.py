@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...turnout import record_turnout_history
+
+
+class Command(BaseCommand):
+    help = ('Record the turnout counters that changed since the last run into the '
+            'per-minute turnout history, once or every --interval seconds.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Keep recording, waiting this many seconds between runs.')
+
+    def handle(self, *args, **options):
+        while True:
+            rows = record_turnout_history()
+            self.stdout.write('Recorded %d turnout history rows.' % rows)
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from ...replicas import sync_sqlite
+
+
+class Command(BaseCommand):
+    help = ('Copy the primary SQLite database into every database in '
+            'settings.DATABASE_REPLICAS, once or every --interval seconds.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Keep copying, waiting this many seconds between copies.')
+
+    def handle(self, *args, **options):
+        databases = [settings.DATABASES[alias] for alias in
+                     [DEFAULT_DB_ALIAS] + list(settings.DATABASE_REPLICAS)]
+        if any(not database['ENGINE'].endswith('sqlite3') for database in databases):
+            raise CommandError('sync_replicas only copies SQLite databases.')
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('No DATABASE_REPLICAS are configured (see VOTER_DB_REPLICAS).')
+
+        source = databases[0]['NAME']
+        while True:
+            for alias in settings.DATABASE_REPLICAS:
+                start = time.time()
+                rows = sync_sqlite(source, settings.DATABASES[alias]['NAME'],
+                                   settings.SQLITE_PRAGMAS)
+                self.stdout.write('Copied %d rows to %s in %.2fs.' % (
+                    rows, alias, time.time() - start))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
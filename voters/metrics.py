@@ -0,0 +1,282 @@
+"""
+Per-endpoint request metrics.
+
+MetricsMiddleware records, for every view name (the URL name with its
+namespace, e.g. voters:check_votable or admin:index), a latency
+histogram, request counts by status code, and the number of database
+queries and time spent in them. Queries are timed by a thin cursor wrapper
+installed on each connection (Django's debug cursor is too slow to leave
+on: on SQLite it runs an extra query per statement to log the SQL).
+
+Each worker process aggregates in memory and writes its totals to
+METRICS_DIR/metrics-<pid>-<start time>.json at most every
+METRICS_FLUSH_SECONDS; the metrics view adds up the files of all workers
+and renders them in the Prometheus text format.
+
+Files left by workers that have exited (their pid is gone, or has been
+reused by a later worker with its own start time) are deleted rather than
+counted. Their counts leave the totals with them, so the counters drop when
+a worker exits; Prometheus' rate() and increase() treat a drop as a
+counter reset.
+"""
+import errno
+import json
+import os
+import re
+import threading
+import time
+
+from timeit import default_timer
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+from django.dispatch import receiver
+from django.utils.deprecation import MiddlewareMixin
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+UNMATCHED = 'unmatched'
+
+_lock = threading.Lock()
+_local = threading.local()
+_views = {}
+_last_flush = [default_timer()]
+# (pid, start time in ms) of this process, renewed after a fork
+_process = [None]
+
+METRICS_FILE_REGEX = re.compile(r'^metrics-(\d+)-(\d+)\.json$')
+
+
+def empty_metrics():
+    return {'buckets': [0] * (len(BUCKETS) + 1), 'count': 0, 'seconds': 0.0,
+            'statuses': {}, 'queries': 0, 'db_seconds': 0.0}
+
+
+def record(view, status, seconds, queries, db_seconds):
+    bucket = len(BUCKETS)
+    for index, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            bucket = index
+            break
+    status = str(status)
+    with _lock:
+        metrics = _views.get(view)
+        if metrics is None:
+            metrics = _views[view] = empty_metrics()
+        metrics['buckets'][bucket] += 1
+        metrics['count'] += 1
+        metrics['seconds'] += seconds
+        metrics['statuses'][status] = metrics['statuses'].get(status, 0) + 1
+        metrics['queries'] += queries
+        metrics['db_seconds'] += db_seconds
+
+
+def snapshot():
+    with _lock:
+        return json.loads(json.dumps(_views))
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+# Query timing #
+
+
+class TimedCursorWrapper(CursorWrapper):
+
+    def execute(self, sql, params=None):
+        start = default_timer()
+        try:
+            return super(TimedCursorWrapper, self).execute(sql, params)
+        finally:
+            count_query(default_timer() - start)
+
+    def executemany(self, sql, param_list):
+        start = default_timer()
+        try:
+            return super(TimedCursorWrapper, self).executemany(sql, param_list)
+        finally:
+            count_query(default_timer() - start)
+
+
+def count_query(seconds):
+    queries = getattr(_local, 'queries', None)
+    if queries is not None:
+        queries[0] += 1
+        queries[1] += seconds
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    connection.make_cursor = lambda cursor: TimedCursorWrapper(cursor, connection)
+    connection.make_debug_cursor = lambda cursor: CursorDebugWrapper(
+        TimedCursorWrapper(cursor, connection), connection)
+
+
+# Sharing between worker processes #
+
+
+def current_process():
+    """(pid, start time) identifying this worker's metrics file."""
+    if _process[0] is None or _process[0][0] != os.getpid():
+        _process[0] = (os.getpid(), int(time.time() * 1000))
+    return _process[0]
+
+
+def metrics_path(pid, started):
+    return os.path.join(settings.METRICS_DIR, 'metrics-%d-%d.json' % (pid, started))
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
+
+
+def worker_files():
+    """
+    Paths of the metrics files of the other running workers. Files of
+    exited workers are deleted.
+    """
+    if not os.path.isdir(settings.METRICS_DIR):
+        return []
+    own = current_process()
+    latest = {}
+    ghosts = []
+    for name in os.listdir(settings.METRICS_DIR):
+        match = METRICS_FILE_REGEX.match(name)
+        if match is None:
+            continue
+        pid, started = int(match.group(1)), int(match.group(2))
+        if pid == own[0] and started != own[1] or not is_running(pid):
+            ghosts.append(name)
+        elif pid in latest and latest[pid][0] > started:
+            ghosts.append(name)
+        else:
+            if pid in latest:
+                ghosts.append(latest[pid][1])
+            latest[pid] = (started, name)
+    for name in ghosts:
+        try:
+            os.remove(os.path.join(settings.METRICS_DIR, name))
+        except OSError:
+            pass
+    return [os.path.join(settings.METRICS_DIR, name)
+            for pid, (_, name) in latest.items() if pid != own[0]]
+
+
+def flush():
+    """Write this process's totals for the other workers to read."""
+    _last_flush[0] = default_timer()
+    if not os.path.isdir(settings.METRICS_DIR):
+        os.makedirs(settings.METRICS_DIR)
+    path = metrics_path(*current_process())
+    with open(path + '.tmp', 'w') as out:
+        json.dump(snapshot(), out)
+    os.rename(path + '.tmp', path)
+
+
+def flush_if_due():
+    if default_timer() - _last_flush[0] >= settings.METRICS_FLUSH_SECONDS:
+        flush()
+
+
+def merge(total, metrics):
+    total['buckets'] = [a + b for a, b in zip(total['buckets'], metrics['buckets'])]
+    for name in ('count', 'seconds', 'queries', 'db_seconds'):
+        total[name] += metrics[name]
+    for status, count in metrics['statuses'].items():
+        total['statuses'][status] = total['statuses'].get(status, 0) + count
+
+
+def collect_metrics():
+    """Totals per view over this process and every worker that has flushed."""
+    workers = [snapshot()]
+    for path in worker_files():
+        try:
+            with open(path) as metrics_file:
+                workers.append(json.load(metrics_file))
+        except (IOError, ValueError):
+            continue
+    views = {}
+    for worker in workers:
+        for view, metrics in worker.items():
+            merge(views.setdefault(view, empty_metrics()), metrics)
+    return views
+
+
+def prometheus_text(views):
+    """The Prometheus text exposition of collect_metrics()'s output."""
+    lines = [
+        '# HELP voter_api_request_duration_seconds Time to produce the response.',
+        '# TYPE voter_api_request_duration_seconds histogram',
+    ]
+    for view, metrics in sorted(views.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), metrics['buckets']):
+            cumulative += count
+            lines.append('voter_api_request_duration_seconds_bucket{view="%s",le="%s"} %d' % (
+                view, bound, cumulative))
+        lines.append('voter_api_request_duration_seconds_sum{view="%s"} %r' % (view, metrics['seconds']))
+        lines.append('voter_api_request_duration_seconds_count{view="%s"} %d' % (view, metrics['count']))
+
+    lines += ['# HELP voter_api_requests_total Responses by status code.',
+              '# TYPE voter_api_requests_total counter']
+    for view, metrics in sorted(views.items()):
+        for status, count in sorted(metrics['statuses'].items()):
+            lines.append('voter_api_requests_total{view="%s",status="%s"} %d' % (view, status, count))
+
+    lines += ['# HELP voter_api_db_queries_total Database queries run by requests.',
+              '# TYPE voter_api_db_queries_total counter']
+    lines += ['voter_api_db_queries_total{view="%s"} %d' % (view, metrics['queries'])
+              for view, metrics in sorted(views.items())]
+
+    lines += ['# HELP voter_api_db_seconds_total Time spent in database queries.',
+              '# TYPE voter_api_db_seconds_total counter']
+    lines += ['voter_api_db_seconds_total{view="%s"} %r' % (view, metrics['db_seconds'])
+              for view, metrics in sorted(views.items())]
+    return '\n'.join(lines) + '\n'
+
+
+# Middleware #
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """Records every request; should come first in MIDDLEWARE_CLASSES."""
+
+    def process_request(self, request):
+        request._metrics_start = default_timer()
+        _local.queries = [0, 0.0]
+
+    def process_response(self, request, response):
+        start = getattr(request, '_metrics_start', None)
+        if start is None:
+            return response
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else UNMATCHED
+        if response.streaming:
+            # Streamed bodies run their queries while being sent
+            response.streaming_content = self.finish_streaming(
+                response.streaming_content, view, response.status_code, start)
+        else:
+            self.finish(view, response.status_code, start)
+        return response
+
+    def finish_streaming(self, content, view, status, start):
+        try:
+            for chunk in content:
+                yield chunk
+        finally:
+            self.finish(view, status, start)
+
+    def finish(self, view, status, start):
+        queries, db_seconds = getattr(_local, 'queries', None) or (0, 0.0)
+        _local.queries = None
+        record(view, status, default_timer() - start, queries, db_seconds)
+        flush_if_due()
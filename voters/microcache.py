@@ -0,0 +1,80 @@
+"""
+In-process micro-cache for polled responses.
+
+Dashboards poll voter_turnout and booths re-fetch get_candidates, so a
+burst of identical requests would otherwise recompute the same body many
+times over. MicroCache keeps each computed value for MICRO_CACHE_SECONDS;
+a burst of requests for a missing key computes it once while the others
+wait for the result. For MICRO_CACHE_STALE_SECONDS after expiry the old
+value is still served while a single request recomputes it
+(stale-while-revalidate). Each worker has its own cache, so a value can
+be up to MICRO_CACHE_SECONDS (plus the stale window) out of date.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Keys share a fixed pool of locks rather than having one each, so the
+# locks don't grow with the number of keys ever seen
+LOCK_STRIPES = 64
+
+
+class MicroCache(object):
+
+    def __init__(self):
+        self._entries = {}
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def _lock(self, key):
+        return self._locks[hash(key) % LOCK_STRIPES]
+
+    def get(self, key, compute, ttl, stale=0):
+        """
+        The cached value of key, computing it with compute() when needed.
+        None results are not cached.
+        """
+        if ttl <= 0:
+            return compute()
+        entry = self._entries.get(key)
+        if entry is not None and time.time() < entry[1]:
+            return entry[0]
+
+        lock = self._lock(key)
+        if entry is not None and time.time() < entry[1] + stale:
+            if not lock.acquire(False):
+                # Another request is already recomputing it
+                return entry[0]
+        else:
+            lock.acquire()
+            entry = self._entries.get(key)
+            if entry is not None and time.time() < entry[1]:
+                lock.release()
+                return entry[0]
+        try:
+            value = compute()
+            if value is not None:
+                self._entries[key] = (value, time.time() + ttl)
+            return value
+        finally:
+            lock.release()
+
+    def clear(self):
+        self._entries.clear()
+
+
+micro_cache = MicroCache()
+
+
+def micro_cached(key, compute):
+    """micro_cache.get() with the MICRO_CACHE_* settings."""
+    return micro_cache.get(key, compute, settings.MICRO_CACHE_SECONDS,
+                           settings.MICRO_CACHE_STALE_SECONDS)
+
+
+@receiver(setting_changed)
+def clear_micro_cache(setting, **kwargs):
+    if setting.startswith('MICRO_CACHE_'):
+        micro_cache.clear()
@@ -0,0 +1,68 @@
+"""
+Browser-only versions of Django's middleware.
+
+The API is called by booths and services that authenticate with API keys
+and never send cookies, so sessions, CSRF, authentication, messages and
+clickjacking protection are pure overhead on those requests. Each class
+below behaves exactly like the Django middleware it extends, except that
+while settings.LEAN_API_MIDDLEWARE is on it does nothing for requests
+outside settings.FULL_MIDDLEWARE_PATH_PREFIXES (the admin).
+"""
+from django.conf import settings
+from django.contrib.auth import middleware as auth
+from django.contrib.messages import middleware as messages
+from django.contrib.sessions import middleware as sessions
+from django.middleware import clickjacking, csrf
+
+HOOKS = ('process_request', 'process_view', 'process_exception',
+         'process_template_response')
+
+
+def is_api_request(request):
+    """True if the request should skip the browser-oriented middleware."""
+    try:
+        return request._lean_middleware
+    except AttributeError:
+        request._lean_middleware = settings.LEAN_API_MIDDLEWARE and \
+            not request.path_info.startswith(tuple(settings.FULL_MIDDLEWARE_PATH_PREFIXES))
+        return request._lean_middleware
+
+
+def _skip_for_api(cls, hook):
+    def method(self, request, *args, **kwargs):
+        if is_api_request(request):
+            return None
+        return getattr(super(cls, self), hook)(request, *args, **kwargs)
+    method.__name__ = str(hook)
+    return method
+
+
+def _pass_response_for_api(cls):
+    def process_response(self, request, response):
+        if is_api_request(request):
+            return response
+        return super(cls, self).process_response(request, response)
+    return process_response
+
+
+def browser_only(middleware_class):
+    """Subclass middleware_class so that it ignores API requests."""
+    class BrowserOnlyMiddleware(middleware_class):
+        pass
+
+    for hook in HOOKS:
+        if hasattr(middleware_class, hook):
+            setattr(BrowserOnlyMiddleware, hook, _skip_for_api(BrowserOnlyMiddleware, hook))
+    if hasattr(middleware_class, 'process_response'):
+        setattr(BrowserOnlyMiddleware, 'process_response',
+                _pass_response_for_api(BrowserOnlyMiddleware))
+    BrowserOnlyMiddleware.__name__ = middleware_class.__name__
+    return BrowserOnlyMiddleware
+
+
+SessionMiddleware = browser_only(sessions.SessionMiddleware)
+CsrfViewMiddleware = browser_only(csrf.CsrfViewMiddleware)
+AuthenticationMiddleware = browser_only(auth.AuthenticationMiddleware)
+SessionAuthenticationMiddleware = browser_only(auth.SessionAuthenticationMiddleware)
+MessageMiddleware = browser_only(messages.MessageMiddleware)
+XFrameOptionsMiddleware = browser_only(clickjacking.XFrameOptionsMiddleware)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 19:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_existing_voters(apps, schema_editor):
+    Constituency = apps.get_model('voters', 'Constituency')
+    Station = apps.get_model('voters', 'Station')
+    Voter = apps.get_model('voters', 'Voter')
+    StationTurnout = apps.get_model('voters', 'StationTurnout')
+    ConstituencyTurnout = apps.get_model('voters', 'ConstituencyTurnout')
+    db = schema_editor.connection.alias
+
+    totals = dict((pk, [0, 0]) for pk in Constituency.objects.using(db).values_list('pk', flat=True))
+    for station in Station.objects.using(db):
+        registered_voters = Voter.objects.using(db).filter(station=station).count()
+        voted = Voter.objects.using(db).filter(station=station, used_vote=True).count()
+        StationTurnout.objects.using(db).create(station=station, registered_voters=registered_voters, voted=voted)
+        totals[station.constituency_id][0] += registered_voters
+        totals[station.constituency_id][1] += voted
+    for pk, (registered_voters, voted) in totals.items():
+        ConstituencyTurnout.objects.using(db).create(constituency_id=pk, registered_voters=registered_voters, voted=voted)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voters', '0005_auto_20170612_1409'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConstituencyTurnout',
+            fields=[
+                ('constituency', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='turnout', serialize=False, to='voters.Constituency')),
+                ('registered_voters', models.IntegerField(default=0)),
+                ('voted', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StationTurnout',
+            fields=[
+                ('station', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='turnout', serialize=False, to='voters.Station')),
+                ('registered_voters', models.IntegerField(default=0)),
+                ('voted', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_existing_voters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 19:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_existing_names(apps, schema_editor):
+    Voter = apps.get_model('voters', 'Voter')
+    VoterNameTrigram = apps.get_model('voters', 'VoterNameTrigram')
+    db = schema_editor.connection.alias
+
+    trigrams = []
+    for pk, first_name in Voter.objects.using(db).values_list('pk', 'first_name').iterator():
+        name = first_name.lower()
+        for trigram in set(name[i:i + 3] for i in range(len(name) - 2)):
+            trigrams.append(VoterNameTrigram(voter_id=pk, trigram=trigram))
+        if len(trigrams) >= 5000:
+            VoterNameTrigram.objects.using(db).bulk_create(trigrams)
+            trigrams = []
+    VoterNameTrigram.objects.using(db).bulk_create(trigrams)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voters', '0006_turnout_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoterNameTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('voter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_trigrams', to='voters.Voter')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='voternametrigram',
+            unique_together=set([('trigram', 'voter')]),
+        ),
+        migrations.RunPython(index_existing_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 19:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# Partial index for counting votes cast per station. SQLite cannot use a
+# partial index when the boolean is a bound parameter, which is how Django
+# emits it, so there the (station, used_vote) index above serves instead.
+PARTIAL_INDEX_SQL = {
+    'postgresql': 'CREATE INDEX voter_voted_station_idx ON voters_voter (station_id) WHERE used_vote',
+}
+
+
+def create_partial_index(apps, schema_editor):
+    sql = PARTIAL_INDEX_SQL.get(schema_editor.connection.vendor)
+    if sql:
+        schema_editor.execute(sql)
+
+
+def drop_partial_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_SQL:
+        schema_editor.execute('DROP INDEX voter_voted_station_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voters', '0007_voter_name_trigrams'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['station', 'postcode'], name='voter_station_postcode_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['station', 'used_vote'], name='voter_station_used_vote_idx'),
+        ),
+        migrations.RunPython(create_partial_index, drop_partial_index),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 19:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F, Func, Value
+from django.db.models.functions import Upper
+
+
+def fill_postcode_keys(apps, schema_editor):
+    # One UPDATE per table. Stored postcodes passed POSTCODE_REGEX, so a
+    # single space is the only whitespace normalize_postcode() has to drop.
+    postcode_key = Upper(Func(F('postcode'), Value(' '), Value(''), function='REPLACE'))
+    for model_name in ('Station', 'Voter'):
+        apps.get_model('voters', model_name).objects.using(
+            schema_editor.connection.alias).update(postcode_key=postcode_key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voters', '0009_voter_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='station',
+            name='postcode_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=8, serialize=False),
+        ),
+        migrations.AddField(
+            model_name='voter',
+            name='postcode_key',
+            field=models.CharField(default='', editable=False, max_length=8, serialize=False),
+        ),
+        migrations.RunPython(fill_postcode_keys, migrations.RunPython.noop),
+        # Built after the backfill rather than maintained through it
+        migrations.RemoveIndex(
+            model_name='voter',
+            name='voter_station_postcode_idx',
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['station', 'postcode_key'], name='voter_station_postcode_key_idx'),
+        ),
+    ]
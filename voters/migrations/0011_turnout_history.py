@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 20:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voters', '0010_postcode_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConstituencyTurnoutHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.DateTimeField()),
+                ('registered_voters', models.IntegerField()),
+                ('voted', models.IntegerField()),
+                ('constituency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turnout_history', to='voters.Constituency')),
+            ],
+            options={
+                'verbose_name_plural': 'constituency turnout history',
+            },
+        ),
+        migrations.CreateModel(
+            name='StationTurnoutHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.DateTimeField()),
+                ('registered_voters', models.IntegerField()),
+                ('voted', models.IntegerField()),
+                ('station', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turnout_history', to='voters.Station')),
+            ],
+            options={
+                'verbose_name_plural': 'station turnout history',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stationturnouthistory',
+            index=models.Index(fields=['minute'], name='station_history_minute_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stationturnouthistory',
+            unique_together=set([('station', 'minute')]),
+        ),
+        migrations.AddIndex(
+            model_name='constituencyturnouthistory',
+            index=models.Index(fields=['minute'], name='constit_history_minute_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='constituencyturnouthistory',
+            unique_together=set([('constituency', 'minute')]),
+        ),
+    ]
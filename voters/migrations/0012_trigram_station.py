@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 21:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_trigram_stations(apps, schema_editor):
+    # One UPDATE, copying each row's station from its voter
+    Voter = apps.get_model('voters', 'Voter')
+    VoterNameTrigram = apps.get_model('voters', 'VoterNameTrigram')
+    VoterNameTrigram.objects.using(schema_editor.connection.alias).update(station=Subquery(
+        Voter.objects.filter(pk=OuterRef('voter')).values('station')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voters', '0011_turnout_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voternametrigram',
+            name='station',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='voters.Station'),
+        ),
+        migrations.RunPython(fill_trigram_stations, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='voternametrigram',
+            name='station',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='voters.Station'),
+        ),
+        migrations.AddIndex(
+            model_name='voternametrigram',
+            index=models.Index(fields=['trigram', 'station', 'voter'], name='trigram_station_voter_idx'),
+        ),
+    ]
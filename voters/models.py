@@ -1,6 +1,13 @@
 from __future__ import unicode_literals
 
-from django.db import models
+from collections import Counter
+
+from django.db import models, router, transaction
+from django.db.models import Case, Count, F, Value, When
+
+from .bitmap import PLANES, forget_voters_after_commit, set_flag_after_commit
+from .shards import ShardedQuerySet, group_by_shard, shard_for_constituency, shard_for_id, \
+using_shard
 
 
 class Constituency(models.Model):
@@ -16,12 +23,28 @@ class Constituency(models.Model):
         verbose_name_plural = "constituencies"
 
 
+def normalize_postcode(postcode):
+    """The postcode uppercased without whitespace: 'sw7 3bh' -> 'SW73BH'."""
+    return ''.join(postcode.split()).upper()
+
+
+def set_postcode_key(instance, save_kwargs):
+    """Refresh instance.postcode_key from its postcode ahead of save()."""
+    instance.postcode_key = normalize_postcode(instance.postcode)
+    update_fields = save_kwargs.get('update_fields')
+    if update_fields is not None and 'postcode' in update_fields:
+        save_kwargs['update_fields'] = set(update_fields) | {'postcode_key'}
+
+
 class Station(models.Model):
     # Station Location
     name = models.CharField(max_length=100)
     addr_line_1 = models.CharField(max_length=100)
     addr_line_2 = models.CharField(max_length=100, null=True, blank=True)
     postcode = models.CharField(max_length=8)
+    # normalize_postcode(postcode), kept up to date by save()
+    postcode_key = models.CharField(max_length=8, db_index=True, editable=False,
+                                    serialize=False, default='')
 
     # Station Constituency
     constituency = models.ForeignKey(
@@ -29,10 +52,194 @@ class Station(models.Model):
         on_delete=models.CASCADE
     )
 
+    objects = models.Manager.from_queryset(ShardedQuerySet)()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        station = super(Station, cls).from_db(db, field_names, values)
+        station._loaded_constituency_id = station.__dict__.get('constituency_id')
+        return station
+
+    def save(self, *args, **kwargs):
+        previous = getattr(self, '_loaded_constituency_id', None)
+        set_postcode_key(self, kwargs)
+        using = kwargs.get('using') or router.db_for_write(Station, instance=self)
+        if previous is not None and \
+                shard_for_constituency(previous) != shard_for_constituency(self.constituency_id):
+            raise ValueError('A station cannot move to a constituency in another shard.')
+        with using_shard(using), transaction.atomic(using=using):
+            super(Station, self).save(*args, **kwargs)
+            if previous is not None and previous != self.constituency_id:
+                move_station_turnout(self.pk, previous, self.constituency_id)
+        self._loaded_constituency_id = self.constituency_id
+
     def __str__(self):
         return self.name
 
 
+# Outcomes of a conditional flag update on a voter
+CHANGED = 'changed'
+ALREADY_SET = 'already_set'
+NOT_FOUND = 'not_found'
+
+# Largest id the database can store (a signed 64-bit integer)
+MAX_ID = 2 ** 63 - 1
+
+
+# Voter fields QuerySet.update() refuses, as only save() keeps what is
+# derived from them in step
+SAVE_ONLY_FIELDS = ('station', 'station_id', 'first_name')
+
+# Length of the name fragments kept in the VoterNameTrigram search index
+TRIGRAM_LENGTH = 3
+
+
+def name_trigrams(name):
+    """The set of lowercased three-character fragments of a name."""
+    name = name.lower()
+    return set(name[i:i + TRIGRAM_LENGTH] for i in range(len(name) - TRIGRAM_LENGTH + 1))
+
+
+class VoterQuerySet(ShardedQuerySet):
+
+    def name_contains(self, name, station=None):
+        """
+        Equivalent to first_name__icontains=name, but narrowed first through
+        the VoterNameTrigram index: a voter can only contain the name if
+        they have every one of its trigrams. Given a station, only that
+        station's trigrams are counted, so the cost follows the station's
+        matches rather than the whole roll's. Names shorter than a trigram
+        fall back to the plain filter.
+        """
+        trigrams = name_trigrams(name)
+        if trigrams:
+            candidates = VoterNameTrigram.objects.filter(trigram__in=trigrams)
+            if station is not None:
+                candidates = candidates.filter(station=station)
+            candidates = candidates.order_by().values('voter') \
+                .annotate(matched=Count('trigram')) \
+                .filter(matched=len(trigrams)).values('voter')
+            self = self.filter(pk__in=candidates)
+        return self.filter(first_name__icontains=name)
+
+    def update(self, **kwargs):
+        # Bulk flag updates bypass save() and the bitmap bookkeeping of the
+        # VoterManager methods, so the voters they touch are dropped from the
+        # bitmap until it is rebuilt. used_vote updates adjust the turnout
+        # counters themselves; station and name changes need save().
+        refused = set(kwargs) & set(SAVE_ONLY_FIELDS)
+        if refused:
+            raise ValueError('Change %s with Voter.save(), which keeps the turnout counters '
+                             'and name index in step.' % ', '.join(sorted(refused)))
+        if not set(kwargs) & set(PLANES):
+            return super(VoterQuerySet, self).update(**kwargs)
+        with using_shard(self.db), transaction.atomic(using=self.db):
+            forget_voters_after_commit(self.values_list('pk', flat=True))
+            if 'used_vote' in kwargs:
+                self._count_votes(kwargs['used_vote'])
+            return super(VoterQuerySet, self).update(**kwargs)
+
+    def _count_votes(self, used_vote):
+        # Move the voted counters of the voters whose used_vote changes
+        if hasattr(used_vote, 'resolve_expression'):
+            raise ValueError('used_vote can only be updated to True or False.')
+        rows = self.select_for_update().filter(used_vote=not used_vote).values_list(
+            'station', 'station__constituency')
+        delta = 1 if used_vote else -1
+        stations, constituencies = Counter(), Counter()
+        for station_id, constituency_id in rows:
+            stations[station_id] += delta
+            constituencies[constituency_id] += delta
+        add_votes(StationTurnout, 'station_id', stations)
+        add_votes(ConstituencyTurnout, 'constituency_id', constituencies)
+
+    def _update_flag(self, **kwargs):
+        # update() for the VoterManager methods, which update the bitmap
+        # themselves
+        return super(VoterQuerySet, self).update(**kwargs)
+
+
+class RacedUpdate(Exception):
+    pass
+
+
+class VoterManager(models.Manager.from_queryset(VoterQuerySet)):
+
+    def _set_flag(self, voter_id, flag):
+        # A single conditional UPDATE touching only the flag: at most one
+        # caller can ever flip it, however many booths race on the voter.
+        alias = shard_for_id(voter_id)
+        with using_shard(alias):
+            with transaction.atomic(using=alias):
+                if self.filter(pk=voter_id, **{flag: False})._update_flag(**{flag: True}):
+                    if flag == 'used_vote':
+                        adjust_voter_turnout(voter_id, voted=1)
+                    set_flag_after_commit([voter_id], flag)
+                    return CHANGED
+            return ALREADY_SET if self.filter(pk=voter_id).exists() else NOT_FOUND
+
+    def _set_flags(self, voter_ids, flag):
+        # Set-based version of _set_flag: one locking read to classify the
+        # ids, then one UPDATE for all of the voters that still need it.
+        # One transaction per shard.
+        outcomes = dict((pk, NOT_FOUND) for pk in voter_ids)
+        for alias, ids in group_by_shard(voter_ids).items():
+            with using_shard(alias), transaction.atomic(using=alias):
+                self._set_shard_flags(ids, flag, outcomes)
+        return outcomes
+
+    def _unset_flags(self, voter_ids, flag, outcomes):
+        """
+        {voter id: (station id, constituency id)} for the voters whose flag is
+        not set yet; marks the others ALREADY_SET in outcomes.
+        """
+        rows = self.select_for_update().filter(pk__in=voter_ids).values_list(
+            'pk', 'station', 'station__constituency', flag)
+        keys = {}
+        for pk, station_id, constituency_id, is_set in rows:
+            outcomes[pk] = ALREADY_SET
+            if not is_set:
+                keys[pk] = (station_id, constituency_id)
+        return keys
+
+    def _set_shard_flags(self, voter_ids, flag, outcomes):
+        # _set_flags for the voters of the current shard
+        keys = self._unset_flags(voter_ids, flag, outcomes)
+        if not keys:
+            return
+        changed = list(keys)
+        try:
+            with transaction.atomic(using=self.db):
+                if self.filter(pk__in=changed, **{flag: False})._update_flag(
+                        **{flag: True}) != len(changed):
+                    raise RacedUpdate
+        except RacedUpdate:
+            # Another transaction set some of the flags after the read
+            # (select_for_update() does not lock on SQLite): settle each
+            # voter with its own conditional UPDATE, as _set_flag does.
+            changed = [pk for pk in changed
+                       if self.filter(pk=pk, **{flag: False})._update_flag(**{flag: True})]
+        for pk in changed:
+            outcomes[pk] = CHANGED
+        set_flag_after_commit(changed, flag)
+        if flag == 'used_vote':
+            add_votes(StationTurnout, 'station_id', Counter(keys[pk][0] for pk in changed))
+            add_votes(ConstituencyTurnout, 'constituency_id',
+                      Counter(keys[pk][1] for pk in changed))
+
+    def mark_used_vote(self, voter_id):
+        return self._set_flag(voter_id, 'used_vote')
+
+    def mark_active_pin(self, voter_id):
+        return self._set_flag(voter_id, 'active_pin')
+
+    def mark_used_votes(self, voter_ids):
+        return self._set_flags(voter_ids, 'used_vote')
+
+    def mark_active_pins(self, voter_ids):
+        return self._set_flags(voter_ids, 'active_pin')
+
+
 class Voter(models.Model):
     # Voter Name
     first_name = models.CharField(max_length=100)
@@ -42,6 +249,8 @@ class Voter(models.Model):
     addr_line_1 = models.CharField(max_length=100)
     addr_line_2 = models.CharField(max_length=100, null=True, blank=True)
     postcode = models.CharField(max_length=8)
+    # normalize_postcode(postcode), kept up to date by save(); what get_voters matches on
+    postcode_key = models.CharField(max_length=8, editable=False, serialize=False, default='')
 
     # Voter Details
     date_of_birth = models.DateField()
@@ -59,10 +268,98 @@ class Voter(models.Model):
     # Has a PIN been created for a voter?
     active_pin = models.BooleanField(default=False)
 
+    objects = VoterManager()
+
+    class Meta:
+        indexes = [
+            # get_voters: station lookups narrowed by postcode
+            models.Index(fields=['station', 'postcode_key'], name='voter_station_postcode_key_idx'),
+            # Turnout recounts: votes cast per station
+            models.Index(fields=['station', 'used_vote'], name='voter_station_used_vote_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        voter = super(Voter, cls).from_db(db, field_names, values)
+        voter._loaded_turnout = (voter.__dict__.get('station_id'),
+                                 voter.__dict__.get('used_vote'))
+        voter._loaded_first_name = voter.__dict__.get('first_name')
+        return voter
+
+    def save(self, *args, **kwargs):
+        # Keep the turnout counters and the name index in step with the
+        # row, in the same transaction as the write itself.
+        previous = getattr(self, '_loaded_turnout', None)
+        current = (self.station_id, self.used_vote)
+        reindex_name = getattr(self, '_loaded_first_name', None) != self.first_name
+        set_postcode_key(self, kwargs)
+        using = kwargs.get('using') or router.db_for_write(Voter, instance=self)
+        if previous is not None and shard_for_id(previous[0]) != shard_for_id(self.station_id):
+            raise ValueError('A voter cannot move to a station in another shard.')
+        with using_shard(using), transaction.atomic(using=using):
+            super(Voter, self).save(*args, **kwargs)
+            if previous != current:
+                if previous is not None:
+                    adjust_turnout(previous[0], registered=-1,
+                                   voted=-int(bool(previous[1])))
+                adjust_turnout(current[0], registered=1,
+                               voted=int(bool(current[1])))
+            if reindex_name:
+                VoterNameTrigram.objects.filter(voter=self).delete()
+                VoterNameTrigram.objects.bulk_create(
+                    VoterNameTrigram(voter=self, station_id=self.station_id, trigram=trigram)
+                    for trigram in name_trigrams(self.first_name))
+            elif previous is not None and previous[0] != self.station_id:
+                VoterNameTrigram.objects.filter(voter=self).update(station=self.station_id)
+        self._loaded_turnout = current
+        self._loaded_first_name = self.first_name
+
     def __str__(self):
         return self.first_name + ' ' + self.last_name
 
 
+class VoterNameTrigram(models.Model):
+    # Search index for Voter.first_name, one row per distinct trigram
+    voter = models.ForeignKey(
+        Voter,
+        on_delete=models.CASCADE,
+        related_name='name_trigrams'
+    )
+
+    # Copy of voter.station, kept up to date by Voter.save(), so that a
+    # search can be confined to one station
+    station = models.ForeignKey(
+        Station,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_index=False
+    )
+
+    trigram = models.CharField(max_length=TRIGRAM_LENGTH)
+
+    def __str__(self):
+        return self.trigram
+
+    class Meta:
+        unique_together = ('trigram', 'voter')
+        indexes = [
+            # name_contains: one station's voters with a trigram
+            models.Index(fields=['trigram', 'station', 'voter'],
+                         name='trigram_station_voter_idx'),
+        ]
+
+
+class VoterImport(models.Model):
+    # Progress of a resumable import_voters run, committed together with
+    # each batch of imported rows
+    source = models.CharField(max_length=255, unique=True)
+    rows_done = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.source + ' - ' + str(self.rows_done) + ' rows'
+
+
 class Party(models.Model):
     name = models.CharField(max_length=100)
 
@@ -93,3 +390,147 @@ class Candidate(models.Model):
 
     def __str__(self):
         return self.first_name + ' ' + self.last_name + ' - ' + str(self.constituency) + ' - ' + str(self.party)
+
+
+# Turnout Counters #
+
+
+class StationTurnout(models.Model):
+    station = models.OneToOneField(
+        Station,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='turnout'
+    )
+
+    registered_voters = models.IntegerField(default=0)
+    voted = models.IntegerField(default=0)
+
+    def __str__(self):
+        return str(self.station) + ' - ' + str(self.voted) + '/' + str(self.registered_voters)
+
+
+class ConstituencyTurnout(models.Model):
+    constituency = models.OneToOneField(
+        Constituency,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='turnout'
+    )
+
+    registered_voters = models.IntegerField(default=0)
+    voted = models.IntegerField(default=0)
+
+    def __str__(self):
+        return str(self.constituency) + ' - ' + str(self.voted) + '/' + str(self.registered_voters)
+
+
+# Turnout History #
+# The counters above as they stood at the end of each minute, recorded by
+# turnout.record_turnout_history() only for the minutes in which they changed
+
+
+class StationTurnoutHistory(models.Model):
+    station = models.ForeignKey(
+        Station,
+        on_delete=models.CASCADE,
+        related_name='turnout_history'
+    )
+
+    minute = models.DateTimeField()
+    registered_voters = models.IntegerField()
+    voted = models.IntegerField()
+
+    def __str__(self):
+        return str(self.station) + ' @ ' + str(self.minute) + ' - ' + str(self.voted) + '/' + str(self.registered_voters)
+
+    class Meta:
+        unique_together = ('station', 'minute')
+        verbose_name_plural = "station turnout history"
+        indexes = [
+            # turnout_history: every station over a time range
+            models.Index(fields=['minute'], name='station_history_minute_idx'),
+        ]
+
+
+class ConstituencyTurnoutHistory(models.Model):
+    constituency = models.ForeignKey(
+        Constituency,
+        on_delete=models.CASCADE,
+        related_name='turnout_history'
+    )
+
+    minute = models.DateTimeField()
+    registered_voters = models.IntegerField()
+    voted = models.IntegerField()
+
+    def __str__(self):
+        return str(self.constituency) + ' @ ' + str(self.minute) + ' - ' + str(self.voted) + '/' + str(self.registered_voters)
+
+    class Meta:
+        unique_together = ('constituency', 'minute')
+        verbose_name_plural = "constituency turnout history"
+        indexes = [
+            # turnout_history: every constituency over a time range
+            models.Index(fields=['minute'], name='constit_history_minute_idx'),
+        ]
+
+
+def adjust_turnout(station_id, registered=0, voted=0):
+    """
+    Apply a delta to the turnout counters of a station and of the
+    constituency it belongs to. Must be called inside the transaction
+    that changed the underlying Voter rows.
+    """
+    if not registered and not voted:
+        return
+    changes = {'registered_voters': F('registered_voters') + registered,
+               'voted': F('voted') + voted}
+    StationTurnout.objects.filter(station_id=station_id).update(**changes)
+    ConstituencyTurnout.objects.filter(
+        constituency__station=station_id).update(**changes)
+
+
+# Keeps each add_votes UPDATE well under SQLite's 999 parameter limit
+ADD_VOTES_CHUNK = 400
+
+
+def add_votes(model, key, votes):
+    """
+    Add votes[pk] to the voted counter of each StationTurnout or
+    ConstituencyTurnout (model) row whose key is pk, in one UPDATE per
+    ADD_VOTES_CHUNK rows rather than one per row.
+    """
+    votes = sorted(votes.items())
+    for start in range(0, len(votes), ADD_VOTES_CHUNK):
+        chunk = votes[start:start + ADD_VOTES_CHUNK]
+        pks_by_delta = {}
+        for pk, delta in chunk:
+            pks_by_delta.setdefault(delta, []).append(pk)
+        model.objects.filter(**{key + '__in': [pk for pk, _ in chunk]}).update(
+            voted=F('voted') + Case(
+                *[When(then=Value(delta), **{key + '__in': pks})
+                  for delta, pks in pks_by_delta.items()],
+                default=Value(0), output_field=models.IntegerField()))
+
+
+def adjust_voter_turnout(voter_id, voted):
+    """Like adjust_turnout, for the station a voter is registered to."""
+    changes = {'voted': F('voted') + voted}
+    StationTurnout.objects.filter(station__voter=voter_id).update(**changes)
+    ConstituencyTurnout.objects.filter(
+        constituency__station__voter=voter_id).update(**changes)
+
+
+def move_station_turnout(station_id, old_constituency_id, new_constituency_id):
+    """Move a station's counts from one constituency's totals to another's."""
+    counts = StationTurnout.objects.filter(station_id=station_id).values(
+        'registered_voters', 'voted').first()
+    if counts is None:
+        return
+    ConstituencyTurnout.objects.filter(constituency_id=old_constituency_id).update(
+        registered_voters=F('registered_voters') - counts['registered_voters'],
+        voted=F('voted') - counts['voted'])
+    ConstituencyTurnout.objects.filter(constituency_id=new_constituency_id).update(
+        registered_voters=F('registered_voters') + counts['registered_voters'],
+        voted=F('voted') + counts['voted'])
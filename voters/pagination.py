@@ -0,0 +1,71 @@
+"""
+Keyset (cursor) pagination for list endpoints.
+
+A page is read as WHERE id > <last id of the previous page> ORDER BY id
+LIMIT page_size + 1, the extra row only telling whether another page
+follows. Unlike OFFSET paging no skipped rows are read and discarded, so
+a page deep into a long list costs the same as the first one, and rows
+inserted meanwhile never shift a page boundary.
+
+The cursor handed to clients is the last id of the page, signed so that
+it stays opaque and cannot be edited by hand.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core import signing
+from django.utils import six
+
+CURSOR_SALT = 'voters.pagination.cursor'
+
+Page = namedtuple('Page', ['size', 'after'])
+
+
+def encode_cursor(pk):
+    return signing.dumps(pk, salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor):
+    """The id a cursor resumes after. Raises ValueError for a bad cursor."""
+    try:
+        pk = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise ValueError('Invalid cursor.')
+    if not isinstance(pk, six.integer_types):
+        raise ValueError('Invalid cursor.')
+    return pk
+
+
+def parse_page(query):
+    """
+    The Page requested by the page_size and cursor query parameters, or
+    None if the client asked for neither and gets the whole list. Raises
+    ValueError if either is not valid.
+    """
+    page_size = query.get('page_size')
+    cursor = query.get('cursor')
+    if page_size is None and cursor is None:
+        return None
+    if page_size is None:
+        page_size = settings.LIST_PAGE_SIZE
+    else:
+        try:
+            page_size = int(page_size)
+        except ValueError:
+            page_size = 0
+        if not 0 < page_size <= settings.LIST_PAGE_MAX_SIZE:
+            raise ValueError('page_size must be between 1 and %d.' % settings.LIST_PAGE_MAX_SIZE)
+    return Page(page_size, decode_cursor(cursor) if cursor else None)
+
+
+def keyset_page(rows, page):
+    """
+    The rows of a values_list() queryset (pk first) on page, and the cursor
+    of the page after it or None if this is the last one.
+    """
+    if page.after is not None:
+        rows = rows.filter(pk__gt=page.after)
+    rows = list(rows.order_by('pk')[:page.size + 1])
+    if len(rows) > page.size:
+        return rows[:page.size], encode_cursor(rows[page.size - 1][0])
+    return rows, None
@@ -0,0 +1,126 @@
+"""
+Serialize querysets from values_list() rows instead of model instances.
+
+serializers.serialize() builds a model instance for every row and then
+walks all of its fields. A Projection reads only the columns a response
+asks for with values_list() and writes the same {"model", "pk", "fields"}
+records itself, so with every field selected its output is byte for byte
+what serializers.serialize("json", ...) produces.
+
+The columns format drops the per-record envelope and field names
+altogether: {"pk": [...], "first_name": [...], ...}, one list per field.
+"""
+import json
+
+from collections import OrderedDict
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.encoding import force_text
+
+from .models import Candidate, Voter
+from .pagination import keyset_page
+from .streaming import CHUNK_SIZE, json_list_stream
+
+RECORDS = 'records'
+COLUMNS = 'columns'
+FORMATS = (RECORDS, COLUMNS)
+
+
+class Projection(object):
+
+    def __init__(self, model, lookups=None):
+        """
+        Project the fields serializers.serialize() would write for model.
+        lookups maps a field name to the values() lookup to read it from
+        instead, e.g. 'party__name' for a natural foreign key.
+        """
+        lookups = lookups or {}
+        self.label = force_text(model._meta)
+        self.lookups = OrderedDict(
+            (field.name, lookups.get(field.name, field.name))
+            for field in model._meta.concrete_model._meta.local_fields if field.serialize)
+        self.encoder = DjangoJSONEncoder()
+
+    def select(self, fields=None):
+        """
+        The names of the selected fields in model order; None selects all of
+        them. Raises ValueError for a name that is not a projected field.
+        """
+        if fields is None:
+            return list(self.lookups)
+        unknown = set(fields) - set(self.lookups)
+        if unknown:
+            raise ValueError('Unknown fields: %s. Expected any of: %s.' % (
+                ', '.join(sorted(unknown)), ', '.join(self.lookups)))
+        return [name for name in self.lookups if name in fields]
+
+    def rows(self, queryset, names):
+        """queryset as values_list() rows of the pk followed by the named fields."""
+        return queryset.values_list('pk', *[self.lookups[name] for name in names])
+
+    def encode_records(self, rows, names, chunk_size=CHUNK_SIZE):
+        rows = iter(rows)
+        separator = ''
+        while True:
+            chunk = [OrderedDict([('model', self.label), ('pk', row[0]),
+                                  ('fields', OrderedDict(zip(names, row[1:])))])
+                     for row in islice(rows, chunk_size)]
+            if not chunk:
+                return
+            yield separator + self.encoder.encode(chunk)[1:-1]
+            separator = ', '
+
+    def encode_columns(self, rows, names):
+        columns = OrderedDict((name, []) for name in ['pk'] + names)
+        appends = [column.append for column in columns.values()]
+        count = 0
+        for row in rows:
+            count += 1
+            for append, value in zip(appends, row):
+                append(value)
+        return self.encoder.encode(columns), count
+
+
+VOTER_PROJECTION = Projection(Voter)
+# get_candidates names the constituency and party rather than giving their ids
+CANDIDATE_PROJECTION = Projection(Candidate, {'constituency': 'constituency__name',
+                                              'party': 'party__name'})
+
+
+def parse_projection(query, projection):
+    """
+    Read the optional fields=<name>,<name> and format=records|columns
+    selection for projection from a request's query string. Returns the
+    selected field names and the format; raises ValueError if either is
+    not valid.
+    """
+    fields = query.get('fields')
+    if fields is not None:
+        fields = [name.strip() for name in fields.split(',') if name.strip()]
+    output_format = query.get('format', RECORDS)
+    if output_format not in FORMATS:
+        raise ValueError('format must be one of: %s.' % ', '.join(FORMATS))
+    return projection.select(fields), output_format
+
+
+def json_body(key, projection, queryset, fields=None, output_format=RECORDS, page=None):
+    """
+    The {key: ..., "success": <any rows>} response body as pieces of JSON
+    text, streamed for records; the columns format is built up front. With
+    a pagination.Page only that page of rows is returned, followed by the
+    "next_cursor" to resume from (null on the last page).
+    """
+    names = projection.select(fields)
+    rows = projection.rows(queryset, names)
+    trailer = ''
+    if page is None:
+        rows = rows.iterator()
+    else:
+        rows, next_cursor = keyset_page(rows, page)
+        trailer = ', "next_cursor": %s' % json.dumps(next_cursor)
+    if output_format == COLUMNS:
+        columns, count = projection.encode_columns(rows, names)
+        return ['{"%s": %s, "success": %s%s}' % (
+            key, columns, 'true' if count else 'false', trailer)]
+    return json_list_stream(key, projection.encode_records(rows, names), trailer)
@@ -0,0 +1,160 @@
+"""
+Read replicas.
+
+Views wrapped in replica_reads run their queries against a random alias
+from settings.DATABASE_REPLICAS through ReplicaRouter; everything else,
+including every write and the admin, stays on the primary ('default').
+
+Replicas lag behind the primary, so a client that has just written (e.g.
+marked a voter as having voted) is pinned to the primary for
+READ_YOUR_WRITES_SECONDS and sees its own writes. Clients are told apart
+by their X-Client-Id header, falling back to their address. The pin is
+kept in the cache, which must be shared by all workers for it to hold
+across processes.
+
+For SQLite, sync_sqlite is a stand-in for replication: it copies the
+primary into a replica file in one transaction, so readers of the replica
+always see a complete snapshot (see the sync_replicas command).
+"""
+import hashlib
+import random
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS
+from django.dispatch import receiver
+
+_state = threading.local()
+
+
+def current_replica():
+    """The replica alias reads on this thread are sent to, or None."""
+    return getattr(_state, 'database', None)
+
+
+@contextmanager
+def read_from(alias):
+    previous = current_replica()
+    _state.database = alias
+    try:
+        yield
+    finally:
+        _state.database = previous
+
+
+@receiver(request_started)
+@receiver(request_finished)
+def reset_replica(**kwargs):
+    # Streaming views keep reading from their replica until the response
+    # has been sent.
+    _state.database = None
+
+
+def choose_replica():
+    if settings.DATABASE_REPLICAS:
+        return random.choice(settings.DATABASE_REPLICAS)
+    return None
+
+
+def client_key(request):
+    client = request.META.get('HTTP_X_CLIENT_ID') or request.META.get('REMOTE_ADDR', '')
+    return 'voters:replica-pin:%s' % hashlib.md5(client.encode('utf-8')).hexdigest()
+
+
+def pin_to_primary(request):
+    if settings.DATABASE_REPLICAS and settings.READ_YOUR_WRITES_SECONDS:
+        cache.set(client_key(request), True, settings.READ_YOUR_WRITES_SECONDS)
+
+
+def is_pinned(request):
+    return bool(settings.READ_YOUR_WRITES_SECONDS) and cache.get(client_key(request), False)
+
+
+def replica_reads(view):
+    """Run a read-only view against a replica unless the client is pinned."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = choose_replica()
+        if alias is None or is_pinned(request):
+            return view(request, *args, **kwargs)
+        _state.database = alias
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            _state.database = None
+            raise
+        if not response.streaming:
+            _state.database = None
+        return response
+    return wrapper
+
+
+def pins_primary(view):
+    """Pin the client to the primary after a writing view."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        pin_to_primary(request)
+        return response
+    return wrapper
+
+
+class ReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        return current_replica()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema from the primary through sync_replicas
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+def sync_sqlite(source, replica, pragmas=()):
+    """
+    Copy the SQLite database at source into replica. The replica's schema
+    is recreated if it differs from the source. Returns the number of rows
+    copied.
+    """
+    connection = sqlite3.connect(replica, isolation_level=None)
+    try:
+        for name, value in pragmas:
+            connection.execute('PRAGMA %s = %s' % (name, value))
+        connection.execute('ATTACH DATABASE ? AS source', (source,))
+        connection.execute('BEGIN IMMEDIATE')
+
+        schema_query = ("SELECT type, name, sql FROM %s.sqlite_master "
+                        "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%%' "
+                        "ORDER BY type != 'table', name")
+        schema = connection.execute(schema_query % 'source').fetchall()
+        if schema != connection.execute(schema_query % 'main').fetchall():
+            for kind, name, sql in connection.execute(schema_query % 'main').fetchall():
+                if kind in ('table', 'view'):
+                    connection.execute('DROP %s main."%s"' % (kind.upper(), name))
+            for kind, name, sql in schema:
+                connection.execute(sql)
+
+        rows = 0
+        for kind, name, sql in schema:
+            if kind == 'table':
+                connection.execute('DELETE FROM main."%s"' % name)
+                rows += connection.execute(
+                    'INSERT INTO main."%s" SELECT * FROM source."%s"' % (name, name)).rowcount
+        connection.execute('COMMIT')
+        return rows
+    finally:
+        connection.close()
@@ -0,0 +1,140 @@
+"""
+Deterministic synthetic electoral rolls for load testing and benchmarks.
+"""
+import datetime
+import random
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+from django.utils.six.moves import range
+
+from .bitmap import store_voters_after_commit
+from .models import Constituency, Station, Voter, Party, Candidate, VoterNameTrigram, \
+name_trigrams, normalize_postcode
+from .shards import id_base
+from .turnout import rebuild_turnout
+
+FIRST_NAMES = ['James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda',
+               'William', 'Elizabeth', 'David', 'Susan', 'Richard', 'Jessica', 'Joseph', 'Sarah',
+               'Thomas', 'Karen', 'Charles', 'Nancy', 'Oliver', 'Amelia', 'Harry', 'Isla',
+               'George', 'Ava', 'Noah', 'Emily', 'Jack', 'Sophie', 'Jacob', 'Grace', 'Leo', 'Mia']
+LAST_NAMES = ['Smith', 'Jones', 'Williams', 'Taylor', 'Brown', 'Davies', 'Evans', 'Wilson',
+              'Thomas', 'Johnson', 'Roberts', 'Robinson', 'Thompson', 'Wright', 'Walker', 'White',
+              'Edwards', 'Hughes', 'Green', 'Hall', 'Lewis', 'Harris', 'Clarke', 'Patel', 'Jackson']
+STREETS = ['High Street', 'Station Road', 'Main Street', 'Park Road', 'Church Road',
+           'Church Street', 'London Road', 'Victoria Road', 'Green Lane', 'Manor Road']
+OUTWARD_CODES = ['SW7', 'TW9', 'E1', 'N1', 'SE10', 'W2', 'NW3', 'EC1A', 'M1', 'B33', 'LS1', 'G2']
+INWARD_LETTERS = 'ABDEFGHJLNPQRSTUWXYZ'
+
+
+def random_postcode(rng):
+    return '%s %d%s%s' % (rng.choice(OUTWARD_CODES), rng.randint(0, 9),
+                          rng.choice(INWARD_LETTERS), rng.choice(INWARD_LETTERS))
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def insert_rows(model, field_names, rows, using=DEFAULT_DB_ALIAS):
+    """
+    INSERT rows (tuples of values for field_names) with a single
+    executemany. Much cheaper than bulk_create for large loads, as no SQL
+    is compiled per row; like bulk_create it bypasses save() and signals.
+    """
+    connection = connections[using]
+    fields = [model._meta.get_field(name) for name in field_names]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+            for row in rows])
+
+
+def insert_voters(voters, using=DEFAULT_DB_ALIAS):
+    """
+    Insert unsaved Voter instances, which must already have their pk set,
+    together with the postcode keys, VoterNameTrigram rows and voter bitmap
+    bits that Voter.save() would have written for them. All of the voters
+    must belong in the shard using.
+    """
+    for voter in voters:
+        voter.postcode_key = normalize_postcode(voter.postcode)
+    field_names = [field.name for field in Voter._meta.concrete_fields]
+    insert_rows(Voter, field_names, [
+        [getattr(voter, field.attname) for field in Voter._meta.concrete_fields]
+        for voter in voters], using)
+    insert_rows(VoterNameTrigram, ['voter', 'station', 'trigram'], [
+        (voter.pk, voter.station_id, trigram)
+        for voter in voters for trigram in name_trigrams(voter.first_name)], using)
+    store_voters_after_commit(voters)
+
+
+def generate_roll(constituencies=10, stations=5, voters=10000, parties=5, candidates=5,
+                  used_vote_fraction=0.0, seed=0, chunk_size=5000, progress=None):
+    """
+    Create constituencies, stations, parties and candidates, then insert
+    voters in chunks of chunk_size, one transaction per chunk and shard.
+    The same arguments always produce the same roll. Returns the list of
+    created stations.
+    """
+    rng = random.Random(seed)
+
+    with transaction.atomic():
+        party_objects = [Party.objects.create(name='Party %d' % (i + 1)) for i in range(parties)]
+        station_objects = []
+        for c in range(constituencies):
+            constituency = Constituency.objects.create(name='Constituency %d' % (c + 1))
+            for i in range(candidates):
+                Candidate.objects.create(first_name=rng.choice(FIRST_NAMES),
+                                         last_name=rng.choice(LAST_NAMES),
+                                         constituency=constituency,
+                                         party=party_objects[i % parties])
+            for s in range(stations):
+                station_objects.append(Station.objects.create(
+                    name='Station %d-%d' % (c + 1, s + 1),
+                    addr_line_1='%d %s' % (rng.randint(1, 200), rng.choice(STREETS)),
+                    postcode=random_postcode(rng),
+                    constituency=constituency))
+
+    next_pks = {}
+    for alias in set(station._state.db for station in station_objects):
+        last_pk = Voter.objects.using(alias).aggregate(pk=Max('pk'))['pk']
+        next_pks[alias] = max(last_pk or 0, id_base(alias)) + 1
+    created = 0
+    for chunk in chunked(range(voters), chunk_size):
+        batches = {}
+        for n in chunk:
+            station = station_objects[n % len(station_objects)]
+            alias = station._state.db
+            next_pks[alias] += 1
+            batches.setdefault(alias, []).append(Voter(
+                pk=next_pks[alias] - 1,
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                addr_line_1='%d %s' % (rng.randint(1, 200), rng.choice(STREETS)),
+                postcode=station.postcode,
+                date_of_birth=datetime.date(1930, 1, 1) + datetime.timedelta(days=rng.randint(0, 27000)),
+                phone='+447%09d' % rng.randint(0, 999999999),
+                station=station,
+                used_vote=rng.random() < used_vote_fraction))
+        for alias, batch in batches.items():
+            with transaction.atomic(using=alias):
+                insert_voters(batch, alias)
+            created += len(batch)
+        if progress:
+            progress(created)
+
+    # insert_voters bypasses Voter.save(), so count the new voters in one go.
+    rebuild_turnout()
+    return station_objects
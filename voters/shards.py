@@ -0,0 +1,231 @@
+"""
+Horizontal sharding of the voter roll by constituency.
+
+With settings.DATABASE_SHARDS configured, each constituency belongs to one
+shard database (constituency id modulo the number of shards), which holds
+its stations, their voters and every row hanging off them: the name index,
+the turnout counters and their history, and import checkpoints. Vote
+marking in one shard never waits on the write lock of another. Parties,
+candidates and the master list of constituencies stay in 'default'. Every
+shard has the whole voters schema and a copy of the constituency rows (see
+signals.py), so that its own queries can still join on them.
+
+Station and voter ids encode their shard: the ids of shard n (DATABASE_SHARDS
+[n - 1]) start at n * SHARD_ID_SPACE, so a view can route on the id in its
+URL alone. ShardRouter sends sharded models to the shard of the instance
+being saved or to the one selected with using_shard() or routed_by();
+anything else goes to 'default'; ShardedQuerySet.create() routes on the new
+instance rather than on the queryset. Endpoints spanning every constituency
+query each shard in turn (all_shards()) and merge the results.
+
+Without DATABASE_SHARDS everything lives in 'default' and the router stays
+out of the way. Shards cannot be added to a populated roll: stations would
+change shard with the modulus.
+
+Shards and read replicas (replicas.py) are mutually exclusive: ShardRouter
+answers for sharded models before ReplicaRouter is asked, so replica_reads
+views would read the voter roll from the shard primaries anyway, and the
+replicas only copy 'default'. check_settings() refuses to start with both.
+"""
+import threading
+
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections, models, router
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+# Models stored in the shard of their constituency
+SHARDED_MODELS = {'station', 'stationturnout', 'stationturnouthistory', 'voter',
+                  'voternametrigram', 'voterimport', 'constituencyturnout',
+                  'constituencyturnouthistory'}
+
+# Ids of shard n start at n * SHARD_ID_SPACE; keeps ids below 2 ** 53 for
+# JSON clients for up to 9000 shards
+SHARD_ID_SPACE = 10 ** 12
+
+_state = threading.local()
+
+
+def all_shards():
+    """Every database that holds part of the roll."""
+    return list(settings.DATABASE_SHARDS) or [DEFAULT_DB_ALIAS]
+
+
+def id_base(alias):
+    """The ids of stations and voters in a shard are above this."""
+    if alias in settings.DATABASE_SHARDS:
+        return (settings.DATABASE_SHARDS.index(alias) + 1) * SHARD_ID_SPACE
+    return 0
+
+
+def shard_for_id(pk):
+    """The shard holding the station or voter with this id."""
+    number = int(pk) // SHARD_ID_SPACE
+    if 0 < number <= len(settings.DATABASE_SHARDS):
+        return settings.DATABASE_SHARDS[number - 1]
+    return DEFAULT_DB_ALIAS
+
+
+def shard_for_constituency(constituency_id):
+    if not settings.DATABASE_SHARDS:
+        return DEFAULT_DB_ALIAS
+    return settings.DATABASE_SHARDS[int(constituency_id) % len(settings.DATABASE_SHARDS)]
+
+
+def group_by_shard(ids):
+    """{shard alias: [ids in that shard]}, keeping the order of ids."""
+    groups = {}
+    for pk in ids:
+        groups.setdefault(shard_for_id(pk), []).append(pk)
+    return groups
+
+
+def shard_for_instance(instance):
+    """The shard a (possibly unsaved) model instance belongs in."""
+    name = instance._meta.model_name
+    if name == 'constituency':
+        return shard_for_constituency(instance.pk)
+    if name in ('constituencyturnout', 'constituencyturnouthistory'):
+        return shard_for_constituency(instance.constituency_id)
+    if instance._state.db is not None:
+        return instance._state.db
+    if name == 'station':
+        return shard_for_id(instance.pk) if instance.pk else \
+            shard_for_constituency(instance.constituency_id)
+    if name == 'voter':
+        return shard_for_id(instance.pk) if instance.pk else shard_for_id(instance.station_id)
+    if name == 'voternametrigram':
+        return shard_for_id(instance.voter_id)
+    if name in ('stationturnout', 'stationturnouthistory'):
+        return shard_for_id(instance.station_id)
+    return current_shard() or DEFAULT_DB_ALIAS
+
+
+def current_shard():
+    """The shard selected on this thread, or None."""
+    return getattr(_state, 'shard', None)
+
+
+@contextmanager
+def using_shard(alias):
+    """Send queries for sharded models in the block to alias."""
+    previous = current_shard()
+    _state.shard = alias
+    try:
+        yield alias
+    finally:
+        _state.shard = previous
+
+
+@receiver(request_started)
+@receiver(request_finished)
+def reset_shard(**kwargs):
+    # Streaming views keep reading from their shard until the response
+    # has been sent.
+    _state.shard = None
+
+
+def routed_by(argument, resolve=shard_for_id):
+    """
+    Run a view against the shard resolve(<the view's argument keyword
+    argument>) names, e.g. @routed_by('voter_id').
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            _state.shard = resolve(kwargs[argument])
+            try:
+                response = view(request, *args, **kwargs)
+            except Exception:
+                _state.shard = None
+                raise
+            if not response.streaming:
+                _state.shard = None
+            return response
+        return wrapper
+    return decorator
+
+
+def check_settings():
+    if settings.DATABASE_SHARDS and settings.DATABASE_REPLICAS:
+        raise ImproperlyConfigured('DATABASE_SHARDS and DATABASE_REPLICAS cannot both be '
+                                   'set: replicas are not supported with sharding.')
+
+
+class ShardedQuerySet(models.QuerySet):
+
+    def create(self, **kwargs):
+        # QuerySet.create() saves to the queryset's database; without an
+        # explicit using() that is the current shard, not the new row's.
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db or router.db_for_write(self.model, instance=obj))
+        return obj
+
+
+class ShardRouter(object):
+    """
+    Listed before ReplicaRouter; only answers for sharded models, and only
+    when there are no replicas (see check_settings()).
+    """
+
+    def _db(self, model, hints):
+        if not settings.DATABASE_SHARDS or model._meta.model_name not in SHARDED_MODELS:
+            return None
+        if hints.get('instance') is not None:
+            return shard_for_instance(hints['instance'])
+        return current_shard() or DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Stations point at the constituency rows in 'default', and their
+        # copies in the shard
+        if obj1._meta.app_label == obj2._meta.app_label == 'voters':
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in settings.DATABASE_SHARDS:
+            return None
+        return app_label == 'voters'
+
+
+# Reserving each shard's id range #
+
+
+def reserve_id_range(alias, models):
+    """Start the id sequences of models in a shard at the shard's id base."""
+    connection = connections[alias]
+    base = id_base(alias)
+    with connection.cursor() as cursor:
+        for model in models:
+            table = model._meta.db_table
+            if connection.vendor == 'sqlite':
+                # AUTOINCREMENT tables continue from sqlite_sequence
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) SELECT %s, 0 WHERE NOT "
+                               "EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                               [table, table])
+                cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s",
+                               [base, table, base])
+            elif connection.vendor == 'postgresql':
+                cursor.execute("SELECT setval(pg_get_serial_sequence(%%s, 'id'), GREATEST(%%s, "
+                               "(SELECT COALESCE(MAX(id), 0) FROM %s)))"
+                               % connection.ops.quote_name(table), [table, base])
+            else:
+                raise ImproperlyConfigured('Sharding supports SQLite and PostgreSQL shards only.')
+
+
+@receiver(post_migrate)
+def reserve_shard_ids(sender, using, **kwargs):
+    if sender.name == 'voters' and using in settings.DATABASE_SHARDS:
+        reserve_id_range(using, [sender.get_model('Station'), sender.get_model('Voter')])
@@ -0,0 +1,74 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .bitmap import remove_voter_after_commit, store_voters_after_commit
+from .candidates import invalidate_candidates, invalidate_station
+from .models import Constituency, Station, Voter, Party, Candidate, \
+ConstituencyTurnout, StationTurnout, adjust_turnout
+from .shards import shard_for_constituency, using_shard
+
+
+@receiver(post_save, sender=Constituency)
+def mirror_constituency(sender, instance, using, **kwargs):
+    # Every shard keeps a copy of the constituencies in 'default'
+    if using == DEFAULT_DB_ALIAS:
+        for alias in settings.DATABASE_SHARDS:
+            Constituency(pk=instance.pk, name=instance.name).save(using=alias)
+
+
+@receiver(post_delete, sender=Constituency)
+def unmirror_constituency(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS:
+        for alias in settings.DATABASE_SHARDS:
+            Constituency.objects.using(alias).filter(pk=instance.pk).delete()
+
+
+@receiver(post_save, sender=Constituency)
+def create_constituency_turnout(sender, instance, created, using, **kwargs):
+    # Counted in the constituency's own shard only
+    if created and using == shard_for_constituency(instance.pk):
+        ConstituencyTurnout.objects.using(using).get_or_create(constituency=instance)
+
+
+@receiver(post_save, sender=Station)
+def create_station_turnout(sender, instance, created, using, **kwargs):
+    if created:
+        StationTurnout.objects.using(using).get_or_create(station=instance)
+
+
+@receiver(post_delete, sender=Voter)
+def remove_voter_from_turnout(sender, instance, using, **kwargs):
+    # Deletes (including cascades from Station) run their post_delete
+    # signals inside the deletion transaction.
+    station_id, used_vote = getattr(instance, '_loaded_turnout',
+                                    (instance.station_id, instance.used_vote))
+    with using_shard(using):
+        adjust_turnout(station_id, registered=-1, voted=-int(bool(used_vote)))
+    remove_voter_after_commit(instance.pk)
+
+
+@receiver(post_save, sender=Voter)
+def store_voter_in_bitmap(sender, instance, **kwargs):
+    store_voters_after_commit([instance])
+
+
+@receiver(post_save, sender=Candidate)
+@receiver(post_delete, sender=Candidate)
+@receiver(post_save, sender=Party)
+@receiver(post_delete, sender=Party)
+@receiver(post_save, sender=Constituency)
+@receiver(post_delete, sender=Constituency)
+def clear_cached_candidates(sender, using, **kwargs):
+    # After the commit: a get_candidates running before it would cache the
+    # old rows again
+    transaction.on_commit(invalidate_candidates, using=using)
+
+
+@receiver(post_save, sender=Station)
+@receiver(post_delete, sender=Station)
+def clear_cached_station(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(invalidate_station, instance.pk), using=using)
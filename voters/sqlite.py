@@ -0,0 +1,24 @@
+"""
+Per-connection tuning for the SQLite backend.
+
+Every new SQLite connection gets settings.SQLITE_PRAGMAS applied as soon
+as it is opened. With WAL journaling, readers no longer block behind the
+vote-marking writers, and the other pragmas trade a little durability on
+power loss (synchronous=NORMAL) and memory for throughput. Connections are
+kept open between requests through CONN_MAX_AGE in DATABASES.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas:
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            apply_pragmas(cursor, settings.SQLITE_PRAGMAS)
@@ -0,0 +1,33 @@
+"""
+Stream JSON responses to the client.
+
+The API's list responses are written a chunk of records at a time by
+projection.Projection from values_list() rows, instead of being built,
+parsed and re-encoded as a whole; json_list_stream() wraps those pieces in
+the response object as they are produced.
+"""
+from django.http import StreamingHttpResponse
+
+CHUNK_SIZE = 500
+
+
+def json_list_stream(key, pieces, trailer=''):
+    """
+    Yield {key: [records...], "success": <any records>} as JSON text from
+    the pieces yielded by Projection.encode_records().
+    "success" comes last as it is only known once the rows are exhausted;
+    trailer is any further ', "name": value' members to end the object with.
+    """
+    yield '{"%s": [' % key
+    found = False
+    for piece in pieces:
+        found = True
+        yield piece
+    yield '], "success": %s%s}' % ('true' if found else 'false', trailer)
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+
+    def __init__(self, streaming_content=(), **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super(StreamingJsonResponse, self).__init__(streaming_content, **kwargs)
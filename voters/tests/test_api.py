@@ -1,13 +1,22 @@
+import csv
+import gzip
+import io
 import json
 import datetime
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from django.http.cookie import SimpleCookie
+from django.utils import timezone
 from mock import patch
 
-from ..models import Constituency, Station, Voter, Party, Candidate
+from ..models import Constituency, Station, Voter, Party, Candidate, StationTurnout
+from ..candidates import VERSION_KEY
+from ..turnout import record_turnout_history
 from ..views import check_votable
+from ..api_key_verification import ROLES, AUDIT, BOOTH, PINS, STATION, RESULTS, key_roles
 
 ELIGIBLE_VOTER_PK = 1
 INELIGIBLE_VOTER_PK = 2
@@ -18,9 +27,21 @@ STATION_PK = 1
 INVALID_STATION_PK = 47
 CONSTITUENCY_PK = 1
 
+ALL_ROLES = sum(ROLES.values())
+NO_ROLES = 0
+
+BOOTH_KEY = 'Basic booth-key'
+PINS_KEY = 'Basic pins-key'
+STATION_KEY = 'Basic station-key'
+TEST_API_KEYS = {'booth': [BOOTH_KEY], 'pins': [PINS_KEY, 'Basic pins-key-2'],
+                 'station': [STATION_KEY], 'results': [STATION_KEY]}
+
 RESPONSE_OK = 200
 RESPONSE_UNAUTHORIZED = 401
 RESPONSE_FORBIDDEN = 403
+RESPONSE_BAD_REQUEST = 400
+RESPONSE_NOT_ALLOWED = 405
+RESPONSE_NOT_MODIFIED = 304
 
 ELIGIBLE_VOTER_JSON = json.dumps({'success': True,
                                   'voters':
@@ -49,6 +70,10 @@ CANDIDATE_JSON = json.dumps({'success': True,
                              }, sort_keys=True)
 
 
+def streamed_content(response):
+    return b''.join(response.streaming_content).decode('utf-8')
+
+
 def create_constituency():
     return Constituency.objects.create(name="Richmond Park")
 
@@ -73,6 +98,26 @@ def create_candidate(constituency, party):
     return Candidate.objects.create(pk=CANDIDATE_PK, first_name="Jeremy", last_name="Corbyn", constituency=constituency, party=party)
 
 
+@override_settings(API_KEYS=TEST_API_KEYS)
+class APIKeyTests(TestCase):
+
+    def test_keys_map_to_role_masks(self):
+        self.assertEqual(key_roles(BOOTH_KEY), BOOTH)
+        self.assertEqual(key_roles('Basic pins-key-2'), PINS)
+        self.assertEqual(key_roles(STATION_KEY), STATION | RESULTS)
+        self.assertEqual(key_roles('Basic 123'), NO_ROLES)
+
+    def test_view_accepts_any_of_its_roles(self):
+        url = reverse('voters:check_votable', args=(ELIGIBLE_VOTER_PK,))
+
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=BOOTH_KEY).status_code, RESPONSE_OK)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=PINS_KEY).status_code, RESPONSE_OK)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=STATION_KEY).status_code,
+                         RESPONSE_FORBIDDEN)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Basic 123').status_code,
+                         RESPONSE_FORBIDDEN)
+
+
 class CheckVotabilityTests(TestCase):
 
     def test_endpoint_returns_unauthorized_without_API_key(self):
@@ -87,21 +132,21 @@ class CheckVotabilityTests(TestCase):
 
         self.assertEqual(response.status_code, RESPONSE_UNAUTHORIZED)
 
-    @patch('voters.views.has_check_votable_permissions', return_value=False)
+    @patch('voters.api_key_verification.key_roles', return_value=NO_ROLES)
     def test_endpoint_returns_forbidden_with_valid_API_key_insufficient_priviledges(self, *_):
         url = reverse('voters:check_votable', args=(ELIGIBLE_VOTER_PK,))
         response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
 
         self.assertEqual(response.status_code, RESPONSE_FORBIDDEN)
 
-    @patch('voters.views.has_check_votable_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_endpoint_returns_response_for_valid_API_key(self, *_):
         url = reverse('voters:check_votable', args=(ELIGIBLE_VOTER_PK,))
         response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
 
         self.assertEqual(response.status_code, RESPONSE_OK)
 
-    @patch('voters.views.has_check_votable_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_eligible_voter_can_vote(self, *_):
         create_eligible_voter(station=create_station(
             constituency=create_constituency()))
@@ -112,7 +157,7 @@ class CheckVotabilityTests(TestCase):
         self.assertJSONEqual(response.content, {'voter_exists': True,
                                                 'used_vote': False})
 
-    @patch('voters.views.has_check_votable_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_ineligible_cannot_vote(self, *_):
         create_ineligable_voter(station=create_station(
             constituency=create_constituency()))
@@ -123,7 +168,7 @@ class CheckVotabilityTests(TestCase):
         self.assertJSONEqual(response.content, {'voter_exists': True,
                                                 'used_vote': True})
 
-    @patch('voters.views.has_check_votable_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_non_existent_voter_returns_false(self, *_):
         self.client.cookies = SimpleCookie({'API_key': 12345})
         url = reverse('voters:check_votable', args=(NON_EXIST_VOTER_PK,))
@@ -134,9 +179,63 @@ class CheckVotabilityTests(TestCase):
                                                 'used_vote': None})
 
 
+class CheckVotableBatchTests(TestCase):
+
+    def post(self, body):
+        url = reverse('voters:check_votable_batch')
+        return self.client.post(url, json.dumps(body), content_type='application/json',
+                                **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+    @patch('voters.api_key_verification.key_roles', return_value=NO_ROLES)
+    def test_endpoint_returns_forbidden_with_insufficient_priviledges(self, *_):
+        response = self.post({'voter_ids': [ELIGIBLE_VOTER_PK]})
+
+        self.assertEqual(response.status_code, RESPONSE_FORBIDDEN)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_endpoint_rejects_get(self, *_):
+        url = reverse('voters:check_votable_batch')
+        response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+        self.assertEqual(response.status_code, RESPONSE_NOT_ALLOWED)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_endpoint_rejects_malformed_body(self, *_):
+        self.assertEqual(self.post({'voter_ids': ['1']}).status_code, RESPONSE_BAD_REQUEST)
+        self.assertEqual(self.post({'voters': [1]}).status_code, RESPONSE_BAD_REQUEST)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_endpoint_rejects_ids_out_of_range(self, *_):
+        self.assertEqual(self.post({'voter_ids': [10 ** 20]}).status_code, RESPONSE_BAD_REQUEST)
+        self.assertEqual(self.post({'voter_ids': [0]}).status_code, RESPONSE_BAD_REQUEST)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_endpoint_rejects_oversized_batch(self, *_):
+        with self.settings(VOTER_BATCH_MAX_SIZE=2):
+            response = self.post({'voter_ids': [1, 2, 3]})
+
+        self.assertEqual(response.status_code, RESPONSE_BAD_REQUEST)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_batch_resolves_every_voter_in_one_query(self, *_):
+        station = create_station(constituency=create_constituency())
+        create_eligible_voter(station)
+        create_ineligable_voter(station)
+
+        with self.assertNumQueries(1):
+            response = self.post({'voter_ids': [ELIGIBLE_VOTER_PK, INELIGIBLE_VOTER_PK,
+                                                NON_EXIST_VOTER_PK]})
+
+        self.assertEqual(response.status_code, RESPONSE_OK)
+        self.assertJSONEqual(response.content, {'voters': {
+            str(ELIGIBLE_VOTER_PK): {'voter_exists': True, 'used_vote': False},
+            str(INELIGIBLE_VOTER_PK): {'voter_exists': True, 'used_vote': True},
+            str(NON_EXIST_VOTER_PK): {'voter_exists': False, 'used_vote': None}}})
+
+
 class GetVoterAPITests(TestCase):
 
-    @patch('voters.views.has_get_voters_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_endpoint_returns_response(self, *_):
         self.client.cookies = SimpleCookie({'API_key': 12345})
         url = reverse('voters:get_voters',  args=(
@@ -145,7 +244,7 @@ class GetVoterAPITests(TestCase):
 
         self.assertEqual(response.status_code, RESPONSE_OK)
 
-    @patch('voters.views.has_get_voters_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_can_retrieve_voter_who_exists(self, *_):
         self.client.cookies = SimpleCookie({'API_key': 12345})
         create_eligible_voter(station=create_station(
@@ -155,9 +254,19 @@ class GetVoterAPITests(TestCase):
         response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
 
         self.assertEqual(response.status_code, RESPONSE_OK)
-        self.assertJSONEqual(response.content, ELIGIBLE_VOTER_JSON)
+        self.assertJSONEqual(streamed_content(response), ELIGIBLE_VOTER_JSON)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_postcode_matches_with_or_without_space(self, *_):
+        create_eligible_voter(station=create_station(
+            constituency=create_constituency()))
+        url = reverse('voters:get_voters', args=(
+            STATION_PK, "James", "SW73BH",))
+        response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+        self.assertJSONEqual(streamed_content(response), ELIGIBLE_VOTER_JSON)
 
-    @patch('voters.views.has_get_voters_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_retrieving_voter_who_does_not_exist_returns_false(self, *_):
         self.client.cookies = SimpleCookie({'API_key': 12345})
         create_eligible_voter(station=create_station(
@@ -167,13 +276,87 @@ class GetVoterAPITests(TestCase):
         response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
 
         self.assertEqual(response.status_code, RESPONSE_OK)
-        self.assertJSONEqual(response.content, {'success': False,
+        self.assertJSONEqual(streamed_content(response), {'success': False,
                                                 'voters': []})
 
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_response_is_streamed_from_a_single_query(self, *_):
+        station = create_station(constituency=create_constituency())
+        create_eligible_voter(station)
+        create_ineligable_voter(station)
+        url = reverse('voters:get_voters', args=(
+            STATION_PK, "James", "SW7 3BH",))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+            content = json.loads(streamed_content(response))
+
+        self.assertTrue(response.streaming)
+        self.assertTrue(content['success'])
+        self.assertEqual([voter['pk'] for voter in content['voters']],
+                         [ELIGIBLE_VOTER_PK, INELIGIBLE_VOTER_PK])
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_fields_and_columns_can_be_selected(self, *_):
+        station = create_station(constituency=create_constituency())
+        create_eligible_voter(station)
+        create_ineligable_voter(station)
+        url = reverse('voters:get_voters', args=(STATION_PK, "James", "SW7 3BH",))
+
+        response = self.client.get(url, {'fields': 'first_name,used_vote', 'format': 'columns'},
+                                   HTTP_AUTHORIZATION='Basic 123')
+
+        self.assertEqual(response.status_code, RESPONSE_OK)
+        self.assertJSONEqual(streamed_content(response), {
+            'success': True,
+            'voters': {'pk': [ELIGIBLE_VOTER_PK, INELIGIBLE_VOTER_PK],
+                       'first_name': ['James', 'James'],
+                       'used_vote': [False, True]}})
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_voters_can_be_paged_with_a_cursor(self, *_):
+        station = create_station(constituency=create_constituency())
+        create_eligible_voter(station)
+        create_ineligable_voter(station)
+        Voter.objects.create(pk=3, first_name="James", last_name="May", addr_line_1="",
+                             postcode="SW7 3BH", date_of_birth=datetime.date(1963, 1, 16),
+                             phone="", station=station)
+        url = reverse('voters:get_voters', args=(STATION_PK, "James", "SW7 3BH",))
+
+        pages = []
+        query = {'page_size': 2, 'fields': 'last_name'}
+        while True:
+            with self.assertNumQueries(1):
+                content = json.loads(streamed_content(
+                    self.client.get(url, query, HTTP_AUTHORIZATION='Basic 123')))
+            pages.append([voter['pk'] for voter in content['voters']])
+            if content['next_cursor'] is None:
+                break
+            query['cursor'] = content['next_cursor']
+
+        self.assertEqual(pages, [[ELIGIBLE_VOTER_PK, INELIGIBLE_VOTER_PK], [3]])
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_invalid_pages_are_rejected(self, *_):
+        url = reverse('voters:get_voters', args=(STATION_PK, "James", "SW7 3BH",))
+
+        for query in ({'page_size': 0}, {'page_size': 'ten'}, {'page_size': 100000},
+                      {'cursor': '2'}):
+            response = self.client.get(url, query, HTTP_AUTHORIZATION='Basic 123')
+            self.assertEqual(response.status_code, RESPONSE_BAD_REQUEST)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_unknown_fields_are_rejected(self, *_):
+        url = reverse('voters:get_voters', args=(STATION_PK, "James", "SW7 3BH",))
+
+        for query in ({'fields': 'first_name,password'}, {'format': 'xml'}):
+            response = self.client.get(url, query, HTTP_AUTHORIZATION='Basic 123')
+            self.assertEqual(response.status_code, RESPONSE_BAD_REQUEST)
+
 
 class MakeVoterIneligibleAPITests(TestCase):
 
-    @patch('voters.views.has_make_voter_ineligible_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_endpoint_returns_response(self, *_):
         self.client.cookies = SimpleCookie({'API_key': 12345})
         url = reverse('voters:make_voter_ineligible',
@@ -182,7 +365,7 @@ class MakeVoterIneligibleAPITests(TestCase):
 
         self.assertEqual(response.status_code, RESPONSE_OK)
 
-    @patch('voters.views.has_make_voter_ineligible_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_make_existing_voter_ineligible(self, *_):
         self.client.cookies = SimpleCookie({'API_key': 12345})
         create_eligible_voter(station=create_station(
@@ -192,9 +375,25 @@ class MakeVoterIneligibleAPITests(TestCase):
         response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
 
         self.assertEqual(response.status_code, RESPONSE_OK)
-        self.assertJSONEqual(response.content, {'success': True})
+        self.assertJSONEqual(response.content, {'success': True,
+                                                'changed': True})
+        self.assertTrue(Voter.objects.get(pk=ELIGIBLE_VOTER_PK).used_vote)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_make_voter_ineligible_twice_reports_no_change(self, *_):
+        create_eligible_voter(station=create_station(
+            constituency=create_constituency()))
+        url = reverse('voters:make_voter_ineligible',
+                      args=(ELIGIBLE_VOTER_PK,))
+        self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+        response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+        self.assertEqual(response.status_code, RESPONSE_OK)
+        self.assertJSONEqual(response.content, {'success': True,
+                                                'changed': False})
+        self.assertEqual(StationTurnout.objects.get(station=STATION_PK).voted, 1)
 
-    @patch('voters.views.has_make_voter_ineligible_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_make_non_existing_voter_ineligible(self, *_):
         self.client.cookies = SimpleCookie({'API_key': 12345})
         url = reverse('voters:make_voter_ineligible',
@@ -202,12 +401,13 @@ class MakeVoterIneligibleAPITests(TestCase):
         response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
 
         self.assertEqual(response.status_code, RESPONSE_OK)
-        self.assertJSONEqual(response.content, {'success': False})
+        self.assertJSONEqual(response.content, {'success': False,
+                                                'changed': False})
 
 
 class SetVoterHasActivePinTests(TestCase):
 
-    @patch('voters.views.has_set_voter_has_active_pin_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_endpoint_returns_response(self, *_):
         url = reverse('voters:set_voter_has_active_pin',
                       args=(ELIGIBLE_VOTER_PK,))
@@ -215,7 +415,7 @@ class SetVoterHasActivePinTests(TestCase):
 
         self.assertEqual(response.status_code, RESPONSE_OK)
 
-    @patch('voters.views.has_set_voter_has_active_pin_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_set_existing_voter_active_pin(self, *_):
         create_eligible_voter(station=create_station(
             constituency=create_constituency()))
@@ -224,21 +424,102 @@ class SetVoterHasActivePinTests(TestCase):
         response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
 
         self.assertEqual(response.status_code, RESPONSE_OK)
-        self.assertJSONEqual(response.content, {'success': True})
+        self.assertJSONEqual(response.content, {'success': True,
+                                                'changed': True})
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_set_active_pin_twice_reports_no_change(self, *_):
+        create_eligible_voter(station=create_station(
+            constituency=create_constituency()))
+        url = reverse('voters:set_voter_has_active_pin',
+                      args=(ELIGIBLE_VOTER_PK,))
+        self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+        response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+        self.assertEqual(response.status_code, RESPONSE_OK)
+        self.assertJSONEqual(response.content, {'success': True,
+                                                'changed': False})
 
-    @patch('voters.views.has_set_voter_has_active_pin_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_set_non_existing_voter_active_pin(self, *_):
         url = reverse('voters:set_voter_has_active_pin',
                       args=(NON_EXIST_VOTER_PK,))
         response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
 
         self.assertEqual(response.status_code, RESPONSE_OK)
-        self.assertJSONEqual(response.content, {'success': False})
+        self.assertJSONEqual(response.content, {'success': False,
+                                                'changed': False})
+
+
+class FlagBatchAPITests(TestCase):
+
+    def post(self, name, body):
+        return self.client.post(reverse(name), json.dumps(body), content_type='application/json',
+                                **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+    @patch('voters.api_key_verification.key_roles', return_value=NO_ROLES)
+    def test_make_voters_ineligible_requires_permissions(self, *_):
+        response = self.post('voters:make_voter_ineligible_batch', {'voter_ids': [ELIGIBLE_VOTER_PK]})
+
+        self.assertEqual(response.status_code, RESPONSE_FORBIDDEN)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_make_voters_ineligible_reports_each_outcome(self, *_):
+        station = create_station(constituency=create_constituency())
+        create_eligible_voter(station)
+        create_ineligable_voter(station)
+        response = self.post('voters:make_voter_ineligible_batch',
+                             {'voter_ids': [ELIGIBLE_VOTER_PK, INELIGIBLE_VOTER_PK, NON_EXIST_VOTER_PK]})
+
+        self.assertEqual(response.status_code, RESPONSE_OK)
+        self.assertJSONEqual(response.content, {'voters': {
+            str(ELIGIBLE_VOTER_PK): 'changed',
+            str(INELIGIBLE_VOTER_PK): 'already_set',
+            str(NON_EXIST_VOTER_PK): 'not_found'}})
+        self.assertTrue(Voter.objects.get(pk=ELIGIBLE_VOTER_PK).used_vote)
+        self.assertEqual(StationTurnout.objects.get(station=STATION_PK).voted, 2)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_set_active_pins_reports_each_outcome(self, *_):
+        station = create_station(constituency=create_constituency())
+        create_eligible_voter(station)
+        response = self.post('voters:set_voter_has_active_pin_batch',
+                             {'voter_ids': [ELIGIBLE_VOTER_PK, NON_EXIST_VOTER_PK]})
+        repeat = self.post('voters:set_voter_has_active_pin_batch',
+                           {'voter_ids': [ELIGIBLE_VOTER_PK]})
+
+        self.assertJSONEqual(response.content, {'voters': {
+            str(ELIGIBLE_VOTER_PK): 'changed',
+            str(NON_EXIST_VOTER_PK): 'not_found'}})
+        self.assertJSONEqual(repeat.content, {'voters': {
+            str(ELIGIBLE_VOTER_PK): 'already_set'}})
+        self.assertTrue(Voter.objects.get(pk=ELIGIBLE_VOTER_PK).active_pin)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_set_active_pins_rejects_malformed_body(self, *_):
+        response = self.post('voters:set_voter_has_active_pin_batch', {'voter_ids': 'all'})
+
+        self.assertEqual(response.status_code, RESPONSE_BAD_REQUEST)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_make_voters_ineligible_rejects_ids_out_of_range(self, *_):
+        response = self.post('voters:make_voter_ineligible_batch', {'voter_ids': [1, 10 ** 20]})
+
+        self.assertEqual(response.status_code, RESPONSE_BAD_REQUEST)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_set_active_pins_rejects_ids_out_of_range(self, *_):
+        response = self.post('voters:set_voter_has_active_pin_batch', {'voter_ids': [1, 10 ** 20]})
+
+        self.assertEqual(response.status_code, RESPONSE_BAD_REQUEST)
 
 
 class CandidateAPITests(TestCase):
 
-    @patch('voters.views.has_get_candidates_permissions', return_value=True)
+    def setUp(self):
+        cache.clear()
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_endpoint_returns_response(self, *_):
         self.client.cookies = SimpleCookie({'API_key': 12345})
         url = reverse('voters:get_candidates', args=(STATION_PK,))
@@ -246,7 +527,7 @@ class CandidateAPITests(TestCase):
 
         self.assertEqual(response.status_code, RESPONSE_OK)
 
-    @patch('voters.views.has_get_candidates_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_endpoint_returns_candidates(self, *_):
         self.client.cookies = SimpleCookie({'API_key': 12345})
         constituency = create_constituency()
@@ -258,7 +539,23 @@ class CandidateAPITests(TestCase):
         self.assertEqual(response.status_code, RESPONSE_OK)
         self.assertJSONEqual(response.content, CANDIDATE_JSON)
 
-    @patch('voters.views.has_get_candidates_permissions', return_value=True)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_candidate_fields_can_be_selected(self, *_):
+        constituency = create_constituency()
+        create_station(constituency)
+        create_candidate(constituency=constituency, party=create_party())
+        url = reverse('voters:get_candidates', args=(STATION_PK,))
+        self.client.get(url, HTTP_AUTHORIZATION='Basic 123')
+
+        response = self.client.get(url, {'fields': 'last_name,party'},
+                                   HTTP_AUTHORIZATION='Basic 123')
+
+        self.assertJSONEqual(response.content, {
+            'success': True,
+            'candidates': [{'pk': CANDIDATE_PK, 'model': 'voters.candidate',
+                            'fields': {'last_name': 'Corbyn', 'party': 'Labour'}}]})
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
     def test_endpoint_returns_error_for_invalid_constituency(self, *_):
         self.client.cookies = SimpleCookie({'API_key': 12345})
         url = reverse('voters:get_candidates', args=(INVALID_STATION_PK,))
@@ -268,6 +565,121 @@ class CandidateAPITests(TestCase):
         self.assertEqual(response.content, json.dumps({'success': False,
                                                        'candidates': []}, sort_keys=True))
 
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_repeated_requests_are_served_without_queries(self, *_):
+        constituency = create_constituency()
+        create_station(constituency)
+        create_candidate(constituency=constituency, party=create_party())
+        url = reverse('voters:get_candidates', args=(STATION_PK,))
+        self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+        self.assertJSONEqual(response.content, CANDIDATE_JSON)
+
+
+class CandidateCacheInvalidationTests(TransactionTestCase):
+    # The cache is invalidated once the change commits
+    reset_sequences = True
+
+    def setUp(self):
+        cache.clear()
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_cached_candidates_are_invalidated_by_changes(self, *_):
+        constituency = create_constituency()
+        create_station(constituency)
+        url = reverse('voters:get_candidates', args=(STATION_PK,))
+        self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+        create_candidate(constituency=constituency, party=create_party())
+        response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+        self.assertJSONEqual(response.content, CANDIDATE_JSON)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_unchanged_candidates_are_not_modified(self, *_):
+        constituency = create_constituency()
+        create_station(constituency)
+        create_candidate(constituency=constituency, party=create_party())
+        url = reverse('voters:get_candidates', args=(STATION_PK,))
+        etag = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123',
+                                               'HTTP_IF_NONE_MATCH': etag})
+        self.assertEqual(response.status_code, RESPONSE_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        party = Party.objects.get()
+        party.name = 'Labour Party'
+        party.save()
+        response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123',
+                                           'HTTP_IF_NONE_MATCH': etag})
+        self.assertEqual(response.status_code, RESPONSE_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_cache_is_invalidated_after_commit(self):
+        constituency = create_constituency()
+        create_station(constituency)
+        version = cache.get(VERSION_KEY)
+
+        with transaction.atomic():
+            create_candidate(constituency=constituency, party=create_party())
+            self.assertEqual(cache.get(VERSION_KEY), version)
+        self.assertNotEqual(cache.get(VERSION_KEY), version)
+
+
+class ExportAPITests(TestCase):
+
+    def setUp(self):
+        station = create_station(create_constituency())
+        create_eligible_voter(station)
+        create_ineligable_voter(station)
+
+    @patch('voters.api_key_verification.key_roles', return_value=BOOTH)
+    def test_export_requires_audit_or_results_role(self, *_):
+        url = reverse('voters:export_voters', args=(CONSTITUENCY_PK,))
+        response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+        self.assertEqual(response.status_code, RESPONSE_FORBIDDEN)
+
+    @patch('voters.api_key_verification.key_roles', return_value=AUDIT)
+    @patch('voters.export.PAGE_SIZE', 1)
+    def test_export_voters_streams_csv(self, *_):
+        url = reverse('voters:export_voters', args=(CONSTITUENCY_PK,))
+        response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+        rows = list(csv.reader(streamed_content(response).splitlines()))
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(rows[0][:3], ['id', 'first_name', 'last_name'])
+        self.assertEqual([(row[0], row[-2]) for row in rows[1:]],
+                         [(str(ELIGIBLE_VOTER_PK), 'False'), (str(INELIGIBLE_VOTER_PK), 'True')])
+
+    @patch('voters.api_key_verification.key_roles', return_value=RESULTS)
+    def test_export_turnout_can_be_gzipped(self, *_):
+        url = reverse('voters:export_turnout')
+        response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123',
+                                           'HTTP_ACCEPT_ENCODING': 'gzip, deflate'})
+        content = gzip.GzipFile(fileobj=io.BytesIO(b''.join(response.streaming_content))).read()
+        rows = list(csv.reader(content.decode('utf-8').splitlines()))
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(rows[1][1:], ['Richmond Park', str(STATION_PK), 'Kensington Library', '2', '1'])
+
+    @patch('voters.api_key_verification.key_roles', return_value=RESULTS)
+    def test_export_turnout_is_not_gzipped_when_refused(self, *_):
+        url = reverse('voters:export_turnout')
+        for accept_encoding in ('gzip;q=0, deflate', 'gzip; q=0.0', '*;q=0', 'identity'):
+            response = self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123',
+                                               'HTTP_ACCEPT_ENCODING': accept_encoding})
+
+            rows = list(csv.reader(streamed_content(response).splitlines()))
+
+            self.assertFalse(response.has_header('Content-Encoding'), accept_encoding)
+            self.assertEqual(rows[1][2], str(STATION_PK))
+
 
 class VoterTurnoutAPITests(TestCase):
 
@@ -282,3 +694,72 @@ class VoterTurnoutAPITests(TestCase):
 
         self.assertJSONEqual(response.content, {"turnout": [
                              {"constituency": "Richmond Park", "voted": 1, "registered_voters": 2}]})
+
+    def test_unchanged_turnout_is_not_modified(self):
+        create_eligible_voter(create_station(create_constituency()))
+        url = reverse('voters:voter_turnout')
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, RESPONSE_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        Voter.objects.mark_used_vote(ELIGIBLE_VOTER_PK)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, RESPONSE_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(MICRO_CACHE_SECONDS=60)
+    def test_micro_cache_serves_repeated_polls_from_memory(self):
+        create_eligible_voter(create_station(create_constituency()))
+        url = reverse('voters:voter_turnout')
+        first = self.client.get(url)
+
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+
+        self.assertEqual(second.content, first.content)
+
+
+class TurnoutHistoryAPITests(TestCase):
+
+    def setUp(self):
+        station = create_station(create_constituency())
+        create_eligible_voter(station)
+        create_ineligable_voter(station)
+        self.start = timezone.make_aware(datetime.datetime(2017, 6, 8, 7, 0), timezone.utc)
+        record_turnout_history(now=self.start)
+        Voter.objects.mark_used_vote(ELIGIBLE_VOTER_PK)
+        record_turnout_history(now=self.start + datetime.timedelta(minutes=5, seconds=30))
+        record_turnout_history(now=self.start + datetime.timedelta(minutes=6))
+
+    def test_series_lists_the_minutes_counts_changed(self):
+        url = reverse('voters:turnout_history')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'from': '2017-06-08T07:00:00Z',
+                                             'to': '2017-06-08T08:00:00Z'})
+
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(content['fields'], ['minute', 'registered_voters', 'voted'])
+        self.assertEqual(content['series'], [{
+            'constituency': CONSTITUENCY_PK, 'name': 'Richmond Park',
+            'points': [['2017-06-08T07:00:00Z', 2, 1], ['2017-06-08T07:05:00Z', 2, 2]]}])
+
+    def test_series_can_be_narrowed_to_stations_of_a_constituency(self):
+        url = reverse('voters:turnout_history')
+        response = self.client.get(url, {'level': 'station', 'constituency': CONSTITUENCY_PK,
+                                         'from': '2017-06-08T07:03:00Z',
+                                         'to': '2017-06-08T08:00:00Z'})
+
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(content['series'], [{
+            'station': STATION_PK, 'name': 'Kensington Library',
+            'points': [['2017-06-08T07:05:00Z', 2, 2]]}])
+
+    def test_invalid_ranges_are_rejected(self):
+        url = reverse('voters:turnout_history')
+        for query in ({'level': 'voter'}, {'from': 'yesterday'},
+                      {'from': '2017-06-08T08:00:00Z', 'to': '2017-06-08T07:00:00Z'},
+                      {'from': '2017-06-01T00:00:00Z', 'to': '2017-06-08T00:00:00Z'}):
+            response = self.client.get(url, query)
+            self.assertEqual(response.status_code, RESPONSE_BAD_REQUEST)
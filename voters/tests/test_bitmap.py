@@ -0,0 +1,159 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils.six import StringIO
+from mock import patch
+
+from ..bitmap import ACTIVE_PIN, USED_VOTE, VoterBitmap, lookup_voter, rebuild_voter_bitmap
+from ..models import Voter
+from .test_api import ALL_ROLES, ELIGIBLE_VOTER_PK, INELIGIBLE_VOTER_PK, NON_EXIST_VOTER_PK, \
+create_constituency, create_eligible_voter, create_ineligable_voter, create_station
+
+
+class VoterBitmapTests(TransactionTestCase):
+    # on_commit hooks only run when the transaction really commits
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'voters.bitmap')
+        settings_override = override_settings(VOTER_BITMAP_PATH=self.path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.station = create_station(create_constituency())
+        create_eligible_voter(self.station)
+        create_ineligable_voter(self.station)
+
+    def test_lookup_is_empty_until_built(self):
+        self.assertIsNone(lookup_voter(ELIGIBLE_VOTER_PK))
+
+        out = StringIO()
+        call_command('rebuild_voter_bitmap', stdout=out)
+
+        self.assertIn('2 voters', out.getvalue())
+        self.assertEqual(lookup_voter(ELIGIBLE_VOTER_PK), (True, False, False))
+        self.assertEqual(lookup_voter(INELIGIBLE_VOTER_PK), (True, True, False))
+        self.assertEqual(lookup_voter(NON_EXIST_VOTER_PK), (False, False, False))
+        self.assertIsNone(lookup_voter(10 ** 6))
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_check_votable_answers_without_database(self, *_):
+        rebuild_voter_bitmap()
+
+        with self.assertNumQueries(0):
+            exists = self.client.get(reverse('voters:check_votable', args=(INELIGIBLE_VOTER_PK,)),
+                                     HTTP_AUTHORIZATION='Basic 123')
+        # Confirmed against the database
+        with self.assertNumQueries(1):
+            missing = self.client.get(reverse('voters:check_votable', args=(NON_EXIST_VOTER_PK,)),
+                                      HTTP_AUTHORIZATION='Basic 123')
+
+        self.assertJSONEqual(exists.content, {'voter_exists': True, 'used_vote': True})
+        self.assertJSONEqual(missing.content, {'voter_exists': False, 'used_vote': None})
+
+    def test_committed_writes_update_bitmap(self):
+        rebuild_voter_bitmap()
+
+        Voter.objects.mark_used_vote(str(ELIGIBLE_VOTER_PK))
+        Voter.objects.mark_active_pins([ELIGIBLE_VOTER_PK, INELIGIBLE_VOTER_PK])
+        self.assertEqual(lookup_voter(ELIGIBLE_VOTER_PK), (True, True, True))
+
+        Voter.objects.get(pk=INELIGIBLE_VOTER_PK).delete()
+        self.assertEqual(lookup_voter(INELIGIBLE_VOTER_PK), (False, False, False))
+
+        voter = create_ineligable_voter(self.station)
+        self.assertEqual(lookup_voter(voter.pk), (True, True, False))
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_voters_missing_from_bitmap_are_read_from_database(self, *_):
+        rebuild_voter_bitmap()
+        with override_settings(VOTER_BITMAP_PATH=None):
+            # Written by a process without the bitmap
+            voter = Voter.objects.create(first_name='Ann', last_name='Lee', addr_line_1='',
+                                         postcode='SW7 3BH', date_of_birth=datetime.date(1970, 7, 7),
+                                         phone='+447654353000', station=self.station,
+                                         used_vote=True)
+        self.assertEqual(lookup_voter(voter.pk), (False, False, False))
+
+        response = self.client.get(reverse('voters:check_votable', args=(voter.pk,)),
+                                   HTTP_AUTHORIZATION='Basic 123')
+
+        self.assertJSONEqual(response.content, {'voter_exists': True, 'used_vote': True})
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_bulk_flag_updates_drop_voters_from_bitmap(self, *_):
+        rebuild_voter_bitmap()
+
+        Voter.objects.filter(pk=ELIGIBLE_VOTER_PK).update(used_vote=True)
+
+        self.assertFalse(lookup_voter(ELIGIBLE_VOTER_PK)[0])
+        self.assertEqual(lookup_voter(INELIGIBLE_VOTER_PK), (True, True, False))
+        response = self.client.get(reverse('voters:check_votable', args=(ELIGIBLE_VOTER_PK,)),
+                                   HTTP_AUTHORIZATION='Basic 123')
+        self.assertJSONEqual(response.content, {'voter_exists': True, 'used_vote': True})
+
+    def test_rolled_back_writes_leave_bitmap_alone(self):
+        rebuild_voter_bitmap()
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Voter.objects.mark_used_vote(ELIGIBLE_VOTER_PK)
+            raise RuntimeError
+
+        self.assertEqual(lookup_voter(ELIGIBLE_VOTER_PK), (True, False, False))
+
+    def test_workers_see_each_others_rebuilds_and_growth(self):
+        worker = VoterBitmap(self.path)
+        other_worker = VoterBitmap(self.path)
+        worker.rebuild([(1, False, False)], 1)
+        self.assertEqual(other_worker.lookup(1), (True, False, False))
+
+        worker.rebuild([(1, True, False)], 1)
+        self.assertEqual(other_worker.lookup(1), (True, True, False))
+
+        beyond = worker.capacity + 10
+        self.assertIsNone(other_worker.lookup(beyond))
+        worker.update([(beyond, {USED_VOTE: True, ACTIVE_PIN: True})])
+        self.assertEqual(other_worker.lookup(beyond), (False, True, True))
+
+
+class VoterBitmapThreadingTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.bitmap = VoterBitmap(os.path.join(directory, 'voters.bitmap'))
+        self.bitmap.rebuild([(1, True, False)], 1)
+
+    def test_lookups_survive_concurrent_rebuilds_and_growth(self):
+        errors = []
+        done = threading.Event()
+
+        def read():
+            try:
+                while not done.is_set():
+                    self.assertEqual(self.bitmap.lookup(1), (True, True, False))
+                    self.bitmap.lookup(self.bitmap.capacity + 5)
+            except Exception as error:
+                errors.append(error)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        try:
+            for _ in range(50):
+                self.bitmap.rebuild([(1, True, False)], 1)
+                self.bitmap.update([(self.bitmap.capacity + 3, {USED_VOTE: True})])
+        finally:
+            done.set()
+            for reader in readers:
+                reader.join()
+
+        self.assertEqual(errors, [])
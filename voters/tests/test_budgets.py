@@ -0,0 +1,158 @@
+"""
+Query and latency budgets for every view in voters/urls.py.
+
+Each view is requested against a roll with several constituencies,
+stations, candidates and voters, so a per-row query (N+1) exceeds the
+budget. Budgets that grow with the number of stations a request touches
+are written in terms of the dataset.
+
+Timing is opt-in: set VOTER_API_TIMING_BASELINE to a JSON file of
+{url name: p50 milliseconds} to fail any view whose p50 is more than
+VOTER_API_TIMING_TOLERANCE (default 1.5) times its baseline. With
+VOTER_API_UPDATE_BASELINE=1 the file is rewritten from this run instead.
+"""
+import json
+import os
+import re
+import unittest
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from mock import patch
+
+from ..benchmarking import summarize, time_calls
+from ..models import Constituency, Station, Voter
+from ..roll import generate_roll
+from ..turnout import record_turnout_history
+from ..urls import urlpatterns
+from .test_api import ALL_ROLES
+
+CONSTITUENCIES = 3
+STATIONS = 4
+VOTERS = 600
+CANDIDATES = 6
+BATCH_SIZE = 50
+
+# Most queries each view may run, for one request on the roll above
+QUERY_BUDGETS = {
+    'index': 0,
+    'voter_turnout': 1,
+    'turnout_history': 1,
+    'check_votable': 1,
+    'check_votable_batch': 1,
+    'get_voters': 1,
+    # conditional UPDATE, then the station and constituency counters
+    'make_voter_ineligible': 3,
+    # SELECT ... FOR UPDATE, UPDATE, then one UPDATE for each level of counters
+    'make_voter_ineligible_batch': 4,
+    'set_voter_has_active_pin': 1,
+    'set_voter_has_active_pin_batch': 2,
+    # cold cache: station -> constituency, then the candidate list
+    'get_candidates': 2,
+    # one keyset page per station plus the page that ends each station
+    'export_voters': 1 + 2 * STATIONS,
+    'export_turnout': 2,
+    'metrics': 0,
+}
+
+SAVEPOINT_SQL = re.compile(r'(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT) ')
+
+TIMING_BASELINE = os.environ.get('VOTER_API_TIMING_BASELINE')
+TIMING_TOLERANCE = float(os.environ.get('VOTER_API_TIMING_TOLERANCE', 1.5))
+UPDATE_BASELINE = os.environ.get('VOTER_API_UPDATE_BASELINE') == '1'
+TIMING_REPEAT = 30
+
+
+@patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+class ViewBudgetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_roll(constituencies=CONSTITUENCIES, stations=STATIONS, voters=VOTERS,
+                      candidates=CANDIDATES, used_vote_fraction=0.2, seed=0)
+        record_turnout_history()
+
+    def setUp(self):
+        voter_ids = list(Voter.objects.order_by('pk').values_list('pk', flat=True))
+        station = Station.objects.order_by('pk').first()
+        voter = Voter.objects.filter(station=station).order_by('pk').first()
+        # Spread the batches over every station
+        by_station = {}
+        for pk, station_id in Voter.objects.order_by('pk').values_list('pk', 'station'):
+            by_station.setdefault(station_id, []).append(pk)
+        batch = [pk for pks in zip(*by_station.values()) for pk in pks][:BATCH_SIZE]
+        # url name -> (url args, JSON body or None for a GET)
+        self.requests = {
+            'index': ((), None),
+            'voter_turnout': ((), None),
+            'turnout_history': ((), None),
+            'check_votable': ((voter_ids[0],), None),
+            'check_votable_batch': ((), {'voter_ids': batch}),
+            'get_voters': ((station.pk, voter.first_name[:3], station.postcode), None),
+            'make_voter_ineligible': ((voter_ids[1],), None),
+            'make_voter_ineligible_batch': ((), {'voter_ids': batch}),
+            'set_voter_has_active_pin': ((voter_ids[2],), None),
+            'set_voter_has_active_pin_batch': ((), {'voter_ids': batch}),
+            'get_candidates': ((station.pk,), None),
+            'export_voters': ((Constituency.objects.order_by('pk').first().pk,), None),
+            'export_turnout': ((), None),
+            'metrics': ((), None),
+        }
+
+    def request(self, name):
+        args, body = self.requests[name]
+        url = reverse('voters:' + name, args=args)
+        if body is None:
+            response = self.client.get(url, HTTP_AUTHORIZATION='Basic 123')
+        else:
+            response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                        HTTP_AUTHORIZATION='Basic 123')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200, name)
+        return response
+
+    def test_every_view_has_a_budget(self, *_):
+        names = set(pattern.name for pattern in urlpatterns)
+        self.assertEqual(names - set(QUERY_BUDGETS), set())
+        self.assertEqual(names - set(self.requests), set())
+
+    def test_views_stay_within_query_budget(self, *_):
+        over_budget = []
+        for name, budget in sorted(QUERY_BUDGETS.items()):
+            cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                self.request(name)
+            # Savepoints stand in for the transactions TestCase wraps around each test
+            queries = [query['sql'] for query in captured.captured_queries
+                       if not SAVEPOINT_SQL.match(query['sql'])]
+            if len(queries) > budget:
+                over_budget.append('%s: %d queries, budget %d\n    %s' % (
+                    name, len(queries), budget, '\n    '.join(sql[:200] for sql in queries)))
+        if over_budget:
+            self.fail('Views over their query budget:\n' + '\n'.join(over_budget))
+
+    @unittest.skipUnless(TIMING_BASELINE, 'set VOTER_API_TIMING_BASELINE to check latency')
+    def test_views_stay_within_latency_baseline(self, *_):
+        timings = {}
+        for name in sorted(QUERY_BUDGETS):
+            self.request(name)  # warm up caches
+            timings[name] = summarize(time_calls(lambda: self.request(name), TIMING_REPEAT))['p50_ms']
+
+        if UPDATE_BASELINE:
+            with open(TIMING_BASELINE, 'w') as out:
+                json.dump(timings, out, indent=2, sort_keys=True)
+            return
+
+        with open(TIMING_BASELINE) as baseline_file:
+            baseline = json.load(baseline_file)
+        slower = ['%s: p50 %.2fms, baseline %.2fms (x%.1f)' % (
+                      name, p50, baseline[name], p50 / baseline[name])
+                  for name, p50 in sorted(timings.items())
+                  if name in baseline and p50 > baseline[name] * TIMING_TOLERANCE]
+        if slower:
+            self.fail('Views slower than %.1fx their baseline:\n%s' % (
+                TIMING_TOLERANCE, '\n'.join(slower)))
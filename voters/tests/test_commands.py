@@ -0,0 +1,156 @@
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+from mock import patch
+
+from ..importer import voter_indexes_present
+from ..models import Constituency, Station, Voter, Party, StationTurnout, VoterImport, \
+StationTurnoutHistory
+
+
+def create_roll():
+    constituency = Constituency.objects.create(name="Richmond Park")
+    station = Station.objects.create(name="Kensington Library", addr_line_1="", postcode="SW7 3BH", constituency=constituency)
+    Voter.objects.create(first_name="James", last_name="Bond", addr_line_1="007 Spy Street", postcode="SW7 3BH", date_of_birth=datetime.date(1970, 7, 7), phone="+447654353205", station=station, used_vote=True)
+    return station
+
+
+class RebuildTurnoutCommandTests(TestCase):
+
+    def test_verify_passes_for_maintained_counters(self):
+        create_roll()
+        out = StringIO()
+        call_command('rebuild_turnout', verify=True, stdout=out)
+        self.assertIn('up to date', out.getvalue())
+
+    def test_verify_fails_and_rebuild_repairs_drifted_counters(self):
+        station = create_roll()
+        StationTurnout.objects.filter(station=station).update(voted=0)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_turnout', verify=True, stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_turnout', stdout=StringIO())
+
+        self.assertEqual(StationTurnout.objects.get(station=station).voted, 1)
+        call_command('rebuild_turnout', verify=True, stdout=StringIO())
+
+
+class RecordTurnoutHistoryCommandTests(TestCase):
+
+    @patch('voters.turnout.timezone.now',
+           return_value=timezone.make_aware(datetime.datetime(2017, 6, 8, 7, 0, 30), timezone.utc))
+    def test_records_only_changed_counters_once_per_minute(self, _):
+        station = create_roll()
+        out = StringIO()
+        call_command('record_turnout_history', stdout=out)
+        call_command('record_turnout_history', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['Recorded 2 turnout history rows.',
+                                                       'Recorded 0 turnout history rows.'])
+
+        Voter.objects.create(first_name="Eve", last_name="Moneypenny", addr_line_1="",
+                             postcode="SW7 3BH", date_of_birth=datetime.date(1970, 1, 1),
+                             phone="", station=station)
+        call_command('record_turnout_history', stdout=StringIO())
+
+        history = StationTurnoutHistory.objects.filter(station=station)
+        self.assertEqual(history.count(), 1)
+        self.assertEqual((history.get().registered_voters, history.get().voted), (2, 1))
+
+
+class GenerateRollCommandTests(TestCase):
+
+    def generate(self, seed):
+        call_command('generate_roll', constituencies=2, stations=3, voters=50, parties=2,
+                     candidates=2, used_vote_fraction=0.5, seed=seed, chunk_size=20,
+                     stdout=StringIO())
+        return list(Voter.objects.order_by('pk').values_list(
+            'first_name', 'last_name', 'postcode', 'station__name', 'used_vote'))
+
+    def test_generates_requested_roll_with_counters(self):
+        self.generate(seed=1)
+
+        self.assertEqual(Constituency.objects.count(), 2)
+        self.assertEqual(Station.objects.count(), 6)
+        self.assertEqual(Voter.objects.count(), 50)
+        name = Voter.objects.first().first_name
+        self.assertEqual(Voter.objects.name_contains(name).count(),
+                         Voter.objects.filter(first_name__icontains=name).count())
+        call_command('rebuild_turnout', verify=True, stdout=StringIO())
+
+    def test_generation_is_deterministic(self):
+        first = self.generate(seed=7)
+        Constituency.objects.all().delete()
+        Party.objects.all().delete()
+
+        self.assertEqual(self.generate(seed=7), first)
+
+
+class ImportVotersCommandTests(TestCase):
+
+    def setUp(self):
+        self.station = create_roll()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'register.csv')
+        rows = [['first_name', 'last_name', 'addr_line_1', 'addr_line_2', 'postcode',
+                 'date_of_birth', 'phone', 'station_id']]
+        for n in range(7):
+            rows.append(['Voter%d' % n, 'Smith', '%d High Street' % n, '', 'SW7 3BH',
+                         '1980-01-0%d' % (n + 1), '+4470000000%d' % n, str(self.station.pk)])
+        rows.append(['Bad', 'Date', '1 High Street', '', 'SW7 3BH', '1980-13-01', '+44', str(self.station.pk)])
+        rows.append(['No', 'Station', '1 High Street', '', 'SW7 3BH', '1980-01-01', '+44', '999'])
+        with open(self.path, 'w') as csv_file:
+            csv_file.write('\n'.join(','.join(row) for row in rows) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_imports_valid_rows_and_reports_invalid_ones(self):
+        out, err = StringIO(), StringIO()
+        call_command('import_voters', self.path, batch_size=3, chunk_size=2, stdout=out, stderr=err)
+
+        self.assertEqual(Voter.objects.filter(last_name='Smith').count(), 7)
+        self.assertIn('row 8: invalid date_of_birth', err.getvalue())
+        self.assertIn('row 9: unknown station 999', err.getvalue())
+        self.assertEqual(Voter.objects.name_contains('voter3').get().phone, '+44700000003')
+        self.assertEqual(Voter.objects.filter(last_name='Smith', postcode_key='SW73BH').count(), 7)
+        self.assertEqual(StationTurnout.objects.get(station=self.station).registered_voters, 8)
+        self.assertEqual(len(voter_indexes_present()), len(Voter._meta.indexes))
+        call_command('rebuild_turnout', verify=True, stdout=StringIO())
+
+    def test_rerun_resumes_after_committed_rows(self):
+        VoterImport.objects.create(source=os.path.abspath(self.path), rows_done=6)
+        call_command('import_voters', self.path, batch_size=3, stdout=StringIO(), stderr=StringIO())
+        call_command('import_voters', self.path, batch_size=3, stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(list(Voter.objects.filter(last_name='Smith').values_list('first_name', flat=True)),
+                         ['Voter6'])
+
+
+class ExportCsvCommandTests(TestCase):
+
+    def test_exports_constituency_voters_gzipped(self):
+        station = create_roll()
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'voters.csv.gz')
+        try:
+            call_command('export_csv', 'voters', constituency=station.constituency_id,
+                         output=path, gzip=True)
+            with gzip.open(path) as export:
+                lines = export.read().decode('utf-8').splitlines()
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].endswith('Kensington Library,True,False'))
+
+    def test_voters_extract_needs_constituency(self):
+        with self.assertRaises(CommandError):
+            call_command('export_csv', 'voters')
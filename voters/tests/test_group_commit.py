@@ -0,0 +1,117 @@
+import threading
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from mock import patch
+
+from ..group_commit import GroupCommitWriter, _Call, apply_flag, apply_flags, mark_voter
+from ..models import Voter, StationTurnout, CHANGED, ALREADY_SET, NOT_FOUND
+from .test_api import ALL_ROLES, ELIGIBLE_VOTER_PK, INELIGIBLE_VOTER_PK, NON_EXIST_VOTER_PK, \
+create_constituency, create_eligible_voter, create_ineligable_voter, create_station
+
+
+class GroupCommitWriterTests(SimpleTestCase):
+
+    def submit_concurrently(self, writer, items):
+        results, errors = {}, {}
+
+        def submit(item):
+            try:
+                results[item] = writer.submit(item)
+            except ValueError as error:
+                errors[item] = error
+        threads = [threading.Thread(target=submit, args=(item,)) for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_calls_are_applied_together(self):
+        groups = []
+
+        def apply(items):
+            groups.append(items)
+            return [item * 10 for item in items]
+        writer = GroupCommitWriter(apply, window=1.0, max_batch=8)
+
+        results, _ = self.submit_concurrently(writer, range(8))
+
+        self.assertEqual(results, dict((item, item * 10) for item in range(8)))
+        # The full batch was committed without waiting out the window
+        self.assertEqual([sorted(group) for group in groups], [list(range(8))])
+
+    def test_failed_group_raises_in_every_caller(self):
+        def apply(items):
+            raise ValueError('database is locked')
+        writer = GroupCommitWriter(apply, window=0.05, max_batch=3)
+
+        results, errors = self.submit_concurrently(writer, range(3))
+
+        self.assertEqual(results, {})
+        self.assertEqual(sorted(errors), [0, 1, 2])
+
+    def test_failed_group_is_retried_one_call_at_a_time(self):
+        def apply_one(item):
+            if item == 1:
+                raise ValueError('bad item')
+            return item * 10
+
+        def apply(items):
+            return [apply_one(item) for item in items]
+        writer = GroupCommitWriter(apply, window=1.0, max_batch=3, apply_one=apply_one)
+
+        results, errors = self.submit_concurrently(writer, range(3))
+
+        self.assertEqual(results, {0: 0, 2: 20})
+        self.assertEqual(list(errors), [1])
+
+
+class ApplyFlagsTests(TestCase):
+
+    def setUp(self):
+        self.station = create_station(create_constituency())
+        create_eligible_voter(self.station)
+        create_ineligable_voter(self.station)
+
+    def test_outcomes_match_one_call_at_a_time(self):
+        outcomes = apply_flags([(ELIGIBLE_VOTER_PK, 'used_vote'),
+                                (ELIGIBLE_VOTER_PK, 'active_pin'),
+                                (INELIGIBLE_VOTER_PK, 'used_vote'),
+                                (ELIGIBLE_VOTER_PK, 'used_vote'),
+                                (NON_EXIST_VOTER_PK, 'used_vote')])
+
+        self.assertEqual(outcomes, [CHANGED, CHANGED, ALREADY_SET, ALREADY_SET, NOT_FOUND])
+        self.assertTrue(Voter.objects.filter(pk=ELIGIBLE_VOTER_PK, used_vote=True,
+                                             active_pin=True).exists())
+        self.assertEqual(StationTurnout.objects.get(station=self.station).voted, 2)
+
+    def test_poisoned_group_only_fails_the_bad_call(self):
+        writer = GroupCommitWriter(apply_flags, window=0, max_batch=2, apply_one=apply_flag)
+        good, bad = _Call((ELIGIBLE_VOTER_PK, 'used_vote')), _Call((10 ** 20, 'used_vote'))
+
+        writer._commit([good, bad])
+
+        self.assertEqual((good.result, good.error), (CHANGED, None))
+        self.assertIsInstance(bad.error, OverflowError)
+        self.assertTrue(Voter.objects.get(pk=ELIGIBLE_VOTER_PK).used_vote)
+
+    def test_ids_out_of_range_are_not_found(self):
+        for window in (0, 1):
+            with override_settings(GROUP_COMMIT_WINDOW_MS=window):
+                self.assertEqual(mark_voter(10 ** 20, 'used_vote'), NOT_FOUND)
+                self.assertEqual(mark_voter(0, 'active_pin'), NOT_FOUND)
+
+    @override_settings(GROUP_COMMIT_WINDOW_MS=1)
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_views_use_group_commit_when_enabled(self, *_):
+        url = reverse('voters:make_voter_ineligible', args=(ELIGIBLE_VOTER_PK,))
+
+        with patch.object(GroupCommitWriter, 'submit', autospec=True,
+                          side_effect=GroupCommitWriter.submit) as submit:
+            first = self.client.get(url, HTTP_AUTHORIZATION='Basic 123')
+            second = self.client.get(url, HTTP_AUTHORIZATION='Basic 123')
+
+        self.assertJSONEqual(first.content, {'success': True, 'changed': True})
+        self.assertJSONEqual(second.content, {'success': True, 'changed': False})
+        self.assertEqual(submit.call_count, 2)
@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from mock import patch
+
+from .. import metrics
+from ..api_key_verification import MONITORING
+from .test_api import ALL_ROLES, NO_ROLES, STATION_PK, create_constituency, \
+create_eligible_voter, create_station, streamed_content
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(METRICS_DIR=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def get(self, name, *args):
+        return self.client.get(reverse('voters:%s' % name, args=args),
+                               HTTP_AUTHORIZATION='Basic 123')
+
+    def test_records_statuses_latency_and_queries_per_view(self):
+        with patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES):
+            self.get('check_votable', 1)
+        with patch('voters.api_key_verification.key_roles', return_value=NO_ROLES):
+            self.get('check_votable', 1)
+        self.client.get(reverse('voters:check_votable', args=(1,)))
+
+        check_votable = metrics.collect_metrics()['voters:check_votable']
+        self.assertEqual(check_votable['statuses'], {'200': 1, '401': 1, '403': 1})
+        self.assertEqual(check_votable['count'], 3)
+        self.assertEqual(sum(check_votable['buckets']), 3)
+        self.assertEqual(check_votable['queries'], 1)
+
+    def test_views_are_told_apart_by_namespace(self):
+        self.client.get(reverse('voters:index'))
+        self.client.get(reverse('admin:index'))
+
+        collected = metrics.collect_metrics()
+        self.assertEqual(collected['voters:index']['count'], 1)
+        self.assertEqual(collected['admin:index']['count'], 1)
+
+    @patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+    def test_streamed_responses_count_queries_run_while_streaming(self, *_):
+        create_eligible_voter(create_station(create_constituency()))
+        streamed_content(self.get('get_voters', STATION_PK, 'James', 'SW7 3BH'))
+
+        self.assertEqual(metrics.collect_metrics()['voters:get_voters']['queries'], 1)
+
+    def test_adds_up_flushed_workers(self):
+        metrics.record('voter_turnout', 200, 0.002, 1, 0.001)
+        other_worker = metrics.empty_metrics()
+        other_worker.update(count=2, statuses={'200': 2}, queries=2)
+        other_worker['buckets'][-1] = 2
+        metrics.flush()
+        # The test runner's parent stands in for another running worker
+        with open(metrics.metrics_path(os.getppid(), 1), 'w') as out:
+            json.dump({'voter_turnout': other_worker}, out)
+
+        text = metrics.prometheus_text(metrics.collect_metrics())
+
+        self.assertIn('voter_api_requests_total{view="voter_turnout",status="200"} 3', text)
+        self.assertIn('voter_api_request_duration_seconds_bucket{view="voter_turnout",le="0.005"} 1', text)
+        self.assertIn('voter_api_request_duration_seconds_bucket{view="voter_turnout",le="+Inf"} 3', text)
+        self.assertIn('voter_api_db_queries_total{view="voter_turnout"} 3', text)
+
+    def test_drops_files_of_exited_workers(self):
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        ghosts = [metrics.metrics_path(exited.pid, 1),
+                  # The same pid, reused by a worker that started later
+                  metrics.metrics_path(os.getppid(), 1),
+                  metrics.metrics_path(os.getpid(), 1)]
+        live = metrics.metrics_path(os.getppid(), 2)
+        for path in ghosts + [live]:
+            with open(path, 'w') as out:
+                json.dump({'voter_turnout': dict(metrics.empty_metrics(), count=1)}, out)
+
+        self.assertEqual(metrics.collect_metrics()['voter_turnout']['count'], 1)
+        self.assertEqual([os.path.exists(path) for path in ghosts + [live]],
+                         [False, False, False, True])
+
+    def test_metrics_endpoint_requires_monitoring_role(self):
+        with patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES & ~MONITORING):
+            self.assertEqual(self.get('metrics').status_code, 403)
+        with patch('voters.api_key_verification.key_roles', return_value=MONITORING):
+            response = self.get('metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'voter_api_requests_total{view="voters:metrics",status="403"} 1', response.content)
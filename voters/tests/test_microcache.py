@@ -0,0 +1,67 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+from mock import patch
+
+from ..microcache import LOCK_STRIPES, MicroCache
+
+
+class MicroCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = MicroCache()
+        self.calls = []
+
+    def compute(self, value='value', delay=0):
+        def compute():
+            self.calls.append(value)
+            time.sleep(delay)
+            return value
+        return compute
+
+    def test_burst_of_misses_computes_once(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                       self.cache.get('key', self.compute(delay=0.05), ttl=10)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, ['value'])
+        self.assertEqual(results, ['value'] * 5)
+
+    @patch('voters.microcache.time.time')
+    def test_expired_value_is_recomputed(self, now):
+        now.return_value = 100
+        self.cache.get('key', self.compute('old'), ttl=1)
+        now.return_value = 102
+
+        self.assertEqual(self.cache.get('key', self.compute('new'), ttl=1), 'new')
+
+    @patch('voters.microcache.time.time')
+    def test_stale_value_is_served_while_another_request_recomputes(self, now):
+        now.return_value = 100
+        self.cache.get('key', self.compute('old'), ttl=1, stale=5)
+        now.return_value = 102
+
+        with self.cache._lock('key'):
+            self.assertEqual(self.cache.get('key', self.compute('new'), ttl=1, stale=5), 'old')
+        self.assertEqual(self.cache.get('key', self.compute('new'), ttl=1, stale=5), 'new')
+        self.assertEqual(self.calls, ['old', 'new'])
+
+    def test_disabled_and_none_values_are_not_cached(self):
+        self.cache.get('key', self.compute(), ttl=0)
+        self.cache.get('key', self.compute(None), ttl=10)
+        self.cache.get('key', self.compute(), ttl=10)
+
+        self.assertEqual(self.calls, ['value', None, 'value'])
+
+    def test_locks_do_not_grow_with_keys(self):
+        for key in range(LOCK_STRIPES * 4):
+            self.cache.get(('turnout', key), self.compute(), ttl=10)
+
+        self.assertEqual(len(self.cache._locks), LOCK_STRIPES)
+        self.assertIs(self.cache._lock(('turnout', 1)), self.cache._lock(('turnout', 1)))
@@ -0,0 +1,26 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+
+class LeanMiddlewareTests(TestCase):
+
+    def test_api_requests_skip_browser_middleware(self):
+        response = self.client.get(reverse('voters:index'))
+
+        self.assertNotIn('X-Frame-Options', response)
+        self.assertFalse(hasattr(response.wsgi_request, 'session'))
+        self.assertFalse(hasattr(response.wsgi_request, 'user'))
+
+    def test_admin_requests_get_full_stack(self):
+        response = self.client.get(reverse('admin:login'))
+
+        self.assertEqual(response['X-Frame-Options'], 'SAMEORIGIN')
+        self.assertTrue(hasattr(response.wsgi_request, 'session'))
+        self.assertIn('csrftoken', response.cookies)
+
+    @override_settings(LEAN_API_MIDDLEWARE=False)
+    def test_full_stack_when_disabled(self):
+        response = self.client.get(reverse('voters:index'))
+
+        self.assertEqual(response['X-Frame-Options'], 'SAMEORIGIN')
+        self.assertTrue(hasattr(response.wsgi_request, 'user'))
@@ -1,7 +1,9 @@
 import datetime
 from django.test import TestCase
+from mock import patch
 
-from ..models import Constituency, Station, Voter, Party, Candidate
+from ..models import Constituency, Station, Voter, Party, Candidate, \
+ConstituencyTurnout, StationTurnout, VoterNameTrigram, VoterManager, ALREADY_SET, CHANGED
 
 
 def create_constituency():
@@ -71,6 +73,22 @@ class VoterModelTests(TestCase):
         self.assertEqual(Voter.objects.all().count(), 0)
         self.assertEqual(saved_station.name, station.name)
 
+    def test_save_keeps_postcode_key_normalized(self):
+        constituency = create_constituency()
+        constituency.save()
+        station = create_station(constituency)
+        station.postcode = 'sw7  3xz'
+        station.save()
+        voter = create_voter(station)
+        voter.save()
+        self.assertEqual(Station.objects.get().postcode_key, 'SW73XZ')
+        self.assertEqual(Voter.objects.get().postcode_key, 'SW77MQ')
+
+        voter.postcode = 'TW9 4EQ'
+        voter.save(update_fields=['postcode'])
+        self.assertEqual(Voter.objects.get().postcode_key, 'TW94EQ')
+
+
 class PartyModelTests(TestCase):
 
     def test_string_representation(self):
@@ -100,3 +118,157 @@ class CandidateModelTests(TestCase):
         self.assertEqual(Candidate.objects.all().count(), 0)
         self.assertEqual(saved_party.name, party.name)
         self.assertEqual(saved_constituency.name, constituency.name)
+
+
+class TurnoutCounterTests(TestCase):
+
+    def setUp(self):
+        self.constituency = create_constituency()
+        self.constituency.save()
+        self.station = create_station(self.constituency)
+        self.station.save()
+
+    def assertTurnout(self, registered_voters, voted):
+        station_turnout = StationTurnout.objects.get(station=self.station)
+        constituency_turnout = ConstituencyTurnout.objects.get(constituency=self.constituency)
+        self.assertEqual((station_turnout.registered_voters, station_turnout.voted),
+                         (registered_voters, voted))
+        self.assertEqual((constituency_turnout.registered_voters, constituency_turnout.voted),
+                         (registered_voters, voted))
+
+    def test_new_station_starts_with_empty_counters(self):
+        self.assertTurnout(0, 0)
+
+    def test_creating_voter_registers_them(self):
+        create_voter(self.station).save()
+        self.assertTurnout(1, 0)
+
+    def test_using_vote_counts_as_voted(self):
+        voter = create_voter(self.station)
+        voter.save()
+        voter = Voter.objects.get(pk=voter.pk)
+        voter.used_vote = True
+        voter.save()
+        voter.save()
+        self.assertTurnout(1, 1)
+
+    def test_deleting_voter_removes_them(self):
+        voter = create_voter(self.station)
+        voter.used_vote = True
+        voter.save()
+        Voter.objects.get(pk=voter.pk).delete()
+        self.assertTurnout(0, 0)
+
+    def test_moving_station_moves_constituency_totals(self):
+        voter = create_voter(self.station)
+        voter.used_vote = True
+        voter.save()
+        other = Constituency(name="Richmond Park")
+        other.save()
+        station = Station.objects.get(pk=self.station.pk)
+        station.constituency = other
+        station.save()
+
+        self.assertEqual(ConstituencyTurnout.objects.get(constituency=self.constituency).voted, 0)
+        self.assertEqual(ConstituencyTurnout.objects.get(constituency=other).voted, 1)
+
+    def test_bulk_used_vote_updates_adjust_counters(self):
+        voters = [create_voter(self.station) for _ in range(3)]
+        for voter in voters:
+            voter.save()
+        Voter.objects.mark_used_vote(voters[0].pk)
+
+        Voter.objects.update(used_vote=True)
+        self.assertTurnout(3, 3)
+        Voter.objects.filter(pk__in=[voters[0].pk, voters[1].pk]).update(used_vote=False)
+        self.assertTurnout(3, 1)
+
+    def test_bulk_updates_refuse_fields_only_save_keeps_in_step(self):
+        create_voter(self.station).save()
+
+        for field in ('station', 'first_name'):
+            with self.assertRaises(ValueError):
+                Voter.objects.update(**{field: getattr(Voter.objects.get(), field)})
+
+    @patch('voters.models.ADD_VOTES_CHUNK', 1)
+    def test_batch_votes_count_towards_each_station(self):
+        other = Station(name="Richmond Library", addr_line_1="", postcode="TW9 1TP",
+                        constituency=self.constituency)
+        other.save()
+        voters = [create_voter(station) for station in (self.station, self.station, other)]
+        for voter in voters:
+            voter.save()
+
+        Voter.objects.mark_used_votes([voter.pk for voter in voters])
+
+        self.assertEqual(StationTurnout.objects.get(station=self.station).voted, 2)
+        self.assertEqual(StationTurnout.objects.get(station=other).voted, 1)
+        self.assertEqual(ConstituencyTurnout.objects.get(constituency=self.constituency).voted, 3)
+
+    def test_batch_votes_racing_a_single_vote_count_once(self):
+        voters = [create_voter(self.station) for _ in range(2)]
+        for voter in voters:
+            voter.save()
+        unset_flags = VoterManager._unset_flags
+        raced = []
+
+        def vote_between_read_and_write(manager, *args):
+            keys = unset_flags(manager, *args)
+            # Another booth marks the first voter after the batch has read it
+            raced.append(Voter.objects.mark_used_vote(voters[0].pk))
+            return keys
+
+        with patch.object(VoterManager, '_unset_flags', vote_between_read_and_write):
+            outcomes = Voter.objects.mark_used_votes([voter.pk for voter in voters])
+
+        self.assertEqual(raced, [CHANGED])
+        self.assertEqual(outcomes, {voters[0].pk: ALREADY_SET, voters[1].pk: CHANGED})
+        self.assertEqual(StationTurnout.objects.get(station=self.station).voted, 2)
+        self.assertEqual(ConstituencyTurnout.objects.get(constituency=self.constituency).voted, 2)
+
+
+class VoterNameSearchTests(TestCase):
+
+    def setUp(self):
+        constituency = create_constituency()
+        constituency.save()
+        self.station = create_station(constituency)
+        self.station.save()
+        for first_name in ("James", "Jameson", "Jim", "Ajay", "Mary-Jane"):
+            voter = create_voter(self.station)
+            voter.first_name = first_name
+            voter.save()
+
+    def assertMatchesIcontains(self, name):
+        expected = Voter.objects.filter(first_name__icontains=name)
+        self.assertEqual(sorted(Voter.objects.name_contains(name).values_list('pk', flat=True)),
+                         sorted(expected.values_list('pk', flat=True)))
+
+    def test_search_matches_icontains(self):
+        for name in ("jam", "JAMES", "ameso", "J", "ja", "ay", "y-j", "jane", "bond", "m"):
+            self.assertMatchesIcontains(name)
+
+    def test_search_can_be_confined_to_a_station(self):
+        other_station = create_station(self.station.constituency)
+        other_station.save()
+        voter = Voter.objects.get(first_name="Jameson")
+        voter.station = other_station
+        voter.save()
+
+        self.assertEqual(set(VoterNameTrigram.objects.filter(voter=voter)
+                             .values_list('station', flat=True)), {other_station.pk})
+        self.assertEqual(list(Voter.objects.name_contains("jameson", station=other_station.pk)
+                              .values_list('pk', flat=True)), [voter.pk])
+        self.assertFalse(Voter.objects.name_contains("jameson", station=self.station.pk).exists())
+
+    def test_renaming_voter_reindexes_name(self):
+        voter = Voter.objects.get(first_name="Jim")
+        voter.first_name = "Timothy"
+        voter.save()
+
+        self.assertFalse(Voter.objects.name_contains("Jim").exists())
+        self.assertEqual(Voter.objects.name_contains("imot").get().pk, voter.pk)
+
+    def test_deleting_voter_removes_index_entries(self):
+        Voter.objects.all().delete()
+        self.assertEqual(VoterNameTrigram.objects.count(), 0)
@@ -0,0 +1,54 @@
+import json
+
+from django.core import serializers
+from django.test import TestCase
+
+from ..models import Candidate, Voter
+from ..projection import VOTER_PROJECTION, CANDIDATE_PROJECTION, COLUMNS, json_body
+from ..roll import generate_roll
+
+
+class ProjectionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_roll(constituencies=2, stations=2, voters=40, candidates=3,
+                      used_vote_fraction=0.5, seed=0)
+
+    def test_records_match_django_serializer(self):
+        voters = Voter.objects.order_by('pk')
+        names = VOTER_PROJECTION.select()
+        rows = VOTER_PROJECTION.rows(voters, names)
+        self.assertEqual('[%s]' % ''.join(VOTER_PROJECTION.encode_records(rows, names, 7)),
+                         serializers.serialize('json', voters))
+
+    def test_candidate_records_use_natural_keys(self):
+        candidates = Candidate.objects.order_by('pk')
+        names = CANDIDATE_PROJECTION.select()
+        rows = CANDIDATE_PROJECTION.rows(candidates, names)
+        self.assertEqual('[%s]' % ''.join(CANDIDATE_PROJECTION.encode_records(rows, names)),
+                         serializers.serialize('json', candidates, use_natural_foreign_keys=True))
+
+    def test_records_hold_only_selected_fields(self):
+        voters = Voter.objects.order_by('pk')
+        records = json.loads(''.join(json_body(
+            'voters', VOTER_PROJECTION, voters, ['used_vote', 'first_name'])))['voters']
+
+        self.assertEqual(records[0], {'model': 'voters.voter', 'pk': voters[0].pk,
+                                      'fields': {'first_name': voters[0].first_name,
+                                                 'used_vote': voters[0].used_vote}})
+
+    def test_columns_hold_one_list_per_field(self):
+        voters = Voter.objects.order_by('pk')
+        content = json.loads(''.join(json_body('voters', VOTER_PROJECTION, voters,
+                                               ['postcode', 'date_of_birth'], COLUMNS)))
+
+        self.assertTrue(content['success'])
+        self.assertEqual(set(content['voters']), {'pk', 'postcode', 'date_of_birth'})
+        self.assertEqual(content['voters']['pk'], [voter.pk for voter in voters])
+        self.assertEqual(content['voters']['date_of_birth'][0],
+                         voters[0].date_of_birth.isoformat())
+
+    def test_unknown_fields_are_rejected(self):
+        with self.assertRaises(ValueError):
+            VOTER_PROJECTION.select(['first_name', 'password'])
@@ -0,0 +1,137 @@
+import json
+import re
+import unittest
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.backends.sqlite3.base import SQLiteCursorWrapper
+from django.test import TestCase
+from django.urls import reverse
+from mock import patch
+
+from ..models import Voter
+from ..turnout import record_turnout_history
+from .test_api import ALL_ROLES, create_constituency, create_station, create_eligible_voter, \
+create_ineligable_voter, create_party, create_candidate, ELIGIBLE_VOTER_PK, \
+INELIGIBLE_VOTER_PK, NON_EXIST_VOTER_PK, STATION_PK, CONSTITUENCY_PK
+
+# Tables that views are expected to read in full: turnout counters, one row
+# per constituency or per station.
+FULL_SCAN_ALLOWED = {'voters_constituencyturnout', 'voters_stationturnout'}
+
+SCAN_REGEX = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+# Subqueries name their tables by alias, e.g. "voters_stationturnout" V0
+ALIAS_REGEX = re.compile(r'"(\w+)" ([A-Z]\d+)\b')
+TRANSACTION_STATEMENTS = ('SAVEPOINT', 'RELEASE', 'ROLLBACK', 'BEGIN', 'COMMIT')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite specific')
+@patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+class QueryPlanTests(TestCase):
+    """
+    Run every view and EXPLAIN each statement it issues, failing if any of
+    them scans a whole table instead of searching an index.
+    """
+
+    def setUp(self):
+        constituency = create_constituency()
+        station = create_station(constituency)
+        create_eligible_voter(station)
+        create_ineligable_voter(station)
+        create_candidate(constituency=constituency, party=create_party())
+
+    def capture_statements(self, request):
+        statements = []
+        execute = SQLiteCursorWrapper.execute
+
+        def record(cursor, sql, params=None):
+            statements.append((sql, params))
+            return execute(cursor, sql, params)
+
+        with patch.object(SQLiteCursorWrapper, 'execute', record):
+            response = request()
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+        return [(sql, params) for sql, params in statements
+                if not sql.lstrip().upper().startswith(TRANSACTION_STATEMENTS)]
+
+    def assertNoFullScans(self, request):
+        statements = self.capture_statements(request)
+        self.assertTrue(statements)
+        with connection.cursor() as cursor:
+            for sql, params in statements:
+                aliases = dict((alias, table) for table, alias in ALIAS_REGEX.findall(sql))
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                for row in cursor.fetchall():
+                    match = SCAN_REGEX.match(row[-1])
+                    table = match and aliases.get(match.group(1), match.group(1))
+                    if match and table not in FULL_SCAN_ALLOWED | {'CONSTANT', 'SUBQUERY'}:
+                        self.fail('Full scan of %s in: %s' % (table, sql))
+
+    def assertUsesIndex(self, request, index):
+        plans = []
+        with connection.cursor() as cursor:
+            for sql, params in self.capture_statements(request):
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plans.extend(row[-1] for row in cursor.fetchall())
+        self.assertTrue(any(index in plan for plan in plans),
+                        'No statement used %s:\n%s' % (index, '\n'.join(plans)))
+
+    def get(self, name, *args):
+        url = reverse(name, args=args)
+        return lambda: self.client.get(url, **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+    def post(self, name, voter_ids):
+        url = reverse(name)
+        body = json.dumps({'voter_ids': voter_ids})
+        return lambda: self.client.post(url, body, content_type='application/json',
+                                        **{'HTTP_AUTHORIZATION': 'Basic 123'})
+
+    def test_check_votable(self, *_):
+        self.assertNoFullScans(self.get('voters:check_votable', ELIGIBLE_VOTER_PK))
+        self.assertNoFullScans(self.post('voters:check_votable_batch',
+                                         [ELIGIBLE_VOTER_PK, NON_EXIST_VOTER_PK]))
+
+    def test_get_voters(self, *_):
+        self.assertNoFullScans(self.get('voters:get_voters', STATION_PK, "Jam", "SW7 3BH"))
+        self.assertNoFullScans(self.get('voters:get_voters', STATION_PK, "J", "SW7 3BH"))
+        # The name search only reads the station's trigrams
+        self.assertUsesIndex(self.get('voters:get_voters', STATION_PK, "Jam", "SW7 3BH"),
+                             'trigram_station_voter_idx')
+
+    def test_make_voter_ineligible(self, *_):
+        self.assertNoFullScans(self.get('voters:make_voter_ineligible', ELIGIBLE_VOTER_PK))
+        self.assertNoFullScans(self.get('voters:make_voter_ineligible', INELIGIBLE_VOTER_PK))
+        self.assertNoFullScans(self.post('voters:make_voter_ineligible_batch',
+                                         [ELIGIBLE_VOTER_PK, INELIGIBLE_VOTER_PK]))
+
+    def test_set_voter_has_active_pin(self, *_):
+        self.assertNoFullScans(self.get('voters:set_voter_has_active_pin', ELIGIBLE_VOTER_PK))
+        self.assertNoFullScans(self.post('voters:set_voter_has_active_pin_batch',
+                                         [ELIGIBLE_VOTER_PK, NON_EXIST_VOTER_PK]))
+
+    def test_get_candidates(self, *_):
+        cache.clear()
+        self.assertNoFullScans(self.get('voters:get_candidates', STATION_PK))
+
+    def test_exports(self, *_):
+        self.assertNoFullScans(self.get('voters:export_voters', CONSTITUENCY_PK))
+        self.assertNoFullScans(self.get('voters:export_turnout'))
+
+    def test_detects_full_scans(self, *_):
+        with self.assertRaises(AssertionError):
+            self.assertNoFullScans(lambda: Voter.objects.filter(phone='+447654353205').exists())
+
+    def test_voter_turnout(self, *_):
+        self.assertNoFullScans(self.get('voters:voter_turnout'))
+
+    def test_record_turnout_history(self, *_):
+        record_turnout_history()
+        Voter.objects.mark_used_vote(ELIGIBLE_VOTER_PK)
+        self.assertNoFullScans(record_turnout_history)
+
+    def test_turnout_history(self, *_):
+        record_turnout_history()
+        self.assertNoFullScans(lambda: self.client.get(reverse('voters:turnout_history')))
+        self.assertNoFullScans(lambda: self.client.get(reverse('voters:turnout_history'), {
+            'level': 'station', 'constituency': CONSTITUENCY_PK}))
@@ -0,0 +1,97 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from django.core.cache import cache
+from django.db import router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from ..models import Voter
+from ..replicas import current_replica, pins_primary, read_from, replica_reads, sync_sqlite
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], READ_YOUR_WRITES_SECONDS=10)
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+        @replica_reads
+        def read_view(request):
+            return HttpResponse(Voter.objects.all().db)
+
+        @pins_primary
+        def write_view(request):
+            return HttpResponse(Voter.objects.all().db)
+
+        self.read_view, self.write_view = read_view, write_view
+
+    def request(self, view, client_id):
+        response = view(self.factory.get('/', HTTP_X_CLIENT_ID=client_id))
+        return response.content.decode('utf-8')
+
+    def test_router_sends_reads_to_current_replica(self):
+        self.assertEqual(router.db_for_read(Voter), 'default')
+        with read_from('replica'):
+            self.assertEqual(router.db_for_read(Voter), 'replica')
+            self.assertEqual(router.db_for_write(Voter), 'default')
+        self.assertIsNone(current_replica())
+        self.assertFalse(router.allow_migrate('replica', 'voters'))
+
+    def test_read_only_views_use_replica(self):
+        self.assertEqual(self.request(self.read_view, 'booth-1'), 'replica')
+        self.assertIsNone(current_replica())
+
+    def test_client_reads_its_writes_from_primary(self):
+        self.assertEqual(self.request(self.write_view, 'booth-1'), 'default')
+
+        self.assertEqual(self.request(self.read_view, 'booth-1'), 'default')
+        self.assertEqual(self.request(self.read_view, 'booth-2'), 'replica')
+
+    @override_settings(READ_YOUR_WRITES_SECONDS=0)
+    def test_pin_can_be_disabled(self):
+        self.request(self.write_view, 'booth-1')
+        self.assertEqual(self.request(self.read_view, 'booth-1'), 'replica')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_reads_stay_on_primary_without_replicas(self):
+        self.assertEqual(self.request(self.read_view, 'booth-1'), 'default')
+
+
+class SyncSqliteTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.source = os.path.join(self.directory, 'primary.sqlite3')
+        self.replica = os.path.join(self.directory, 'replica.sqlite3')
+
+    def execute(self, path, *statements):
+        connection = sqlite3.connect(path)
+        try:
+            for statement in statements:
+                rows = connection.execute(statement).fetchall()
+            connection.commit()
+            return rows
+        finally:
+            connection.close()
+
+    def test_copies_rows_and_follows_schema_changes(self):
+        self.execute(self.source,
+                     'CREATE TABLE voter (id INTEGER PRIMARY KEY, used_vote BOOL)',
+                     'CREATE INDEX voter_used_vote ON voter (used_vote)',
+                     'INSERT INTO voter VALUES (1, 0), (2, 1)')
+        self.assertEqual(sync_sqlite(self.source, self.replica), 2)
+        self.assertEqual(self.execute(self.replica, 'SELECT * FROM voter ORDER BY id'),
+                         [(1, 0), (2, 1)])
+
+        self.execute(self.source, 'UPDATE voter SET used_vote = 1 WHERE id = 1',
+                     'ALTER TABLE voter ADD COLUMN pin BOOL DEFAULT 0')
+        sync_sqlite(self.source, self.replica, [('journal_mode', 'WAL')])
+        self.assertEqual(self.execute(self.replica, 'SELECT * FROM voter ORDER BY id'),
+                         [(1, 1, 0), (2, 1, 0)])
+        self.assertEqual(self.execute(self.replica, "SELECT name FROM sqlite_master WHERE type = 'index'"),
+                         [('voter_used_vote',)])
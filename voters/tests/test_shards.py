@@ -0,0 +1,197 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from mock import patch
+
+from ..models import Constituency, Station, Voter, Party, Candidate, ConstituencyTurnout, \
+StationTurnout
+from ..shards import SHARD_ID_SPACE, check_settings, current_shard, shard_for_constituency, \
+shard_for_id, using_shard
+from ..turnout import rebuild_turnout, verify_turnout
+from .test_api import ALL_ROLES, RESPONSE_OK, streamed_content
+
+SHARDS = ['shard1', 'shard2']
+
+
+class ShardSettingsTests(SimpleTestCase):
+
+    @override_settings(DATABASE_SHARDS=SHARDS, DATABASE_REPLICAS=['replica1'])
+    def test_shards_and_replicas_are_refused_together(self):
+        with self.assertRaises(ImproperlyConfigured):
+            check_settings()
+
+    @override_settings(DATABASE_SHARDS=[], DATABASE_REPLICAS=['replica1'])
+    def test_replicas_alone_are_accepted(self):
+        check_settings()
+
+
+@patch('voters.api_key_verification.key_roles', return_value=ALL_ROLES)
+class ShardedRollTests(TransactionTestCase):
+    # Constituency 1 lives in shard2, constituency 2 in shard1
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        for alias in SHARDS:
+            connections.databases[alias] = dict(
+                connections.databases[DEFAULT_DB_ALIAS],
+                NAME=os.path.join(cls.directory, alias + '.sqlite3'))
+        cls.sharding = override_settings(DATABASE_SHARDS=SHARDS)
+        cls.sharding.enable()
+        for alias in SHARDS:
+            call_command('migrate', database=alias, verbosity=0)
+        super(ShardedRollTests, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(ShardedRollTests, cls).tearDownClass()
+        cls.sharding.disable()
+        for alias in SHARDS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.databases[alias]
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        cache.clear()
+        self.constituencies = [Constituency.objects.create(pk=pk, name='Constituency %d' % pk)
+                               for pk in (1, 2)]
+        self.stations = [Station.objects.create(name='Station %d' % c.pk, addr_line_1='',
+                                                postcode='SW7 3BH', constituency=c)
+                         for c in self.constituencies]
+        self.voters = [self.create_voter(station, used_vote)
+                       for station in self.stations for used_vote in (False, True)]
+
+    def tearDown(self):
+        for alias in SHARDS:
+            call_command('flush', database=alias, interactive=False, verbosity=0)
+
+    def create_voter(self, station, used_vote=False):
+        return Voter.objects.create(first_name='James', last_name='Bond', addr_line_1='',
+                                    postcode='SW7 3BH', date_of_birth=datetime.date(1970, 7, 7),
+                                    phone='+447654353205', station=station, used_vote=used_vote)
+
+    def get(self, name, *args):
+        return self.client.get(reverse('voters:' + name, args=args),
+                               HTTP_AUTHORIZATION='Basic 123')
+
+    def post_ids(self, name, voter_ids):
+        return self.client.post(reverse('voters:' + name), json.dumps({'voter_ids': voter_ids}),
+                                content_type='application/json',
+                                HTTP_AUTHORIZATION='Basic 123')
+
+    def test_rows_are_stored_in_their_constituency_shard(self, *_):
+        for station, alias in zip(self.stations, ['shard2', 'shard1']):
+            self.assertEqual(station._state.db, alias)
+            self.assertEqual(shard_for_id(station.pk), alias)
+            self.assertTrue(Station.objects.using(alias).filter(pk=station.pk).exists())
+            self.assertEqual(Voter.objects.using(alias).count(), 2)
+            self.assertEqual(StationTurnout.objects.using(alias).get().registered_voters, 2)
+        self.assertFalse(Voter.objects.using(DEFAULT_DB_ALIAS).exists())
+        self.assertEqual([shard_for_id(voter.pk) for voter in self.voters],
+                         ['shard2', 'shard2', 'shard1', 'shard1'])
+        self.assertGreater(self.voters[2].pk, SHARD_ID_SPACE)
+
+    def test_constituencies_are_mirrored_and_counted_in_their_shard(self, *_):
+        for alias in SHARDS:
+            self.assertEqual(Constituency.objects.using(alias).count(), 2)
+            self.assertEqual(list(ConstituencyTurnout.objects.using(alias).values_list(
+                'constituency', flat=True)), [2 if alias == 'shard1' else 1])
+        self.constituencies[0].delete()
+        self.assertEqual(Constituency.objects.using('shard1').count(), 1)
+        self.assertFalse(Station.objects.using('shard2').exists())
+
+    def test_router_follows_the_selected_shard(self, *_):
+        self.assertEqual(router.db_for_read(Voter), DEFAULT_DB_ALIAS)
+        with using_shard('shard1'):
+            self.assertEqual(router.db_for_read(Voter), 'shard1')
+            self.assertEqual(router.db_for_write(Party), DEFAULT_DB_ALIAS)
+        self.assertIsNone(current_shard())
+        self.assertEqual(shard_for_constituency(3), 'shard2')
+        self.assertFalse(router.allow_migrate('shard1', 'auth'))
+        self.assertTrue(router.allow_migrate('shard1', 'voters', model_name='voter'))
+        self.assertTrue(router.allow_migrate('shard1', 'voters', model_name='party'))
+
+    def test_voter_cannot_move_to_another_shard(self, *_):
+        voter = self.voters[0]
+        voter.station = Station.objects.using('shard1').get()
+        with self.assertRaises(ValueError):
+            voter.save()
+
+    def test_single_voter_views_route_on_the_voter_id(self, *_):
+        eligible, ineligible = self.voters[2:]
+        def check(pk):
+            return json.loads(self.get('check_votable', pk).content.decode('utf-8'))
+
+        self.assertEqual(check(eligible.pk), {'voter_exists': True, 'used_vote': False})
+        self.assertEqual(check(ineligible.pk), {'voter_exists': True, 'used_vote': True})
+        self.assertFalse(check(SHARD_ID_SPACE + 99)['voter_exists'])
+
+        response = self.get('make_voter_ineligible', eligible.pk)
+
+        self.assertTrue(json.loads(response.content.decode('utf-8'))['changed'])
+        self.assertTrue(Voter.objects.using('shard1').get(pk=eligible.pk).used_vote)
+        self.assertEqual(ConstituencyTurnout.objects.using('shard1').get().voted, 2)
+
+    def test_station_views_route_on_the_station_id(self, *_):
+        station = self.stations[1]
+        Candidate.objects.create(first_name='Jeremy', last_name='Corbyn',
+                                 constituency=self.constituencies[1],
+                                 party=Party.objects.create(name='Labour'))
+
+        voters = json.loads(streamed_content(
+            self.get('get_voters', station.pk, 'James', 'SW7 3BH')))
+        candidates = json.loads(self.get('get_candidates', station.pk).content.decode('utf-8'))
+
+        self.assertEqual(sorted(voter['pk'] for voter in voters['voters']),
+                         [voter.pk for voter in self.voters[2:]])
+        self.assertEqual([candidate['fields']['constituency'] for candidate in
+                          candidates['candidates']], ['Constituency 2'])
+
+    def test_batch_endpoints_span_shards(self, *_):
+        voter_ids = [voter.pk for voter in self.voters] + [SHARD_ID_SPACE + 99]
+
+        response = self.post_ids('make_voter_ineligible_batch', voter_ids)
+
+        self.assertEqual(response.status_code, RESPONSE_OK)
+        outcomes = json.loads(response.content.decode('utf-8'))['voters']
+        self.assertEqual([outcomes[str(pk)] for pk in voter_ids],
+                         ['changed', 'already_set', 'changed', 'already_set', 'not_found'])
+        checked = json.loads(self.post_ids('check_votable_batch', voter_ids)
+                             .content.decode('utf-8'))['voters']
+        self.assertEqual([checked[str(pk)]['used_vote'] for pk in voter_ids],
+                         [True, True, True, True, None])
+
+    def test_voter_turnout_merges_every_shard(self, *_):
+        self.create_voter(self.stations[1])
+
+        turnout = json.loads(self.get('voter_turnout').content.decode('utf-8'))['turnout']
+
+        self.assertEqual(turnout, [
+            {'constituency': 'Constituency 1', 'voted': 1, 'registered_voters': 2},
+            {'constituency': 'Constituency 2', 'voted': 1, 'registered_voters': 3}])
+
+    def test_export_turnout_reads_every_shard(self, *_):
+        rows = streamed_content(self.get('export_turnout')).splitlines()
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(sorted(int(row.split(',')[2]) for row in rows[1:]),
+                         sorted(station.pk for station in self.stations))
+
+    def test_turnout_rebuilds_per_shard(self, *_):
+        StationTurnout.objects.using('shard1').update(voted=5)
+
+        self.assertEqual(len(verify_turnout()), 1)
+        station_counts, constituency_counts = rebuild_turnout()
+
+        self.assertEqual(verify_turnout(), [])
+        self.assertEqual(constituency_counts, {1: (2, 1), 2: (2, 1)})
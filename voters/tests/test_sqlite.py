@@ -0,0 +1,15 @@
+from django.db import connection
+from django.test import TestCase
+
+
+class SqlitePragmaTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA %s' % name)
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_to_connection(self):
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('cache_size'), -64000)
+        # temp_store=MEMORY is reported as 2
+        self.assertEqual(self.pragma('temp_store'), 2)
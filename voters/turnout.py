@@ -0,0 +1,167 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Case, Count, IntegerField, OuterRef, Subquery, Sum, When
+from django.utils import timezone
+
+from .models import Constituency, Station, Voter, ConstituencyTurnout, \
+StationTurnout, ConstituencyTurnoutHistory, StationTurnoutHistory
+from .shards import all_shards, current_shard, shard_for_constituency, using_shard
+
+# level -> (history model, counter model, key of the station / constituency)
+HISTORY_LEVELS = {
+    'station': (StationTurnoutHistory, StationTurnout, 'station'),
+    'constituency': (ConstituencyTurnoutHistory, ConstituencyTurnout, 'constituency'),
+}
+
+
+def count_station_turnout():
+    """
+    Count registered voters and votes cast for every station of the current
+    shard straight from the Voter table. Returns {station_id:
+    (registered_voters, voted)}.
+    """
+    counts = dict((station_id, (0, 0)) for station_id in
+                  Station.objects.values_list('pk', flat=True))
+    rows = Voter.objects.order_by().values('station').annotate(
+        registered_voters=Count('pk'),
+        voted=Sum(Case(When(used_vote=True, then=1), default=0,
+                       output_field=IntegerField())))
+    for row in rows:
+        counts[row['station']] = (row['registered_voters'], row['voted'])
+    return counts
+
+
+def count_constituency_turnout(station_counts):
+    """
+    Roll station counts up to {constituency_id: (registered_voters, voted)}
+    for the constituencies of the current shard.
+    """
+    shard = current_shard() or DEFAULT_DB_ALIAS
+    counts = dict((constituency_id, (0, 0)) for constituency_id in
+                  Constituency.objects.values_list('pk', flat=True)
+                  if shard_for_constituency(constituency_id) == shard)
+    for station_id, constituency_id in Station.objects.values_list('pk', 'constituency'):
+        registered, voted = station_counts.get(station_id, (0, 0))
+        total_registered, total_voted = counts[constituency_id]
+        counts[constituency_id] = (total_registered + registered, total_voted + voted)
+    return counts
+
+
+def rebuild_turnout():
+    """
+    Replace every turnout counter with a fresh count from the Voter table,
+    one transaction per shard.
+    """
+    station_counts, constituency_counts = {}, {}
+    for alias in all_shards():
+        with using_shard(alias), transaction.atomic(using=alias):
+            stations = count_station_turnout()
+            constituencies = count_constituency_turnout(stations)
+            StationTurnout.objects.all().delete()
+            ConstituencyTurnout.objects.all().delete()
+            StationTurnout.objects.bulk_create(
+                StationTurnout(station_id=pk, registered_voters=registered, voted=voted)
+                for pk, (registered, voted) in stations.items())
+            ConstituencyTurnout.objects.bulk_create(
+                ConstituencyTurnout(constituency_id=pk, registered_voters=registered, voted=voted)
+                for pk, (registered, voted) in constituencies.items())
+        station_counts.update(stations)
+        constituency_counts.update(constituencies)
+    return station_counts, constituency_counts
+
+
+def verify_turnout():
+    """
+    Compare the stored counters against the Voter table. Returns a list of
+    (label, expected, stored) tuples, one per counter that has drifted.
+    """
+    station_counts, constituency_counts = {}, {}
+    stored_stations, stored_constituencies = {}, {}
+    for alias in all_shards():
+        with using_shard(alias), transaction.atomic(using=alias):
+            stations = count_station_turnout()
+            station_counts.update(stations)
+            constituency_counts.update(count_constituency_turnout(stations))
+            stored_stations.update(
+                (row[0], row[1:]) for row in
+                StationTurnout.objects.values_list('station', 'registered_voters', 'voted'))
+            stored_constituencies.update(
+                (row[0], row[1:]) for row in
+                ConstituencyTurnout.objects.values_list('constituency', 'registered_voters',
+                                                        'voted'))
+
+    mismatches = []
+    for label, expected, stored in (('station', station_counts, stored_stations),
+                                    ('constituency', constituency_counts, stored_constituencies)):
+        for pk in sorted(set(expected) | set(stored)):
+            if expected.get(pk) != stored.get(pk):
+                mismatches.append(('%s %s' % (label, pk), expected.get(pk), stored.get(pk)))
+    return mismatches
+
+
+def minute_bucket(when):
+    return when.replace(second=0, microsecond=0)
+
+
+def record_turnout_history(now=None):
+    """
+    Copy the counters of every station and constituency whose counts have
+    changed since they were last recorded into the history bucket for the
+    current minute, replacing any recorded earlier in the same minute.
+    Returns the number of rows written.
+    """
+    minute = minute_bucket(now or timezone.now())
+    written = 0
+    for alias in all_shards():
+        with using_shard(alias), transaction.atomic(using=alias):
+            written += record_shard_history(minute)
+    return written
+
+
+def record_shard_history(minute):
+    """record_turnout_history for the current shard."""
+    written = 0
+    for history, counters, key in HISTORY_LEVELS.values():
+        # The most recent row of each station / constituency, found from the
+        # counter rows with one (key, minute) index lookup apiece
+        last = history.objects.filter(**{key: OuterRef(key)}).order_by('-minute').values('pk')[:1]
+        latest = history.objects.filter(
+            pk__in=counters.objects.annotate(last=Subquery(last)).values('last'))
+        recorded = dict((row[0], row[1:]) for row in
+                        latest.values_list(key, 'minute', 'registered_voters', 'voted'))
+        changed = [row for row in counters.objects.values_list(key, 'registered_voters', 'voted')
+                   if recorded.get(row[0], (None,))[1:] != row[1:]]
+        replaced = [row[0] for row in changed if recorded.get(row[0], (None,))[0] == minute]
+        for start in range(0, len(replaced), settings.VOTER_BATCH_MAX_SIZE):
+            history.objects.filter(minute=minute, **{
+                key + '__in': replaced[start:start + settings.VOTER_BATCH_MAX_SIZE]}).delete()
+        history.objects.bulk_create(
+            history(minute=minute, registered_voters=registered, voted=voted,
+                    **{key + '_id': pk})
+            for pk, registered, voted in changed)
+        written += len(changed)
+    return written
+
+
+def turnout_series(level, start, end, constituency_id=None):
+    """
+    The recorded history of every station or constituency (level) between
+    the minutes start and end, from one range query per shard. Returns a list of
+    (pk, name, [(minute, registered_voters, voted), ...]) ordered by pk;
+    each series only has the minutes in which its counts changed.
+    """
+    history, _, key = HISTORY_LEVELS[level]
+    shards = all_shards() if constituency_id is None else [shard_for_constituency(constituency_id)]
+    series = []
+    for alias in shards:
+        rows = history.objects.filter(minute__gte=minute_bucket(start), minute__lte=end)
+        if constituency_id is not None:
+            rows = rows.filter(**{'constituency' if level == 'constituency'
+                                  else 'station__constituency': constituency_id})
+        with using_shard(alias):
+            for pk, name, minute, registered, voted in rows.order_by(key, 'minute').values_list(
+                    key, key + '__name', 'minute', 'registered_voters', 'voted'):
+                if not series or series[-1][0] != pk:
+                    series.append((pk, name, []))
+                series[-1][2].append((minute, registered, voted))
+    return sorted(series, key=lambda entry: entry[0])
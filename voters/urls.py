@@ -10,14 +10,25 @@ app_name = 'voters'
 urlpatterns = [
     url(r'^$', views.index, name='index'),
     url(r'^voter_turnout/$', views.voter_turnout, name='voter_turnout'),
+    url(r'^voter_turnout/history/$', views.turnout_history, name='turnout_history'),
     url(r'^check_votable/(?P<voter_id>' + ID_REGEX + ')/$',
         views.check_votable, name='check_votable'),
+    url(r'^check_votable/batch/$',
+        views.check_votable_batch, name='check_votable_batch'),
     url(r'^get_voters/station_id/(?P<station_id>' + ID_REGEX + ')/voter_name/(?P<voter_name>' + NAME_REGEX + ')/postcode/(?P<postcode>' +
         POSTCODE_REGEX + ')/$', views.get_voters, name='get_voters'),
     url(r'^make_voter_ineligible/(?P<voter_id>' + ID_REGEX + ')/$',
         views.make_voter_ineligible, name='make_voter_ineligible'),
+    url(r'^make_voter_ineligible/batch/$',
+        views.make_voter_ineligible_batch, name='make_voter_ineligible_batch'),
     url(r'^set_voter_has_active_pin/(?P<voter_id>' + ID_REGEX + ')/$',
         views.set_voter_has_active_pin, name='set_voter_has_active_pin'),
+    url(r'^set_voter_has_active_pin/batch/$',
+        views.set_voter_has_active_pin_batch, name='set_voter_has_active_pin_batch'),
     url(r'^get_candidates/(?P<station_id>' + ID_REGEX + ')/$',
-        views.get_candidates, name='get_candidates')
+        views.get_candidates, name='get_candidates'),
+    url(r'^export/voters/(?P<constituency_id>' + ID_REGEX + ')/$',
+        views.export_voters, name='export_voters'),
+    url(r'^export/turnout/$', views.export_turnout, name='export_turnout'),
+    url(r'^metrics$', views.metrics, name='metrics'),
 ]
@@ -1,24 +1,53 @@
+import hashlib
 import json
 import datetime
 
 from functools import partial
 
-from django.core import serializers
-from django.http import JsonResponse, HttpResponse, HttpResponseForbidden
+from django.conf import settings
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, \
+StreamingHttpResponse
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils import six
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.text import compress_sequence
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
-from .models import Voter, Candidate, Station, Constituency
-from .api_key_verification import verify, has_check_votable_permissions,\
-has_get_voters_permissions, has_make_voter_ineligible_permissions, \
-has_get_candidates_permissions, has_set_voter_has_active_pin_permissions
+from .models import Voter, ConstituencyTurnout, CHANGED, MAX_ID, NOT_FOUND, normalize_postcode
+from .bitmap import lookup_voter
+from .candidates import candidates_for_station, selection_key
+from .streaming import StreamingJsonResponse
+from .export import VOTER_COLUMNS, TURNOUT_COLUMNS, csv_pages, voter_pages, turnout_pages
+from .group_commit import mark_voter
+from .metrics import collect_metrics, prometheus_text
+from .microcache import micro_cached
+from .pagination import parse_page
+from .projection import VOTER_PROJECTION, CANDIDATE_PROJECTION, parse_projection, json_body
+from .replicas import replica_reads, pins_primary
+from .shards import all_shards, group_by_shard, routed_by, using_shard
+from .turnout import HISTORY_LEVELS, turnout_series
+from .api_key_verification import verify, CHECK_VOTABLE_ROLES, GET_VOTERS_ROLES, \
+MAKE_VOTER_INELIGIBLE_ROLES, GET_CANDIDATES_ROLES, SET_VOTER_HAS_ACTIVE_PIN_ROLES, \
+EXPORT_ROLES, METRICS_ROLES
 
 
 def index(request):
     return HttpResponse("The Voter API is online.")
 
 
-@verify(lambda: has_check_votable_permissions)
+@verify(CHECK_VOTABLE_ROLES)
+@replica_reads
+@routed_by('voter_id')
 def check_votable(request, voter_id):
+    # The bitmap is only trusted for voters it knows; "does not exist" is
+    # always confirmed against the database.
+    flags = lookup_voter(voter_id)
+    if flags is not None and flags[0]:
+        return JsonResponse({'voter_exists': True,
+                             'used_vote': flags[1]})
     try:
         voter = Voter.objects.get(pk=voter_id)
         return JsonResponse({'voter_exists': True,
@@ -27,63 +56,253 @@ def check_votable(request, voter_id):
         return JsonResponse({'voter_exists': False,
                              'used_vote': None})
 
-@verify(lambda: has_get_voters_permissions)
+def parse_voter_ids(request):
+    """
+    Read {"voter_ids": [...]} from a batch request body. Raises ValueError
+    if the body is malformed, holds an id outside 1..MAX_ID or more than
+    VOTER_BATCH_MAX_SIZE ids.
+    """
+    try:
+        voter_ids = json.loads(request.body.decode('utf-8'))['voter_ids']
+    except (UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise ValueError('Expected a JSON body of the form {"voter_ids": [...]}.')
+    if not isinstance(voter_ids, list) or \
+            any(isinstance(pk, bool) or not isinstance(pk, six.integer_types)
+                for pk in voter_ids):
+        raise ValueError('voter_ids must be a list of integers.')
+    if any(not 0 < pk <= MAX_ID for pk in voter_ids):
+        raise ValueError('voter_ids must be between 1 and %d.' % MAX_ID)
+    if len(voter_ids) > settings.VOTER_BATCH_MAX_SIZE:
+        raise ValueError('At most %d voter_ids per request.' % settings.VOTER_BATCH_MAX_SIZE)
+    return voter_ids
+
+
+@csrf_exempt
+@require_POST
+@verify(CHECK_VOTABLE_ROLES)
+@replica_reads
+def check_votable_batch(request):
+    try:
+        voter_ids = parse_voter_ids(request)
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+
+    used_votes = {}
+    unknown = []
+    for pk in voter_ids:
+        flags = lookup_voter(pk)
+        if flags is not None and flags[0]:
+            used_votes[pk] = flags[1]
+        else:
+            unknown.append(pk)
+    for alias, shard_ids in group_by_shard(unknown).items():
+        with using_shard(alias):
+            used_votes.update(Voter.objects.filter(pk__in=shard_ids).values_list('pk', 'used_vote'))
+    return JsonResponse({'voters': dict(
+        (str(pk), {'voter_exists': pk in used_votes,
+                   'used_vote': used_votes.get(pk)})
+        for pk in voter_ids)})
+
+@verify(GET_VOTERS_ROLES)
+@replica_reads
+@routed_by('station_id')
 def get_voters(request, station_id, voter_name, postcode):
+    try:
+        fields, output_format = parse_projection(request.GET, VOTER_PROJECTION)
+        page = parse_page(request.GET)
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
     voters = Voter.objects.filter(
-        station=station_id, first_name__icontains=voter_name, postcode__iexact=postcode)
-    voters_json = json.loads(serializers.serialize("json", voters))
-    return JsonResponse({'success': voters.count() > 0,
-                         'voters': voters_json})
+        station=station_id, postcode_key=normalize_postcode(postcode)).name_contains(
+            voter_name, station=station_id)
+    return StreamingJsonResponse(json_body('voters', VOTER_PROJECTION, voters,
+                                           fields, output_format, page))
+
+def flag_update_response(outcome):
+    # 'changed' is False when the voter had already voted / already had a
+    # PIN, which is how callers detect a second attempt.
+    return JsonResponse({'success': outcome != NOT_FOUND,
+                         'changed': outcome == CHANGED})
 
-@verify(lambda: has_make_voter_ineligible_permissions)
+
+@verify(MAKE_VOTER_INELIGIBLE_ROLES)
+@pins_primary
 def make_voter_ineligible(request, voter_id):
-    try:
-        voter = Voter.objects.get(pk=voter_id)
-        voter.used_vote = True
-        voter.save()
-        return JsonResponse({'success': True})
-    except ObjectDoesNotExist:
-        return JsonResponse({'success': False})
+    return flag_update_response(mark_voter(voter_id, 'used_vote'))
 
 
-@verify(lambda: has_set_voter_has_active_pin_permissions)
+@verify(SET_VOTER_HAS_ACTIVE_PIN_ROLES)
+@pins_primary
 def set_voter_has_active_pin(request, voter_id):
+    return flag_update_response(mark_voter(voter_id, 'active_pin'))
+
+
+def flag_batch_response(outcomes):
+    return JsonResponse({'voters': dict(
+        (str(pk), outcome) for pk, outcome in outcomes.items())})
+
+
+@csrf_exempt
+@require_POST
+@verify(MAKE_VOTER_INELIGIBLE_ROLES)
+@pins_primary
+def make_voter_ineligible_batch(request):
     try:
-        voter = Voter.objects.get(pk=voter_id)
-        voter.active_pin = True
-        voter.save()
-        return JsonResponse({'success': True})
-    except ObjectDoesNotExist:
-        return JsonResponse({'success': False})
+        voter_ids = parse_voter_ids(request)
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    return flag_batch_response(Voter.objects.mark_used_votes(voter_ids))
 
 
-@verify(lambda: has_get_candidates_permissions)
-def get_candidates(request, station_id):
+@csrf_exempt
+@require_POST
+@verify(SET_VOTER_HAS_ACTIVE_PIN_ROLES)
+@pins_primary
+def set_voter_has_active_pin_batch(request):
     try:
-        constituency = Station.objects.get(pk=station_id).constituency.pk
-        candidates = Candidate.objects.filter(constituency=constituency)
-        candidates_json = json.loads(serializers.serialize(
-            "json", candidates, use_natural_foreign_keys=True))
+        voter_ids = parse_voter_ids(request)
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    return flag_batch_response(Voter.objects.mark_active_pins(voter_ids))
 
-        return JsonResponse({'success': candidates.count() > 0,
-                             'candidates': candidates_json})
-    except ObjectDoesNotExist:
+
+def conditional_json_response(request, etag, content):
+    """The JSON content, or 304 Not Modified if the client already has it."""
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+
+@verify(GET_CANDIDATES_ROLES)
+@routed_by('station_id')
+def get_candidates(request, station_id):
+    try:
+        fields, output_format = parse_projection(request.GET, CANDIDATE_PROJECTION)
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    cached = micro_cached('candidates:%s:%s' % (station_id, selection_key(fields, output_format)),
+                          partial(candidates_for_station, station_id, fields, output_format))
+    if cached is None:
         return JsonResponse({'success': False,
                              'candidates': []})
+    return conditional_json_response(request, *cached)
+
+
+def render_turnout():
+    # The counters are maintained alongside every Voter write, so this is a
+    # single read (per shard) rather than two COUNT(*) queries per station.
+    rows = []
+    for alias in all_shards():
+        with using_shard(alias):
+            rows.extend(ConstituencyTurnout.objects.values_list(
+                'constituency', 'constituency__name', 'voted', 'registered_voters'))
+    turnout = [{'constituency' : name,
+                'voted' : voted,
+                'registered_voters' : registered_voters}
+               for _, name, voted, registered_voters in sorted(rows)]
+    content = json.dumps({'turnout' : turnout}).encode('utf-8')
+    return '"%s"' % hashlib.md5(content).hexdigest(), content
 
+
+@replica_reads
 def voter_turnout(request):
-    constituencies = Constituency.objects.all()
-    turnout = []
-
-    for constituency in constituencies:
-        registered_voters = 0
-        num_voted = 0
-        stations = Station.objects.filter(constituency=constituency)
-        for station in stations:
-            registered_voters += Voter.objects.filter(station=station).count()
-            num_voted += Voter.objects.filter(used_vote=True, station=station).count()
-        turnout.append({'constituency' : str(constituency),
-                        'voted' : num_voted,
-                        'registered_voters' : registered_voters})
-
-    return JsonResponse({'turnout' : turnout})
+    return conditional_json_response(request, *micro_cached('voter_turnout', render_turnout))
+
+
+def parse_history_query(query):
+    """
+    Read level, from, to and constituency from a turnout_history query
+    string. from and to are ISO 8601 times (UTC unless an offset is given)
+    and default to the last TURNOUT_HISTORY_DEFAULT_SECONDS. Raises
+    ValueError if any of them is invalid or the range is too long.
+    """
+    level = query.get('level', 'constituency')
+    if level not in HISTORY_LEVELS:
+        raise ValueError('level must be one of: %s.' % ', '.join(sorted(HISTORY_LEVELS)))
+    times = {}
+    for name in ('from', 'to'):
+        if query.get(name):
+            value = parse_datetime(query[name])
+            if value is None:
+                raise ValueError('%s must be an ISO 8601 date and time.' % name)
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value, timezone.utc)
+            times[name] = value
+    end = times.get('to') or timezone.now()
+    start = times.get('from') or end - datetime.timedelta(
+        seconds=settings.TURNOUT_HISTORY_DEFAULT_SECONDS)
+    if not datetime.timedelta(0) <= end - start <= datetime.timedelta(
+            seconds=settings.TURNOUT_HISTORY_MAX_SECONDS):
+        raise ValueError('from must be before to, and at most %d seconds before it.'
+                         % settings.TURNOUT_HISTORY_MAX_SECONDS)
+    constituency_id = query.get('constituency')
+    if constituency_id is not None:
+        if not constituency_id.isdigit():
+            raise ValueError('constituency must be a constituency id.')
+        constituency_id = int(constituency_id)
+    return level, start, end, constituency_id
+
+
+@replica_reads
+def turnout_history(request):
+    # Counts as recorded by record_turnout_history: a point per minute in
+    # which a station's or constituency's counts changed.
+    try:
+        level, start, end, constituency_id = parse_history_query(request.GET)
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    series = turnout_series(level, start, end, constituency_id)
+    return JsonResponse({'level': level,
+                         'from': start,
+                         'to': end,
+                         'fields': ['minute', 'registered_voters', 'voted'],
+                         'series': [{level: pk, 'name': name, 'points': points}
+                                    for pk, name, points in series]})
+
+
+def accepts_gzip(request):
+    """Whether Accept-Encoding allows gzip; a q-value of 0 refuses it."""
+    qualities = {}
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = coding.split(';')
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[params[0].strip().lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0)) > 0
+
+
+def csv_response(request, filename, content):
+    """Stream CSV chunks, gzipped if the client accepts it."""
+    gzip = accepts_gzip(request)
+    response = StreamingHttpResponse(compress_sequence(content) if gzip else content,
+                                     content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+@verify(EXPORT_ROLES)
+def export_voters(request, constituency_id):
+    return csv_response(request, 'voters-%s.csv' % constituency_id,
+                        csv_pages(VOTER_COLUMNS, voter_pages(constituency_id)))
+
+
+@verify(EXPORT_ROLES)
+def export_turnout(request):
+    return csv_response(request, 'turnout.csv', csv_pages(TURNOUT_COLUMNS, turnout_pages()))
+
+
+@verify(METRICS_ROLES)
+def metrics(request):
+    return HttpResponse(prometheus_text(collect_metrics()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')